@@ -0,0 +1,98 @@
+"""
+Import-time regression check for the entry points.
+
+Each entry point is imported in a fresh interpreter under `python -X importtime`.
+The check fails if an import exceeds its time budget, or if it pulls in a
+dependency that must only be loaded on first use (spaCy, google-genai).
+
+Usage:
+    python check_import_time.py
+"""
+
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Module -> (directory to import it from, budget in milliseconds)
+ENTRY_POINTS = {
+    "final_experiments": (REPO_ROOT, 500),
+    "final_eval": (REPO_ROOT, 500),
+    "email_classifier": (os.path.join(REPO_ROOT, "tryout"), 1000),
+}
+
+# Packages that must not be imported until they are needed
+DEFERRED_PACKAGES = ("spacy", "google.genai")
+
+
+def measure_import(module: str, cwd: str) -> Tuple[float, Dict[str, int]]:
+    """
+    Import a module in a fresh interpreter and collect -X importtime output.
+
+    Args:
+        module: Module to import
+        cwd: Directory to run the interpreter in
+
+    Returns:
+        Tuple of (cumulative import time of the module in milliseconds,
+        dictionary of every imported module name to its cumulative microseconds)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imported[name.strip()] = int(cumulative)
+    return imported.get(module, 0) / 1000, imported
+
+
+def check_entry_point(module: str, cwd: str, budget_ms: float) -> Tuple[float, List[str]]:
+    """
+    Measure one entry point against its budget and the deferred packages.
+
+    Args:
+        module: Module to import
+        cwd: Directory to run the interpreter in
+        budget_ms: Import-time budget in milliseconds
+
+    Returns:
+        Tuple of (import time in milliseconds, list of failure messages)
+    """
+    elapsed_ms, imported = measure_import(module, cwd)
+    failures = []
+    if elapsed_ms > budget_ms:
+        failures.append(f"{module} took {elapsed_ms:.0f} ms (budget {budget_ms} ms)")
+    deferred = [package for package in DEFERRED_PACKAGES
+                if any(name == package or name.startswith(package + ".") for name in imported)]
+    if deferred:
+        failures.append(f"{module} imports {', '.join(deferred)} at import time")
+    return elapsed_ms, failures
+
+
+def main() -> int:
+    failures = []
+    for module, (cwd, budget_ms) in ENTRY_POINTS.items():
+        elapsed_ms, module_failures = check_entry_point(module, cwd, budget_ms)
+        failures.extend(module_failures)
+        print(f"{module:20} {elapsed_ms:8.1f} ms  (budget {budget_ms} ms)  {'failed' if module_failures else 'ok'}")
+
+    if failures:
+        print("\nImport-time check failed:")
+        for failure in failures:
+            print(f"- {failure}")
+        return 1
+    print("\nImport-time check passed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Gemini context caching for static system instructions.
+
+The classification instruction (PROMPT_CLASSIFICATION plus the few-shot
+examples) is identical for every email in an experiment configuration. This
+module uploads it once per (model, instruction) as a Gemini cached content
+and hands out the cache name so each call only sends the email itself.
+Entries are refreshed shortly before they expire and recreated if the server
+no longer knows them.
+
+The manager only relies on `client.caches.create/update/delete`, so any
+client exposing that surface (including a local fake) can be used. The
+google-genai types are imported on first use to keep imports cheap.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+DEFAULT_TTL_SECONDS = int(os.getenv("EMAILLM_CONTEXT_CACHE_TTL", "3600"))
+DEFAULT_REFRESH_MARGIN_SECONDS = 300
+
+
+def is_uncacheable_error(error: Exception) -> bool:
+    """
+    Whether caches.create refused the instruction itself (400 INVALID_ARGUMENT,
+    e.g. below the minimum token count) rather than failing transiently.
+    """
+    if getattr(error, "code", None) == 400 or getattr(error, "status_code", None) == 400:
+        return True
+    message = f"{getattr(error, 'status', '')} {error}".upper()
+    return "INVALID_ARGUMENT" in message or ("MINIMUM" in message and "TOKEN" in message)
+
+
+class _CacheEntry:
+    def __init__(self, name: Optional[str], expires_at: float):
+        self.name = name
+        self.expires_at = expires_at
+
+
+class ContextCacheManager:
+    """
+    Create, refresh and release Gemini cached contents keyed by
+    (model, instruction).
+
+    If the API refuses to cache an instruction (for example because it is
+    below the model's minimum cacheable size), the key is remembered as
+    uncacheable and callers get None, meaning "send the instruction inline".
+    Other failures (throttling, server errors) also return None but are not
+    remembered, so the next call tries to create the cache again.
+    """
+
+    def __init__(self, ttl_seconds: int = DEFAULT_TTL_SECONDS, refresh_margin_seconds: int = DEFAULT_REFRESH_MARGIN_SECONDS, clock=time.time):
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.clock = clock
+        self._entries: Dict[Tuple[str, str], _CacheEntry] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model: str, instruction: str) -> Tuple[str, str]:
+        return model, hashlib.sha256(instruction.encode("utf-8")).hexdigest()
+
+    def get_cache_name(self, client, model: str, instruction: str) -> Optional[str]:
+        """
+        Return the cached content name for an instruction, creating or
+        refreshing it as needed.
+
+        Args:
+            client: The generative AI client
+            model: The model the cache is created for
+            instruction: The system instruction to cache
+
+        Returns:
+            The cached content name, or None if the instruction cannot be cached
+        """
+        key = self._key(model, instruction)
+        entry = self._entries.get(key)
+        # Fast path: a fresh entry needs no lock
+        if entry is not None and (entry.name is None or self.clock() < entry.expires_at - self.refresh_margin_seconds):
+            return entry.name
+
+        with self._lock:
+            entry = self._entries.get(key)
+            now = self.clock()
+            if entry is not None and entry.name is None:
+                return None
+            if entry is not None and now < entry.expires_at - self.refresh_margin_seconds:
+                return entry.name
+            if entry is not None and now < entry.expires_at:
+                from google.genai import types
+                try:
+                    client.caches.update(
+                        name=entry.name,
+                        config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+                    )
+                    entry.expires_at = now + self.ttl_seconds
+                    return entry.name
+                except Exception as e:
+                    print(f"Error refreshing context cache {entry.name}: {str(e)}")
+            return self._create(client, model, instruction, key, now)
+
+    def _create(self, client, model: str, instruction: str, key: Tuple[str, str], now: float) -> Optional[str]:
+        from google.genai import types
+        try:
+            cache = client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=instruction,
+                    ttl=f"{self.ttl_seconds}s",
+                    display_name=f"emaillm-{key[1][:16]}"
+                )
+            )
+            print(f"Created context cache {cache.name} for {len(instruction)} characters of instruction")
+            self._entries[key] = _CacheEntry(cache.name, now + self.ttl_seconds)
+            return cache.name
+        except Exception as e:
+            if not is_uncacheable_error(e):
+                print(f"Error creating context cache, sending the instruction inline: {str(e)}")
+                return None
+            print(f"Context caching unavailable for this instruction, sending it inline: {str(e)}")
+            self._entries[key] = _CacheEntry(None, float("inf"))
+            return None
+
+    def invalidate(self, model: str, instruction: str) -> None:
+        """
+        Forget the cache for an instruction, e.g. after the server rejected
+        its name. The next call creates a new one.
+        """
+        with self._lock:
+            self._entries.pop(self._key(model, instruction), None)
+
+    def release_all(self, client) -> None:
+        """
+        Delete every cache created by this manager so it stops accruing
+        storage charges.
+
+        Args:
+            client: The generative AI client
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            if entry.name is None:
+                continue
+            try:
+                client.caches.delete(name=entry.name)
+            except Exception as e:
+                print(f"Error deleting context cache {entry.name}: {str(e)}")
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_context_cache() -> ContextCacheManager:
+    """Return the shared context cache manager, creating it on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ContextCacheManager()
+        return _manager
@@ -0,0 +1,258 @@
+"""
+Importer for raw "From:/Subject:/Date:" email exports such as data/Emory_Report.txt.
+
+Each message in an export starts with a header block:
+
+    From: Sender Name <sender@emory.edu>
+    Subject: ...
+    Date: ...
+
+followed by the body, optionally ending with SEPARATOR_KEYWORD. Messages are
+turned into the JSON schema of data/Emory_Report.json (sender_name,
+sender_email, subject, date, content).
+
+The file is memory-mapped and cut into byte ranges that are parsed on a process
+pool. A range owns every message whose header starts inside it; the last of
+them runs on into the next range up to the next header. At most two ranges per
+worker are in flight and records are written in file order as each completes,
+so memory stays bounded by those ranges rather than the whole export.
+
+Usage:
+    python email_import.py data/Emory_Report.txt data/Emory_Report.json
+    python email_import.py export.txt export.jsonl --workers 8
+    python email_import.py --benchmark --copies 200
+"""
+
+import argparse
+import json
+import mmap
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from email_reader import SEPARATOR_KEYWORD
+
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024  # bytes per parsing task
+
+# A message boundary is a full From/Subject/Date header block at the start of
+# a line, so a body line that happens to start with "From: " does not split it
+HEADER_PATTERN = re.compile(
+    rb"^From: ([^\n]*)\nSubject: ([^\n]*)\nDate: ([^\n]*)\n",
+    re.MULTILINE
+)
+
+SENDER_PATTERN = re.compile(r"^(.*?)\s*<([^<>]+)>\s*$")
+
+
+def parse_sender(sender: str) -> Tuple[str, str]:
+    """
+    Split a From header value into name and address.
+
+    Args:
+        sender: Header value, e.g. 'Emory Communications <emorycommunications@emory.edu>'
+
+    Returns:
+        Tuple of (sender_name, sender_email); the name is kept as written
+    """
+    match = SENDER_PATTERN.match(sender.strip())
+    if match:
+        return match.group(1), match.group(2).strip()
+    if "@" in sender:
+        return "", sender.strip()
+    return sender.strip(), ""
+
+
+def parse_message(data: bytes, match: "re.Match", end: int) -> Dict[str, str]:
+    """
+    Build a record from one message.
+
+    Args:
+        data: Buffer holding the export
+        match: HEADER_PATTERN match at the start of the message
+        end: Offset where the message ends
+
+    Returns:
+        Email record in the data/Emory_Report.json schema
+    """
+    sender_name, sender_email = parse_sender(match.group(1).decode("utf-8", errors="replace"))
+    content = data[match.end():end].decode("utf-8", errors="replace").strip()
+    if content.endswith(SEPARATOR_KEYWORD):
+        content = content[:-len(SEPARATOR_KEYWORD)].rstrip()
+    return {
+        "sender_name": sender_name,
+        "sender_email": sender_email,
+        "subject": match.group(2).decode("utf-8", errors="replace").strip(),
+        "date": match.group(3).decode("utf-8", errors="replace").strip(),
+        "content": content
+    }
+
+
+def parse_range(data: bytes, start: int, end: int) -> List[Dict[str, str]]:
+    """
+    Parse every message whose header starts in [start, end).
+
+    Args:
+        data: Buffer holding the export (bytes or mmap)
+        start: First byte of the range
+        end: End of the range (exclusive)
+
+    Returns:
+        List of email records in file order
+    """
+    records = []
+    current = None
+    for match in HEADER_PATTERN.finditer(data, start):
+        if current is not None:
+            records.append(parse_message(data, current, match.start()))
+        if match.start() >= end:
+            return records
+        current = match
+    if current is not None:
+        records.append(parse_message(data, current, len(data)))
+    return records
+
+
+def _parse_file_range(task: Tuple[str, int, int]) -> List[Dict[str, str]]:
+    path, start, end = task
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return parse_range(data, start, end)
+
+
+def iter_export_records(path: str, workers: Optional[int] = None,
+                        range_size: int = DEFAULT_RANGE_SIZE) -> Iterator[Dict[str, str]]:
+    """
+    Parse an export in parallel and yield its records in file order.
+
+    Args:
+        path: Path to the raw export
+        workers: Number of worker processes (defaults to the CPU count; 1 parses in-process)
+        range_size: Number of bytes per parsing task
+
+    Returns:
+        Iterator over email records
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    tasks = [(path, start, min(start + range_size, size)) for start in range(0, size, range_size)]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(tasks) == 1:
+        for task in tasks:
+            yield from _parse_file_range(task)
+        return
+
+    workers = min(workers, len(tasks))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # executor.map would submit every range up front and hold all parsed
+        # results until they are consumed; keep a bounded window instead
+        pending = deque()
+        tasks = iter(tasks)
+        for task in tasks:
+            pending.append(executor.submit(_parse_file_range, task))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            records = pending.popleft().result()
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(executor.submit(_parse_file_range, task))
+            yield from records
+
+
+def import_export(input_path: str, output_path: str, workers: Optional[int] = None,
+                  range_size: int = DEFAULT_RANGE_SIZE) -> int:
+    """
+    Convert a raw export to JSON (a list, like data/Emory_Report.json) or JSONL.
+
+    The format follows the output extension: ".jsonl" writes one record per line.
+
+    Args:
+        input_path: Path to the raw export
+        output_path: Path of the .json or .jsonl file to write
+        workers: Number of worker processes
+        range_size: Number of bytes per parsing task
+
+    Returns:
+        Number of records written
+    """
+    records = iter_export_records(input_path, workers=workers, range_size=range_size)
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        if output_path.endswith(".jsonl"):
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+        else:
+            f.write("[")
+            for record in records:
+                f.write(",\n" if count else "\n")
+                record_json = json.dumps(record, indent=2, ensure_ascii=False)
+                f.write("  " + record_json.replace("\n", "\n  "))
+                count += 1
+            f.write("\n]" if count else "]")
+    return count
+
+
+def run_benchmark(copies: int, workers: Optional[int] = None) -> None:
+    """
+    Time the importer on a synthetic export made of repeated copies of
+    data/Emory_Report.txt, sequentially and on the process pool.
+
+    Args:
+        copies: Number of times to repeat the sample export
+        workers: Number of worker processes for the parallel run
+    """
+    import tempfile
+
+    sample_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "Emory_Report.txt")
+    with open(sample_path, "rb") as f:
+        sample = f.read().rstrip(b"\n") + b"\n\n"
+
+    tmp_dir = tempfile.mkdtemp()
+    export_path = os.path.join(tmp_dir, "export.txt")
+    with open(export_path, "wb") as f:
+        for _ in range(copies):
+            f.write(sample)
+    size_mb = os.path.getsize(export_path) / 1e6
+
+    try:
+        results = {}
+        for label, run_workers in (("sequential", 1), ("parallel", workers or os.cpu_count() or 1)):
+            output_path = os.path.join(tmp_dir, f"{label}.jsonl")
+            start = time.perf_counter()
+            count = import_export(export_path, output_path, workers=run_workers)
+            seconds = time.perf_counter() - start
+            results[label] = output_path
+            print(f"{label:10} workers={run_workers:<3} {count} emails from {size_mb:.0f} MB "
+                  f"in {seconds:.2f}s ({size_mb / seconds:.0f} MB/s)")
+
+        with open(results["sequential"], "rb") as a, open(results["parallel"], "rb") as b:
+            print("Outputs identical:", a.read() == b.read())
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a raw From:/Subject:/Date: export to JSON or JSONL.")
+    parser.add_argument("input", nargs="?", help="Raw export, e.g. data/Emory_Report.txt")
+    parser.add_argument("output", nargs="?", help="Output .json or .jsonl file")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--range-size", type=int, default=DEFAULT_RANGE_SIZE, help="Bytes per parsing task")
+    parser.add_argument("--benchmark", action="store_true", help="Benchmark on a synthetic export")
+    parser.add_argument("--copies", type=int, default=200, help="Copies of the sample export for --benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.copies, workers=args.workers)
+    elif args.input and args.output:
+        start = time.perf_counter()
+        count = import_export(args.input, args.output, workers=args.workers, range_size=args.range_size)
+        print(f"Wrote {count} emails to {args.output} in {time.perf_counter() - start:.2f}s")
+    else:
+        parser.error("input and output are required unless --benchmark is given")
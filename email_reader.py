@@ -0,0 +1,114 @@
+"""
+Streaming reader for separator-delimited email dumps.
+
+Dumps written by preprocessing.py put SEPARATOR_KEYWORD after every email.
+`iter_separated_emails` reads such a file in fixed-size chunks and yields one
+email at a time, so memory stays flat regardless of the file size. A separator
+that spans two chunks is still found, and the emails yielded are the same
+pieces `content.split(SEPARATOR_KEYWORD)` would give.
+
+The output is a plain iterator of strings and can be passed straight to
+`preprocess_corpus` or to a classification loop.
+"""
+
+import os
+from typing import Iterator
+
+SEPARATOR_KEYWORD = "Caleb_Kairos_Michael_Nate_STOP_EMAIL"
+
+DEFAULT_CHUNK_SIZE = 1 << 20  # characters per read
+
+
+def iter_separated_emails(file_path: str, separator: str = SEPARATOR_KEYWORD,
+                          chunk_size: int = DEFAULT_CHUNK_SIZE, skip_empty: bool = True,
+                          encoding: str = "utf-8") -> Iterator[str]:
+    """
+    Yield the emails of a separator-delimited file one at a time.
+
+    Args:
+        file_path: Path to the dump
+        separator: String written between emails
+        chunk_size: Number of characters read at once
+        skip_empty: Whether to skip emails that are only whitespace
+        encoding: Text encoding of the file
+
+    Returns:
+        Iterator over the emails, in file order
+    """
+    if not separator:
+        raise ValueError("separator must not be empty")
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+
+    # The last len(separator) - 1 characters of each chunk are held back,
+    # since they may be the start of a separator that ends in the next chunk
+    keep = len(separator) - 1
+
+    with open(file_path, "r", encoding=encoding) as file:
+        pending = []  # pieces of the current email that cannot contain a separator start
+        tail = ""
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            pieces = (tail + chunk).split(separator)
+            if len(pieces) > 1:
+                pending.append(pieces[0])
+                email = "".join(pending)
+                pending = []
+                if not skip_empty or email.strip():
+                    yield email
+                for email in pieces[1:-1]:
+                    if not skip_empty or email.strip():
+                        yield email
+
+            last = pieces[-1]
+            if len(last) > keep:
+                pending.append(last[:len(last) - keep])
+                tail = last[len(last) - keep:]
+            else:
+                tail = last
+
+        pending.append(tail)
+        email = "".join(pending)
+        if not skip_empty or email.strip():
+            yield email
+
+
+if __name__ == "__main__":
+    # Check against str.split on a synthetic dump, with chunk sizes that put
+    # separators across chunk boundaries, then stream a large file and report
+    # peak memory
+    import tempfile
+    import time
+    import tracemalloc
+
+    body = "From: 'Lab' <lab@emory.edu>\nSubject: Weekly update\nDate: March 24, 2025\n" + "Seminar notes. " * 200
+    emails = [f"{body}#{i}\n" for i in range(2000)] + ["", "   \n", "Caleb_Kairos ends early"]
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt", delete=False) as tmp:
+        for email in emails:
+            tmp.write(email + "\n" + SEPARATOR_KEYWORD + "\n")
+        path = tmp.name
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        expected = [email for email in content.split(SEPARATOR_KEYWORD) if email.strip()]
+        for chunk_size in (1, 7, len(SEPARATOR_KEYWORD), 4096, DEFAULT_CHUNK_SIZE):
+            actual = list(iter_separated_emails(path, chunk_size=chunk_size))
+            print(f"chunk_size={chunk_size}: {'ok' if actual == expected else 'MISMATCH'} ({len(actual)} emails)")
+
+        # Grow the dump to ~300 MB and stream it
+        with open(path, "a", encoding="utf-8") as f:
+            for _ in range(50):
+                f.write(content)
+        size_mb = os.path.getsize(path) / 1e6
+        tracemalloc.start()
+        start = time.perf_counter()
+        count = sum(1 for _ in iter_separated_emails(path))
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Streamed {count} emails from {size_mb:.0f} MB in {seconds:.2f}s, peak memory {peak / 1e6:.1f} MB")
+    finally:
+        os.remove(path)
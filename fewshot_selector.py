@@ -0,0 +1,275 @@
+"""
+Similarity-based few-shot example selection.
+
+Instead of pasting the same fixed examples into every prompt, a pool of
+labelled emails is indexed as hashed TF-IDF vectors and, for each email to
+classify, the most similar examples are picked until `k` examples or the
+token budget is reached. Examples are formatted like `five_shot_examples`
+in final_experiments.py.
+
+The pool is stored as per-feature posting arrays (CSR by feature: for each
+hashed n-gram, the examples containing it and their weights), so memory grows
+with the number of n-grams in the pool rather than FEATURE_DIM per example. A
+query only reads the postings of its own n-grams, so selecting examples
+costs well under a millisecond per email.
+
+Usage:
+    python fewshot_selector.py
+"""
+
+import hashlib
+import math
+import os
+import zlib
+from collections import Counter
+from typing import Dict, Any, List, Optional, Sequence, Set, Tuple
+
+from local_classifier import TOKEN_PATTERN, email_text, email_labels, load_labelled_emails
+
+DEFAULT_K = int(os.getenv("EMAILLM_FEWSHOT_K", "8"))
+
+# Approximate prompt tokens the selected examples may use
+DEFAULT_TOKEN_BUDGET = int(os.getenv("EMAILLM_FEWSHOT_TOKEN_BUDGET", "1000"))
+
+# Example contents are cut to this many characters in the prompt
+DEFAULT_MAX_EXAMPLE_CHARS = 600
+
+# Measured on the saved token usage logs: ~3.8 characters per Gemini token
+CHARS_PER_TOKEN = 3.8
+
+FEATURE_DIM = 1 << 15
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough prompt token count of a text."""
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def content_hash(text: str) -> str:
+    """Identify an email by its text, to keep it out of its own examples."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def format_example(number: int, content: str, keywords: List[str]) -> str:
+    """Format one example the way the fixed few-shot strings do."""
+    return (
+        f"    Example {number}:\n"
+        f"    \n"
+        f"    Content: \"{content}\"\n"
+        f"    \n"
+        f"    correct keywords: {', '.join(keywords) if keywords else 'Non'}\n"
+        f"    \n"
+    )
+
+
+class FewShotSelector:
+    """
+    Index of labelled example emails that picks the most similar ones per query.
+
+    Example:
+        selector = FewShotSelector(load_labelled_emails())
+        fewshot_examples = selector.select_examples(email)
+    """
+
+    def __init__(self, pool: Sequence[Dict[str, Any]], k: int = DEFAULT_K,
+                 token_budget: int = DEFAULT_TOKEN_BUDGET,
+                 max_example_chars: int = DEFAULT_MAX_EXAMPLE_CHARS):
+        """
+        Args:
+            pool: Labelled emails (`category` or `label`) to draw examples from
+            k: Maximum number of examples per prompt
+            token_budget: Maximum estimated tokens of the formatted examples
+            max_example_chars: Length each example's content is cut to
+        """
+        import numpy as np
+
+        self.k = k
+        self.token_budget = token_budget
+        self.max_example_chars = max_example_chars
+
+        texts = [email_text(email) for email in pool]
+        self.hashes = [content_hash(text) for text in texts]
+        self.labels = [email_labels(email) for email in pool]
+        self.snippets = [" ".join(text.split())[:max_example_chars] for text in texts]
+
+        counts = [self._features(text) for text in texts]
+        df = Counter(feature for count in counts for feature in count)
+        n = len(pool)
+        self.idf = np.ones(FEATURE_DIM, dtype=np.float32)
+        for feature, frequency in df.items():
+            self.idf[feature] = math.log((1 + n) / (1 + frequency)) + 1
+
+        # Postings sorted by feature: examples containing feature f are
+        # self.columns[self.indptr[f]:self.indptr[f + 1]], with their weights
+        vectors = [self._weights(count) for count in counts]
+        features = np.concatenate([f for f, _ in vectors]) if vectors else np.zeros(0, dtype=np.int64)
+        columns = np.repeat(np.arange(n, dtype=np.int32), [len(f) for f, _ in vectors])
+        values = np.concatenate([w for _, w in vectors]) if vectors else np.zeros(0, dtype=np.float32)
+        order = np.argsort(features, kind="stable")
+        self.columns = columns[order]
+        self.values = values[order].astype(np.float32)
+        self.indptr = np.zeros(FEATURE_DIM + 1, dtype=np.int64)
+        np.cumsum(np.bincount(features, minlength=FEATURE_DIM), out=self.indptr[1:])
+        self.size = n
+
+    @staticmethod
+    def _features(text: str) -> Counter:
+        # Hashed word unigrams and bigrams, as in local_classifier.hashed_ngrams
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        crc32 = zlib.crc32
+        features = Counter(crc32(token.encode("utf-8")) & (FEATURE_DIM - 1) for token in tokens)
+        features.update(crc32(f"{a} {b}".encode("utf-8")) & (FEATURE_DIM - 1) for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    def _weights(self, count: Counter) -> Tuple[Any, Any]:
+        import numpy as np
+
+        features = np.fromiter(count.keys(), dtype=np.int64, count=len(count))
+        tf = np.fromiter(count.values(), dtype=np.float32, count=len(count))
+        weights = (1 + np.log(tf)) * self.idf[features]
+        return features, weights / max(float(np.linalg.norm(weights)), 1e-12)
+
+    def nearest(self, email: Dict[str, Any], limit: Optional[int] = None,
+                exclude_self: bool = True, exclude: Optional[Set[str]] = None) -> List[Tuple[int, float]]:
+        """
+        Rank pool examples by cosine similarity to an email.
+
+        Args:
+            email: Email with `subject` and `content`
+            limit: Maximum number of examples to return (all if None)
+            exclude_self: Skip pool entries with exactly the same text
+            exclude: Content hashes of further pool entries to skip (e.g. the
+                other emails of a packed request)
+
+        Returns:
+            List of (pool index, similarity), most similar first
+        """
+        import numpy as np
+
+        text = email_text(email)
+        features, weights = self._weights(self._features(text))
+        # Gather the postings of the query's features and sum weight products per example
+        starts = self.indptr[features]
+        lengths = self.indptr[features + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        similarities = np.bincount(self.columns[offsets],
+                                   weights=self.values[offsets] * np.repeat(weights, lengths),
+                                   minlength=self.size)
+
+        excluded = set(exclude or ())
+        if exclude_self:
+            excluded.add(content_hash(text))
+
+        n = len(similarities)
+        # Spare slots in case excluded emails are in the pool
+        spare = len(excluded)
+        if limit is not None and limit + spare < n:
+            candidates = np.argpartition(-similarities, limit + spare)[:limit + spare]
+            order = candidates[np.argsort(-similarities[candidates], kind="stable")]
+        else:
+            order = np.argsort(-similarities, kind="stable")
+
+        ranked = [(int(i), float(similarities[i])) for i in order if self.hashes[i] not in excluded]
+        return ranked[:limit] if limit is not None else ranked
+
+    def select(self, email: Dict[str, Any], k: Optional[int] = None,
+               token_budget: Optional[int] = None) -> List[int]:
+        """
+        Pick pool indices for an email's examples, most similar first.
+
+        Examples are added while fewer than `k` are chosen and the formatted
+        examples stay within the token budget; an example that does not fit is
+        skipped in favour of shorter, less similar ones.
+        """
+        k = self.k if k is None else k
+        return self._fill(self.nearest(email, limit=4 * k), k, token_budget)
+
+    def select_for_pack(self, emails: Sequence[Dict[str, Any]], k: Optional[int] = None,
+                        token_budget: Optional[int] = None) -> List[int]:
+        """
+        Pick pool indices for the shared examples of a packed request.
+
+        Each email is ranked separately, with every email of the pack kept
+        out of the examples. The rankings are interleaved (every member's
+        nearest example, then every member's second nearest, ...) so each
+        member gets examples, deduplicated, and filled under `k` and the token
+        budget like select().
+        """
+        k = self.k if k is None else k
+        exclude = {content_hash(email_text(email)) for email in emails}
+        rankings = [self.nearest(email, limit=4 * k, exclude=exclude) for email in emails]
+        ranked, seen = [], set()
+        for rank in range(max((len(ranking) for ranking in rankings), default=0)):
+            for ranking in rankings:
+                if rank < len(ranking) and ranking[rank][0] not in seen:
+                    seen.add(ranking[rank][0])
+                    ranked.append(ranking[rank])
+        return self._fill(ranked, k, token_budget)
+
+    def _fill(self, ranked: List[Tuple[int, float]], k: int, token_budget: Optional[int]) -> List[int]:
+        token_budget = self.token_budget if token_budget is None else token_budget
+        chosen, used = [], 0
+        for i, _ in ranked:
+            if len(chosen) >= k:
+                break
+            cost = estimate_tokens(format_example(len(chosen) + 1, self.snippets[i], self.labels[i]))
+            if used + cost > token_budget:
+                continue
+            chosen.append(i)
+            used += cost
+        return chosen
+
+    def select_examples(self, email: Dict[str, Any], k: Optional[int] = None,
+                        token_budget: Optional[int] = None) -> str:
+        """
+        Build the few-shot examples string for an email.
+
+        Returns:
+            Examples formatted like five_shot_examples ("" if none fit)
+        """
+        return self._format(self.select(email, k=k, token_budget=token_budget))
+
+    def select_pack_examples(self, emails: Sequence[Dict[str, Any]], k: Optional[int] = None,
+                             token_budget: Optional[int] = None) -> str:
+        """
+        Build the few-shot examples string shared by a packed request (see select_for_pack).
+        """
+        return self._format(self.select_for_pack(emails, k=k, token_budget=token_budget))
+
+    def _format(self, chosen: List[int]) -> str:
+        return "\n" + "".join(
+            format_example(number, self.snippets[i], self.labels[i])
+            for number, i in enumerate(chosen, 1)
+        ) if chosen else ""
+
+
+if __name__ == "__main__":
+    # Offline check: latency per email, prompt size against the fixed 8-shot
+    # examples, and how often the nearest example carries a correct keyword
+    # (leave-one-out over the QTM emails, pool = QTM + Emory Report)
+    import json
+    import time
+    from local_classifier import QTM_DATA_PATH, EMORY_REPORT_DATA_PATH
+    from final_experiments import eight_shot_examples
+
+    with open(QTM_DATA_PATH, "r", encoding="utf-8") as f:
+        qtm_emails = json.load(f)
+    pool = qtm_emails + load_labelled_emails([EMORY_REPORT_DATA_PATH])
+
+    start = time.perf_counter()
+    selector = FewShotSelector(pool)
+    print(f"Indexed {len(pool)} examples in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    examples = [selector.select_examples(email) for email in qtm_emails]
+    per_email_ms = (time.perf_counter() - start) * 1000 / len(qtm_emails)
+
+    top1_hits = 0
+    for email in qtm_emails:
+        best = selector.nearest(email)[0][0]
+        top1_hits += bool(set(selector.labels[best]) & set(email_labels(email)))
+
+    average_tokens = sum(estimate_tokens(example) for example in examples) / len(examples)
+    print(f"Selection: {per_email_ms:.3f} ms per email")
+    print(f"Prompt examples: {average_tokens:.0f} tokens on average vs {estimate_tokens(eight_shot_examples)} for 8-shot")
+    print(f"Nearest example shares a correct keyword for {top1_hits}/{len(qtm_emails)} emails")
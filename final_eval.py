@@ -1,160 +1,298 @@
-def evaluate_email_classification(all_qtm_emails, output):
+import json
+import os
+
+METRICS = ["precision", "recall", "f1", "jaccard", "accuracy"]
+
+# Segment boundaries are read from "<dataset>.meta.json" next to the dataset
+DEFAULT_DATASET_PATH = os.getenv("EMAILLM_DATASET_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "qtm_emails_final_version.json"))
+
+def dataset_metadata_path(dataset_path):
     """
-    Evaluate email classification performance with comprehensive metrics
-    for multi-label (first half) and single-label (second half) data.
+    Return the path of a dataset's metadata file (data/x.json -> data/x.meta.json).
+    """
+    return os.path.splitext(dataset_path)[0] + ".meta.json"
+
+def load_segments(dataset_path=DEFAULT_DATASET_PATH, length=None):
+    """
+    Read the segment definitions of a dataset from its metadata file.
+    
+    A segment is a [start, end) range of email indices with a labelling:
+    "multi" (any number of keywords per email) or "single" (one keyword per
+    email, additionally reported with global metrics and a confusion matrix).
+    
+    Parameters:
+    - dataset_path: Path to the dataset JSON file
+    - length: Number of emails, used for segments with "end": null (open-ended)
+    
+    Returns:
+    - List of segments as dictionaries with 'name', 'start', 'end' and 'labelling';
+      empty when the dataset has no metadata, so only whole-dataset metrics are reported
+    """
+    metadata_path = dataset_metadata_path(dataset_path)
+    if not os.path.exists(metadata_path):
+        print(f"Warning: No dataset metadata at {metadata_path}; reporting whole-dataset metrics only")
+        return []
+    with open(metadata_path, 'r') as f:
+        metadata = json.load(f)
+    
+    segments = []
+    for segment in metadata.get("segments", []):
+        end = segment.get("end")
+        if end is None:
+            end = length
+        elif length is not None:
+            end = min(end, length)
+        segments.append({
+            "name": segment["name"],
+            "start": segment.get("start", 0),
+            "end": end,
+            "labelling": segment.get("labelling", "multi")
+        })
+    return segments
+
+def predicted_keywords(record):
+    """
+    Predicted keywords of an output record; error records and missing emails
+    (None, or a record with "missing") count as empty predictions.
+    """
+    if not record or "predicted_classification" not in record:
+        return []
+    return record["predicted_classification"].get("relevant_keywords") or []
+
+def count_failures(output, length):
+    """
+    Count the emails of a run without a classification.
+    
+    Parameters:
+    - output: List of output records, aligned with the dataset
+    - length: Number of emails in the dataset
+    
+    Returns:
+    - Tuple of (errors, missing): error records, and emails with no record
+    """
+    errors, missing = 0, max(0, length - len(output))
+    for record in output[:length]:
+        if not record or record.get("missing"):
+            missing += 1
+        elif "predicted_classification" not in record:
+            errors += 1
+    return errors, missing
+
+def encode_predictions(all_qtm_emails, output):
+    """
+    Encode predicted and true keyword sets as boolean indicator matrices.
     
     Parameters:
     - all_qtm_emails: List of email data with ground truth labels in 'category' field
-    - output: List of model prediction data with 'predicted_classification' field
+    - output: List of model prediction data with 'predicted_classification' field;
+      error records and missing emails are encoded as empty predictions
     
     Returns:
-    - Dictionary containing all metrics for different segments of the dataset
+    - Tuple of (labels, predicted, true): the sorted label vocabulary and two
+      (emails x labels) boolean matrices
     """
-    # Get total length of dataset
+    import numpy as np
+    
     length = len(all_qtm_emails)
-    first_half_end = 65  # Index where first half ends
+    predicted_sets = [set(predicted_keywords(output[i] if i < len(output) else None)) for i in range(length)]
+    true_sets = [set(email["category"]) for email in all_qtm_emails]
     
-    # Define metrics calculation functions
-    def calculate_jaccard(predicted_keywords, true_keywords):
-        pred_set = set(predicted_keywords)
-        true_set = set(true_keywords)
-        
-        intersection = len(pred_set & true_set)
-        union = len(pred_set | true_set)
-        
-        return intersection / union if union > 0 else 1.0  # If both sets empty, similarity is 1
+    labels = sorted(set().union(*predicted_sets, *true_sets))
+    column = {label: j for j, label in enumerate(labels)}
     
-    def calculate_precision(predicted_keywords, true_keywords):
-        pred_set = set(predicted_keywords)
-        true_set = set(true_keywords)
-        
-        intersection = len(pred_set & true_set)
-        
-        return intersection / len(pred_set) if len(pred_set) > 0 else 1.0  # If no predictions, precision is 1
+    def indicator(sets):
+        matrix = np.zeros((length, len(labels)), dtype=bool)
+        rows = np.repeat(np.arange(length), [len(label_set) for label_set in sets])
+        matrix[rows, [column[label] for label_set in sets for label in label_set]] = True
+        return matrix
     
-    def calculate_recall(predicted_keywords, true_keywords):
-        pred_set = set(predicted_keywords)
-        true_set = set(true_keywords)
-        
-        intersection = len(pred_set & true_set)
-        
-        return intersection / len(true_set) if len(true_set) > 0 else 1.0  # If no true labels, recall is 1
+    return labels, indicator(predicted_sets), indicator(true_sets)
+
+def per_example_metrics(predicted, true):
+    """
+    Compute every per-example metric from indicator matrices.
     
-    def calculate_f1(predicted_keywords, true_keywords):
-        precision = calculate_precision(predicted_keywords, true_keywords)
-        recall = calculate_recall(predicted_keywords, true_keywords)
-        
-        return 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
-    
-    def calculate_accuracy(predicted_keywords, true_keywords):
-        """For single-label classification, checks if the prediction contains the true label"""
-        return 1.0 if set(true_keywords) & set(predicted_keywords) else 0.0
-    
-    # Calculate per-example metrics for different segments
-    def calculate_segment_metrics(start_idx, end_idx):
-        total_precision = 0
-        total_recall = 0
-        total_f1 = 0
-        total_jaccard = 0
-        total_accuracy = 0  # Only meaningful for single-label
-        
-        for i in range(start_idx, end_idx):
-            predicted = output[i]["predicted_classification"]["relevant_keywords"]
-            true = all_qtm_emails[i]["category"]
-            
-            total_precision += calculate_precision(predicted, true)
-            total_recall += calculate_recall(predicted, true)
-            total_f1 += calculate_f1(predicted, true)
-            total_jaccard += calculate_jaccard(predicted, true)
-            total_accuracy += calculate_accuracy(predicted, true)
-        
-        num_examples = end_idx - start_idx
-        return {
-            "precision": total_precision / num_examples if num_examples > 0 else 0,
-            "recall": total_recall / num_examples if num_examples > 0 else 0,
-            "f1": total_f1 / num_examples if num_examples > 0 else 0,
-            "jaccard": total_jaccard / num_examples if num_examples > 0 else 0,
-            "accuracy": total_accuracy / num_examples if num_examples > 0 else 0
-        }
+    Conventions: precision is 1 when nothing is predicted, recall is 1 when
+    there are no true labels, Jaccard is 1 when both sets are empty, and
+    accuracy is 1 when the prediction contains a true label.
     
-    # Calculate global metrics for second half (single-label)
-    def calculate_global_metrics_second_half():
-        total_tp, total_fp, total_fn = 0, 0, 0
-        total_correct = 0
-        
-        for i in range(first_half_end, length):
-            predicted = set(output[i]["predicted_classification"]["relevant_keywords"])
-            true = set(all_qtm_emails[i]["category"])
-            
-            # Calculate TP, FP, FN for global metrics
-            tp = len(predicted & true)
-            fp = len(predicted - true)
-            fn = len(true - predicted)
-            
-            total_tp += tp
-            total_fp += fp
-            total_fn += fn
-            
-            # For accuracy
-            if tp > 0:
-                total_correct += 1
-        
-        # Calculate global metrics
-        precision = total_tp / (total_tp + total_fp) if (total_tp + total_fp) > 0 else 0
-        recall = total_tp / (total_tp + total_fn) if (total_tp + total_fn) > 0 else 0
-        f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
-        accuracy = total_correct / (length - first_half_end) if (length - first_half_end) > 0 else 0
-        
+    Returns:
+    - Dictionary of metric name to a float array with one value per email
+    """
+    import numpy as np
+    
+    intersection = (predicted & true).sum(axis=1)
+    predicted_count = predicted.sum(axis=1)
+    true_count = true.sum(axis=1)
+    union = (predicted | true).sum(axis=1)
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted_count > 0, intersection / predicted_count, 1.0)
+        recall = np.where(true_count > 0, intersection / true_count, 1.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        jaccard = np.where(union > 0, intersection / union, 1.0)
+    accuracy = (intersection > 0).astype(float)
+    
+    return {"precision": precision, "recall": recall, "f1": f1, "jaccard": jaccard, "accuracy": accuracy}
+
+def global_metrics(predicted, true):
+    """
+    Compute micro-averaged precision, recall and F1 plus accuracy over a set of emails.
+    """
+    tp = int((predicted & true).sum())
+    fp = int((predicted & ~true).sum())
+    fn = int((~predicted & true).sum())
+    correct = int((predicted & true).any(axis=1).sum())
+    length = predicted.shape[0]
+    
+    precision = tp / (tp + fp) if (tp + fp) > 0 else 0
+    recall = tp / (tp + fn) if (tp + fn) > 0 else 0
+    f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+    accuracy = correct / length if length > 0 else 0
+    
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "accuracy": accuracy
+    }
+
+def bootstrap_confidence_intervals(per_example, n_resamples=5000, confidence=0.95, seed=0):
+    """
+    Percentile bootstrap confidence intervals for the mean of each per-example metric.
+    
+    Resamples are drawn as index matrices (in chunks of about ten million
+    indices, to bound memory) and shared by all metrics, so thousands of
+    resamples take milliseconds on a dataset of this size.
+    
+    Parameters:
+    - per_example: Dictionary of metric name to per-example values (see per_example_metrics)
+    - n_resamples: Number of bootstrap resamples
+    - confidence: Coverage of the intervals
+    - seed: Random seed, so intervals are reproducible
+    
+    Returns:
+    - Dictionary of metric name to (lower, upper)
+    """
+    import numpy as np
+    
+    length = len(next(iter(per_example.values())))
+    if length == 0:
+        return {metric: (0.0, 0.0) for metric in per_example}
+    rng = np.random.default_rng(seed)
+    values = {metric: np.asarray(metric_values, dtype=float) for metric, metric_values in per_example.items()}
+    means = {metric: np.empty(n_resamples) for metric in values}
+    chunk = max(1, 10_000_000 // length)
+    for start in range(0, n_resamples, chunk):
+        indices = rng.integers(0, length, size=(min(chunk, n_resamples - start), length))
+        for metric, metric_values in values.items():
+            means[metric][start:start + len(indices)] = metric_values[indices].mean(axis=1)
+    
+    alpha = (1 - confidence) / 2
+    intervals = {}
+    for metric, resampled in means.items():
+        lower, upper = np.quantile(resampled, [alpha, 1 - alpha])
+        intervals[metric] = (float(lower), float(upper))
+    return intervals
+
+def bootstrap_difference(per_example_a, per_example_b, n_resamples=5000, confidence=0.95, seed=0):
+    """
+    Paired bootstrap of the difference in mean metrics between two runs on the same emails.
+    
+    Returns:
+    - Dictionary of metric name to (difference b - a, lower, upper)
+    """
+    import numpy as np
+    
+    differences = {metric: np.asarray(per_example_b[metric]) - np.asarray(per_example_a[metric]) for metric in per_example_a}
+    intervals = bootstrap_confidence_intervals(differences, n_resamples=n_resamples, confidence=confidence, seed=seed)
+    return {metric: (float(values.mean()), *intervals[metric]) for metric, values in differences.items()}
+
+def evaluate_email_classification(all_qtm_emails, output, bootstrap=0, segments=None):
+    """
+    Evaluate email classification performance with comprehensive metrics
+    for each segment of the dataset, e.g. multi-label (first half) and
+    single-label (second half) data.
+    
+    Predictions and ground truth are encoded once as indicator matrices and
+    every metric is computed from them.
+    
+    Parameters:
+    - all_qtm_emails: List of email data with ground truth labels in 'category' field
+    - output: List of model prediction data with 'predicted_classification' field,
+      aligned with all_qtm_emails; error records and missing emails are scored
+      as empty predictions
+    - bootstrap: Number of bootstrap resamples for 95% confidence intervals (0 to skip)
+    - segments: Segment definitions (see load_segments); read from the default
+      dataset's metadata when not given
+    
+    Returns:
+    - Dictionary containing all metrics for different segments of the dataset:
+      per-example metrics for "multi" segments, per-example and global metrics
+      for "single" segments, plus "whole_dataset", "confusion_matrix", and the
+      number of error records ("errors") and emails without a record ("missing")
+    """
+    import numpy as np
+    
+    # Get total length of dataset
+    length = len(all_qtm_emails)
+    if segments is None:
+        segments = load_segments(length=length)
+    ranges = {segment["name"]: (segment["start"], length if segment["end"] is None else segment["end"]) for segment in segments}
+    
+    labels, predicted, true = encode_predictions(all_qtm_emails, output)
+    per_example = per_example_metrics(predicted, true)
+    
+    def segment_metrics(start_idx, end_idx):
+        num_examples = end_idx - start_idx
         return {
-            "precision": precision,
-            "recall": recall,
-            "f1": f1,
-            "accuracy": accuracy
+            metric: float(values[start_idx:end_idx].mean()) if num_examples > 0 else 0
+            for metric, values in per_example.items()
         }
     
-    # Calculate confusion matrix for second half (single-label)
-    def calculate_confusion_matrix():
-        # Get all unique categories
-        all_categories = set()
-        for email in all_qtm_emails:
-            all_categories.update(email["category"])
-        all_categories = sorted(list(all_categories))
-        
-        # Initialize confusion matrix
-        confusion_matrix = {category: {pred: 0 for pred in all_categories} for category in all_categories}
-        
-        # Fill confusion matrix
-        for i in range(first_half_end, length):
-            true_category = all_qtm_emails[i]["category"][0]  # Assuming single label
-            
-            # Find predicted category
-            predicted = output[i]["predicted_classification"]["relevant_keywords"]
-            predicted_category = predicted[0] if predicted else None  # Take first prediction
-            
-            # Update confusion matrix
-            if predicted_category in all_categories:
-                confusion_matrix[true_category][predicted_category] += 1
-        
-        return confusion_matrix
-    
-    # Calculate all metrics
-    first_half_metrics = calculate_segment_metrics(0, first_half_end)
-    second_half_metrics = calculate_segment_metrics(first_half_end, length)
-    whole_dataset_metrics = calculate_segment_metrics(0, length)
-    second_half_global_metrics = calculate_global_metrics_second_half()
-    confusion_matrix = calculate_confusion_matrix()
+    # Confusion matrix for single-label segments: first true label vs first prediction
+    all_categories = sorted(set().union(*(email["category"] for email in all_qtm_emails)))
+    category_index = {category: j for j, category in enumerate(all_categories)}
+    counts = np.zeros((len(all_categories), len(all_categories)), dtype=int)
+    true_idx, predicted_idx = [], []
+    single_label = [ranges[segment["name"]] for segment in segments if segment["labelling"] == "single"]
+    for start_idx, end_idx in single_label:
+        for i in range(start_idx, end_idx):
+            predictions = predicted_keywords(output[i] if i < len(output) else None)
+            if predictions and predictions[0] in category_index:
+                true_idx.append(category_index[all_qtm_emails[i]["category"][0]])
+                predicted_idx.append(category_index[predictions[0]])
+    np.add.at(counts, (np.array(true_idx, dtype=int), np.array(predicted_idx, dtype=int)), 1)
+    confusion_matrix = {
+        category: {pred: int(counts[j, k]) for k, pred in enumerate(all_categories)}
+        for j, category in enumerate(all_categories)
+    }
     
     # Compile results
-    results = {
-        "first_half": first_half_metrics,
-        "second_half": {
-            "per_example": second_half_metrics,
-            "global": second_half_global_metrics
-        },
-        "whole_dataset": whole_dataset_metrics,
-        "confusion_matrix": confusion_matrix
-    }
+    results = {}
+    for segment in segments:
+        start_idx, end_idx = ranges[segment["name"]]
+        if segment["labelling"] == "single":
+            results[segment["name"]] = {
+                "per_example": segment_metrics(start_idx, end_idx),
+                "global": global_metrics(predicted[start_idx:end_idx], true[start_idx:end_idx])
+            }
+        else:
+            results[segment["name"]] = segment_metrics(start_idx, end_idx)
+    results["whole_dataset"] = segment_metrics(0, length)
+    results["confusion_matrix"] = confusion_matrix
+    
+    if bootstrap:
+        ranges["whole_dataset"] = (0, length)
+        results["confidence_intervals"] = {
+            segment: bootstrap_confidence_intervals(
+                {metric: values[start:end] for metric, values in per_example.items()},
+                n_resamples=bootstrap
+            )
+            for segment, (start, end) in ranges.items()
+        }
     
+    results["errors"], results["missing"] = count_failures(output, length)
     return results
 
 # Example usage
@@ -162,7 +300,15 @@ def print_evaluation_report(all_qtm_emails, output):
     """
     Generate and print a comprehensive evaluation report
     """
-    results = evaluate_email_classification(all_qtm_emails, output)
+    print_evaluation_results(evaluate_email_classification(all_qtm_emails, output))
+
+def print_evaluation_results(results):
+    """
+    Print evaluation results (see evaluate_email_classification) as a report
+    """
+    # Segments are every key besides the fixed ones, in metadata order
+    segment_names = [name for name, value in results.items()
+                     if isinstance(value, dict) and name not in ("whole_dataset", "confusion_matrix", "confidence_intervals")]
     
     print("=" * 80)
     print("EMAIL CLASSIFICATION EVALUATION REPORT")
@@ -170,27 +316,24 @@ def print_evaluation_report(all_qtm_emails, output):
     
     print("\nPER-EXAMPLE METRICS:")
     print("-" * 80)
-    print(f"{'Metric':<15} {'First Half':<15} {'Second Half':<15} {'Whole Dataset':<15}")
+    print(f"{'Metric':<15} " + " ".join(f"{name.replace('_', ' ').title():<15}" for name in segment_names) + f" {'Whole Dataset':<15}")
     print("-" * 80)
     metrics = ["precision", "recall", "f1", "jaccard", "accuracy"]
     for metric in metrics:
-        first_half_val = results["first_half"].get(metric, "N/A")
-        second_half_val = results["second_half"]["per_example"].get(metric, "N/A")
-        whole_val = results["whole_dataset"].get(metric, "N/A")
-        
-        if first_half_val != "N/A":
-            first_half_val = f"{first_half_val:.2f}"
-        if second_half_val != "N/A":
-            second_half_val = f"{second_half_val:.2f}"
-        if whole_val != "N/A":
-            whole_val = f"{whole_val:.2f}"
+        values = []
+        for name in segment_names + ["whole_dataset"]:
+            segment = results[name]
+            val = segment.get("per_example", segment).get(metric, "N/A")
+            values.append(f"{val:.2f}" if val != "N/A" else val)
         
-        print(f"{metric.capitalize():<15} {first_half_val:<15} {second_half_val:<15} {whole_val:<15}")
+        print(f"{metric.capitalize():<15} " + " ".join(f"{val:<15}" for val in values))
     
-    print("\nGLOBAL METRICS FOR SECOND HALF:")
-    print("-" * 80)
-    for metric, value in results["second_half"]["global"].items():
-        print(f"{metric.capitalize():<15} {value:.2f}")
+    for name in segment_names:
+        if "global" in results[name]:
+            print(f"\nGLOBAL METRICS FOR {name.replace('_', ' ').upper()}:")
+            print("-" * 80)
+            for metric, value in results[name]["global"].items():
+                print(f"{metric.capitalize():<15} {value:.2f}")
     
     print("\nCONFUSION MATRIX SUMMARY (TOP MISCLASSIFICATIONS):")
     print("-" * 80)
@@ -206,9 +349,68 @@ def print_evaluation_report(all_qtm_emails, output):
     for true_cat, pred_cat, count in top_confusions[:5]:
         print(f"True: {true_cat}, Predicted: {pred_cat}, Count: {count}")
     
+    if results.get("errors") or results.get("missing"):
+        print(f"\nUnclassified emails, scored as empty predictions: {results.get('errors', 0)} errors, "
+              f"{results.get('missing', 0)} missing")
+    
     print("=" * 80)
 
-def evaluate_experiment_results():
+def print_cascade_report(all_qtm_emails, output, baseline_output=None):
+    """
+    Report how much of a run the local classifier cascade resolved and what it
+    did to accuracy.
+
+    Parameters:
+    - all_qtm_emails: List of email data with ground truth labels in 'category' field
+    - output: Cascade run output; locally resolved records have
+      predicted_classification['source'] == 'local'
+    - baseline_output: Optional LLM-only output of the same configuration to compare against
+
+    Returns:
+    - Dictionary with the local fraction, local-only metrics and whole-dataset metrics
+    """
+    local = [i for i, record in enumerate(output)
+             if record and record.get("predicted_classification", {}).get("source") == "local"]
+    length = len(output)
+
+    def subset_metrics(records, indices):
+        # Per-example Jaccard and accuracy over the given emails (ignoring "Non")
+        jaccard, accuracy = 0.0, 0.0
+        for i in indices:
+            predicted = set(predicted_keywords(records[i] if i < len(records) else None))
+            true = set(label.lower() for label in all_qtm_emails[i]["category"]) - {"non"}
+            union = predicted | true
+            jaccard += len(predicted & true) / len(union) if union else 1.0
+            accuracy += 1.0 if (predicted & true) or not union else 0.0
+        count = len(indices)
+        return {"jaccard": jaccard / count if count else 0, "accuracy": accuracy / count if count else 0}
+
+    report = {
+        "local_fraction": len(local) / length if length else 0,
+        "local_count": len(local),
+        "llm_calls_saved": len(local),
+        "local_subset": subset_metrics(output, local),
+        "whole_dataset": evaluate_email_classification(all_qtm_emails, output)["whole_dataset"]
+    }
+
+    print(f"Resolved locally: {len(local)}/{length} emails ({report['local_fraction']:.1%})")
+    print(f"Local decisions:  Jaccard {report['local_subset']['jaccard']:.2f}, "
+          f"Accuracy {report['local_subset']['accuracy']:.2f}")
+
+    if baseline_output is not None:
+        report["baseline_local_subset"] = subset_metrics(baseline_output, local)
+        report["baseline_whole_dataset"] = evaluate_email_classification(all_qtm_emails, baseline_output)["whole_dataset"]
+        print(f"LLM on same emails: Jaccard {report['baseline_local_subset']['jaccard']:.2f}, "
+              f"Accuracy {report['baseline_local_subset']['accuracy']:.2f}")
+        print(f"{'Metric':<15} {'LLM only':<15} {'Cascade':<15} {'Change':<15}")
+        for metric in ["precision", "recall", "f1", "jaccard", "accuracy"]:
+            before = report["baseline_whole_dataset"][metric]
+            after = report["whole_dataset"][metric]
+            print(f"{metric.capitalize():<15} {before:<15.3f} {after:<15.3f} {after - before:+.3f}")
+
+    return report
+
+def evaluate_experiment_results(bootstrap=5000):
     """
     Evaluate all experiment results and present them in a comprehensive table format.
     
@@ -217,9 +419,14 @@ def evaluate_experiment_results():
     - Three sub-columns for each condition: Zero-shot, Five-shot, Eight-shot
     - Three sub-sub-columns for each shot type: First Half, Second Half, Whole Dataset
     - Five metrics for each segment: Precision, Recall, F1, Jaccard, Accuracy
+    
+    Followed by whole-dataset 95% bootstrap confidence intervals for each
+    configuration and paired bootstrap intervals for the differences between
+    shot settings.
+    
+    Parameters:
+    - bootstrap: Number of bootstrap resamples (0 to skip the intervals)
     """
-    import os
-    import json
     from tabulate import tabulate
     
     # Define experiment paths
@@ -228,11 +435,14 @@ def evaluate_experiment_results():
     shots = ["0shot", "5shot", "8shot"]
     
     # Load all QTM emails for reference
-    with open('/Users/natehu/Desktop/QTM 329 Comp Ling/EmaiLLM/data/qtm_emails_final_version.json', 'r') as f:
+    dataset_path = '/Users/natehu/Desktop/QTM 329 Comp Ling/EmaiLLM/data/qtm_emails_final_version.json'
+    with open(dataset_path, 'r') as f:
         all_qtm_emails = json.load(f)
+    segments = load_segments(dataset_path, length=len(all_qtm_emails))
     
     # Organize data for table
     results = {}
+    per_example = {}
     for condition in conditions:
         results[condition] = {}
         for shot in shots:
@@ -241,15 +451,19 @@ def evaluate_experiment_results():
                 with open(file_path, 'r') as f:
                     output = json.load(f)
                     # Evaluate results
-                    eval_results = evaluate_email_classification(all_qtm_emails, output)
+                    eval_results = evaluate_email_classification(all_qtm_emails, output, bootstrap=bootstrap, segments=segments)
+                    if eval_results["errors"] or eval_results["missing"]:
+                        print(f"Warning: {file_path} has {eval_results['errors']} error records and "
+                              f"{eval_results['missing']} missing emails, scored as empty predictions")
                     results[condition][shot] = eval_results
+                    per_example[(condition, shot)] = per_example_metrics(*encode_predictions(all_qtm_emails, output)[1:])
             else:
                 print(f"Warning: File not found: {file_path}")
     
     # Extract metrics for each segment and format table
-    metrics = ["precision", "recall", "f1", "jaccard", "accuracy"]
-    segments = ["first_half", "second_half", "whole_dataset"]
-    segment_labels = ["First Half", "Second Half", "Whole Dataset"]
+    metrics = METRICS
+    segment_names = [segment["name"] for segment in segments] + ["whole_dataset"]
+    segment_labels = [name.replace("_", " ").title() for name in segment_names]
     
     # Prepare header row
     headers = ["Metric"]
@@ -267,20 +481,14 @@ def evaluate_experiment_results():
         for cond in conditions:
             for shot in shots:
                 if cond in results and shot in results[cond]:
-                    # First half
-                    val = results[cond][shot]["first_half"].get(metric, "N/A")
-                    row.append(f"{val:.2f}" if isinstance(val, float) else val)
-                    
-                    # Second half (use per_example metrics)
-                    val = results[cond][shot]["second_half"]["per_example"].get(metric, "N/A")
-                    row.append(f"{val:.2f}" if isinstance(val, float) else val)
-                    
-                    # Whole dataset
-                    val = results[cond][shot]["whole_dataset"].get(metric, "N/A")
-                    row.append(f"{val:.2f}" if isinstance(val, float) else val)
+                    for name in segment_names:
+                        # Single-label segments use their per_example metrics
+                        segment = results[cond][shot][name]
+                        val = segment.get("per_example", segment).get(metric, "N/A")
+                        row.append(f"{val:.2f}" if isinstance(val, float) else val)
                 else:
                     # If data missing, add placeholders
-                    row.extend(["N/A", "N/A", "N/A"])
+                    row.extend(["N/A"] * len(segment_names))
         table_data.append(row)
     
     # Generate table
@@ -288,10 +496,39 @@ def evaluate_experiment_results():
     print("\nCOMPREHENSIVE EVALUATION RESULTS:\n")
     print(table)
     
+    # Confidence intervals and paired differences on the whole dataset
+    interval_table = ""
+    if bootstrap:
+        interval_rows = []
+        for cond in conditions:
+            for shot in shots:
+                if (cond, shot) in per_example:
+                    intervals = results[cond][shot]["confidence_intervals"]["whole_dataset"]
+                    row = [f"{cond} {shot}"]
+                    for metric in METRICS:
+                        val = results[cond][shot]["whole_dataset"][metric]
+                        lower, upper = intervals[metric]
+                        row.append(f"{val:.2f} [{lower:.2f}, {upper:.2f}]")
+                    interval_rows.append(row)
+            for a, b in [("0shot", "5shot"), ("0shot", "8shot"), ("5shot", "8shot")]:
+                if (cond, a) in per_example and (cond, b) in per_example:
+                    differences = bootstrap_difference(per_example[(cond, a)], per_example[(cond, b)], n_resamples=bootstrap)
+                    row = [f"{cond} {b} - {a}"]
+                    for metric in METRICS:
+                        difference, lower, upper = differences[metric]
+                        row.append(f"{difference:+.2f} [{lower:+.2f}, {upper:+.2f}]")
+                    interval_rows.append(row)
+        interval_table = tabulate(interval_rows, headers=["Whole Dataset (95% CI)"] + [m.capitalize() for m in METRICS], tablefmt="grid")
+        print(f"\nBOOTSTRAP CONFIDENCE INTERVALS ({bootstrap} resamples):\n")
+        print(interval_table)
+    
     # Save table to file
     with open(os.path.join(base_path, 'evaluation_results_table.txt'), 'w') as f:
         f.write("COMPREHENSIVE EVALUATION RESULTS:\n\n")
         f.write(table)
+        if interval_table:
+            f.write(f"\n\nBOOTSTRAP CONFIDENCE INTERVALS ({bootstrap} resamples):\n\n")
+            f.write(interval_table)
     
     print(f"\nTable saved to {os.path.join(base_path, 'evaluation_results_table.txt')}")
     
@@ -299,8 +536,6 @@ def evaluate_experiment_results():
 
 # Add a main block to run the evaluation when script is executed directly
 if __name__ == "__main__":
-    import json
-    
     # Check if we're evaluating a specific experiment or all experiments
     import sys
     if len(sys.argv) > 1 and sys.argv[1] == "--all":
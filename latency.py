@@ -0,0 +1,217 @@
+"""
+Per-stage latency histograms for the classification pipeline.
+
+Stages (preprocessing, prompt assembly, the LLM network call, response
+parsing, persistence) are timed with the monotonic clock:
+
+    with span("llm_call"):
+        response = client.models.generate_content(...)
+
+Each stage feeds a histogram with fixed bucket bounds, so recording costs a
+bucket search and three additions whatever the number of calls. Percentiles
+(p50/p95/p99) are interpolated inside the bucket that holds them.
+
+Instrumentation is off unless EMAILLM_LATENCY=1 (or enable() is called).
+When it is off, span() returns a shared no-op context manager and nothing
+is timed or stored.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Any, List, Optional, Tuple
+
+LATENCY_ENABLED = os.getenv("EMAILLM_LATENCY", "").lower() in ("1", "true", "yes")
+
+# Upper bounds of the histogram buckets in seconds (the last bucket is unbounded)
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+# Stages in the order a request goes through them, for the summary
+PIPELINE_STAGES = ["preprocessing", "prompt_assembly", "llm_call", "parsing", "persistence"]
+
+_NO_SPAN = nullcontext()
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket histogram of durations in seconds.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float, count: int = 1) -> None:
+        """Add `count` observations of a duration."""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += count
+        self.count += count
+        self.sum += seconds * count
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """
+        Approximate q-quantile (0 <= q <= 1), interpolated linearly within its bucket.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+    def cumulative_counts(self) -> List[int]:
+        """Counts of observations <= each bucket bound, then the total (Prometheus layout)."""
+        cumulative, total = [], 0
+        for bucket_count in self.counts:
+            total += bucket_count
+            cumulative.append(total)
+        return cumulative
+
+
+class LatencyRecorder:
+    """
+    Latency histograms by stage.
+
+    Example:
+        recorder = get_latency_recorder()
+        with recorder.span("parsing"):
+            result = parse_classification_response(text)
+        print(recorder.summary()["parsing"]["p95_ms"])
+    """
+
+    def __init__(self, enabled: bool = LATENCY_ENABLED, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            enabled: Whether spans are timed
+            buckets: Upper bounds of the histogram buckets in seconds
+        """
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, count: int = 1) -> None:
+        """Record `count` occurrences of a stage taking `seconds` each."""
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram(self.buckets)
+            histogram.observe(seconds, count)
+
+    @contextmanager
+    def _timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def span(self, stage: str):
+        """Context manager timing its block as one occurrence of `stage` (no-op when disabled)."""
+        if not self.enabled:
+            return _NO_SPAN
+        return self._timed(stage)
+
+    def reset(self) -> None:
+        """Drop every recorded duration."""
+        with self._lock:
+            self.histograms = {}
+
+    def snapshot(self) -> List[Tuple[str, List[int], float]]:
+        """(stage, cumulative bucket counts, sum of seconds) of every stage, for exporters."""
+        with self._lock:
+            return [(stage, histogram.cumulative_counts(), histogram.sum)
+                    for stage, histogram in self.histograms.items()]
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Count, mean, p50/p95/p99 and max of each stage, in milliseconds.
+        """
+        with self._lock:
+            histograms = dict(self.histograms)
+        ordered = [stage for stage in PIPELINE_STAGES if stage in histograms]
+        ordered += sorted(stage for stage in histograms if stage not in PIPELINE_STAGES)
+        summary = {}
+        for stage in ordered:
+            histogram = histograms[stage]
+            summary[stage] = {
+                "count": histogram.count,
+                "mean_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                "p50_ms": histogram.quantile(0.5) * 1000,
+                "p95_ms": histogram.quantile(0.95) * 1000,
+                "p99_ms": histogram.quantile(0.99) * 1000,
+                "max_ms": histogram.max * 1000
+            }
+        return summary
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_latency_recorder() -> LatencyRecorder:
+    """
+    Return the process-wide latency recorder, creating it on first use.
+    """
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = LatencyRecorder()
+    return _recorder
+
+
+def span(stage: str):
+    """Time a block as one occurrence of a stage on the process-wide recorder."""
+    recorder = _recorder or get_latency_recorder()
+    if not recorder.enabled:
+        return _NO_SPAN
+    return recorder._timed(stage)
+
+
+def observe(stage: str, seconds: float, count: int = 1) -> None:
+    """Record a measured duration on the process-wide recorder (ignored when disabled)."""
+    recorder = _recorder or get_latency_recorder()
+    if recorder.enabled:
+        recorder.observe(stage, seconds, count)
+
+
+def enable(enabled: bool = True) -> None:
+    """Turn instrumentation on or off for the process-wide recorder."""
+    get_latency_recorder().enabled = enabled
+
+
+def display_latency_summary(stages: Optional[List[str]] = None):
+    """
+    Display the latency of each pipeline stage.
+
+    Args:
+        stages: Stages to show (defaults to every recorded stage)
+    """
+    recorder = get_latency_recorder()
+    if not recorder.enabled:
+        return
+    summary = recorder.summary()
+    if stages is not None:
+        summary = {stage: summary[stage] for stage in stages if stage in summary}
+    if not summary:
+        print("Latency: no stages recorded")
+        return
+    print(f"{'Stage':<18} {'Count':>8} {'Mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'Max ms':>10}")
+    for stage, stats in summary.items():
+        print(f"{stage:<18} {stats['count']:>8} {stats['mean_ms']:>10.2f} {stats['p50_ms']:>10.2f} "
+              f"{stats['p95_ms']:>10.2f} {stats['p99_ms']:>10.2f} {stats['max_ms']:>10.2f}")
@@ -0,0 +1,197 @@
+"""
+Persistent, content-addressed cache for LLM responses.
+
+Responses are stored in a SQLite database keyed by a SHA-256 hash of the full
+request (model, system instruction, content, temperature, max output tokens),
+so re-running an experiment grid or re-classifying an email in the UI does not
+call Gemini again for a request it has already answered.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+
+DEFAULT_CACHE_PATH = os.getenv(
+    "EMAILLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.sqlite3")
+)
+DEFAULT_MAX_BYTES = int(os.getenv("EMAILLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def make_cache_key(model: str, instruction: str, content: str, temperature: float, max_output_tokens: int) -> str:
+    """
+    Build a stable cache key for an LLM request.
+
+    Args:
+        model: The model used for generation
+        instruction: The system instruction
+        content: The request content
+        temperature: Sampling temperature
+        max_output_tokens: Output token limit
+
+    Returns:
+        Hex digest identifying the request
+    """
+    payload = json.dumps({
+        "model": model,
+        "instruction": instruction,
+        "content": content,
+        "temperature": temperature,
+        "max_output_tokens": max_output_tokens
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite-backed response cache with size-based LRU eviction.
+
+    When `bypass` is set, lookups always miss but fresh responses are still
+    written, which refreshes the stored entries.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES, bypass: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Cache key from make_cache_key
+
+        Returns:
+            The cached response text, or None on a miss
+        """
+        if self.bypass:
+            self.misses += 1
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Store a response, evicting least recently used entries if the cache
+        grows beyond max_bytes.
+
+        Args:
+            key: Cache key from make_cache_key
+            response: The response text to store
+        """
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._total_bytes -= row[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time())
+            )
+            self._total_bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # Drop the oldest entries in batches until we are back under budget
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return cache counters.
+
+        Returns:
+            Dictionary with hits, misses, evictions, entries and size in bytes
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_bytes": self._total_bytes
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """
+    Return the shared response cache, creating it on first use.
+
+    Set EMAILLM_CACHE_BYPASS=1 to skip lookups for this process. With the mock
+    LLM client (EMAILLM_MOCK_LLM=1) the cache is kept in memory, so mock
+    responses never end up in the persistent cache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            bypass = os.getenv("EMAILLM_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+            if os.getenv("EMAILLM_MOCK_LLM", "").lower() in ("1", "true", "yes"):
+                _cache = LLMResponseCache(path=":memory:", bypass=bypass)
+            else:
+                _cache = LLMResponseCache(bypass=bypass)
+        return _cache
+
+
+def display_cache_summary():
+    """
+    Display a summary of LLM cache usage.
+    """
+    stats = get_llm_cache().stats()
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = stats["hits"] / lookups if lookups else 0
+    print(f"LLM cache hits: {stats['hits']}")
+    print(f"LLM cache misses: {stats['misses']}")
+    print(f"LLM cache hit rate: {hit_rate:.2%}")
+    print(f"LLM cache entries: {stats['entries']} ({stats['size_bytes']} bytes)")
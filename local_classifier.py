@@ -0,0 +1,380 @@
+"""
+CPU-only first stage of the classification cascade.
+
+Emails are turned into hashed word unigram/bigram TF-IDF vectors and scored by
+a one-vs-rest logistic regression, one probability per keyword. Every keyword
+has two thresholds calibrated on out-of-fold predictions: a probability at or
+above `hi` is a confident "yes", at or below `lo` a confident "no". An email is
+resolved locally only when every keyword is confident and at least one is a
+"yes"; all other emails go on to the LLM (classify_email). Confident "no" on
+every keyword is not trusted by default: the per-keyword errors add up, and
+"Non" is rare in the QTM data.
+
+Training data:
+- data/qtm_emails_final_version.json, labels in `category`
+- data/Emory_Report_Labelled.json, labels in `label`
+"Non" means no keyword applies.
+
+numpy is imported on first use so importing this module stays cheap.
+
+Usage:
+    python local_classifier.py
+"""
+
+import json
+import math
+import os
+import re
+import zlib
+from collections import Counter
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+QTM_DATA_PATH = os.path.join(REPO_ROOT, "data", "qtm_emails_final_version.json")
+EMORY_REPORT_DATA_PATH = os.path.join(REPO_ROOT, "data", "Emory_Report_Labelled.json")
+
+# Precision required of every local yes/no decision (on out-of-fold predictions)
+DEFAULT_TARGET_PRECISION = float(os.getenv("EMAILLM_CASCADE_PRECISION", "0.95"))
+DEFAULT_FOLDS = 5
+
+# A threshold is only set when at least this many out-of-fold predictions back it
+MIN_THRESHOLD_SUPPORT = 5
+
+N_FEATURES = 1 << 20
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+NO_KEYWORD_LABEL = "non"
+
+
+def email_text(email: Dict[str, Any]) -> str:
+    """Text the classifier sees: subject and content, as sent to the LLM."""
+    return (email.get("subject") or "") + " " + (email.get("content") or "")
+
+
+def email_labels(email: Dict[str, Any]) -> List[str]:
+    """
+    Return the lowercased ground-truth keywords of a labelled email.
+
+    Args:
+        email: Email with a `category` list or a `label` string
+
+    Returns:
+        List of keywords; empty when the email is labelled "Non"
+    """
+    labels = email.get("category", email.get("label", []))
+    if isinstance(labels, str):
+        labels = [labels]
+    return sorted({label.strip().lower() for label in labels if label.strip().lower() != NO_KEYWORD_LABEL})
+
+
+def load_labelled_emails(paths: Sequence[str] = (QTM_DATA_PATH, EMORY_REPORT_DATA_PATH)) -> List[Dict[str, Any]]:
+    """Load and concatenate labelled email datasets, skipping missing files."""
+    emails = []
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                emails.extend(json.load(f))
+        else:
+            print(f"Warning: labelled data not found: {path}")
+    return emails
+
+
+def hashed_ngrams(text: str) -> Counter:
+    """
+    Count hashed word unigrams and bigrams of a text.
+
+    crc32 is used instead of hash() so feature ids are the same in every process.
+    """
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return Counter(zlib.crc32(gram.encode("utf-8")) % N_FEATURES for gram in grams)
+
+
+class HashedTfidf:
+    """
+    TF-IDF over hashed n-grams with sublinear term frequency and l2-normalized rows.
+
+    Only features seen during fit get a column; unseen ones are ignored.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.idf = None
+
+    def fit(self, texts: Sequence[str]) -> "HashedTfidf":
+        import numpy as np
+
+        counts = [hashed_ngrams(text) for text in texts]
+        df = Counter(feature for count in counts for feature in count)
+        self.columns = {feature: column for column, feature in enumerate(sorted(df))}
+        n = len(texts)
+        self.idf = np.array([math.log((1 + n) / (1 + df[feature])) + 1 for feature in sorted(df)], dtype=np.float32)
+        return self
+
+    def transform(self, texts: Sequence[str]):
+        """
+        Vectorize texts.
+
+        Returns:
+            Dense float32 matrix of shape (len(texts), number of columns)
+        """
+        import numpy as np
+
+        matrix = np.zeros((len(texts), len(self.columns)), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in hashed_ngrams(text).items():
+                column = self.columns.get(feature)
+                if column is not None:
+                    matrix[row, column] = (1 + math.log(count)) * self.idf[column]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+class LinearMultiLabel:
+    """
+    One-vs-rest logistic regression trained by full-batch gradient descent
+    with Nesterov momentum, L2 regularization and balanced class weights.
+
+    Every gradient step adds a combination of training rows to the weights,
+    so they are kept as W = X.T @ A and the descent runs on the n x n Gram
+    matrix; with far fewer emails than n-gram features this is much cheaper.
+    """
+
+    def __init__(self, l2: float = 1e-3, learning_rate: float = 2.0, epochs: int = 300):
+        self.l2 = l2
+        self.learning_rate = learning_rate
+        self.epochs = epochs
+        self.weights = None
+        self.bias = None
+
+    def fit(self, X, Y) -> "LinearMultiLabel":
+        import numpy as np
+
+        n = X.shape[0]
+        positives = Y.sum(axis=0)
+        # Balanced weights: each label's positives and negatives count equally
+        pos_weight = np.where(positives > 0, n / (2 * np.maximum(positives, 1)), 1.0)
+        neg_weight = np.where(positives < n, n / (2 * np.maximum(n - positives, 1)), 1.0)
+        sample_weight = Y * pos_weight + (1 - Y) * neg_weight
+
+        gram = X @ X.T
+        A = np.zeros((n, Y.shape[1]), dtype=np.float32)
+        b = np.zeros(Y.shape[1], dtype=np.float32)
+        A_velocity, b_velocity = np.zeros_like(A), np.zeros_like(b)
+        momentum = 0.9
+        for _ in range(self.epochs):
+            A_ahead, b_ahead = A + momentum * A_velocity, b + momentum * b_velocity
+            error = (self._sigmoid(gram @ A_ahead + b_ahead) - Y) * sample_weight / n
+            A_velocity = momentum * A_velocity - self.learning_rate * (error + self.l2 * A_ahead)
+            b_velocity = momentum * b_velocity - self.learning_rate * error.sum(axis=0)
+            A, b = A + A_velocity, b + b_velocity
+        self.weights, self.bias = X.T @ A, b
+        return self
+
+    def predict_proba(self, X):
+        return self._sigmoid(X @ self.weights + self.bias)
+
+    @staticmethod
+    def _sigmoid(z):
+        import numpy as np
+
+        return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+def calibrate_thresholds(probabilities, Y, target_precision: float) -> Tuple[Any, Any]:
+    """
+    Pick per-label confidence thresholds from out-of-fold probabilities.
+
+    For each label, `hi` is the lowest probability such that emails scoring at
+    or above it are positives with at least `target_precision`, and `lo` the
+    highest probability such that emails at or below it are negatives with at
+    least `target_precision`. A side that cannot reach the target (or has fewer
+    than MIN_THRESHOLD_SUPPORT emails) is disabled (hi = inf, lo = -inf).
+
+    Returns:
+        Tuple of (lo, hi) arrays, one entry per label
+    """
+    import numpy as np
+
+    n_labels = Y.shape[1]
+    lo = np.full(n_labels, -np.inf)
+    hi = np.full(n_labels, np.inf)
+    for label in range(n_labels):
+        p, y = probabilities[:, label], Y[:, label]
+        order = np.argsort(-p, kind="stable")
+        p_desc, y_desc = p[order], y[order]
+        counts = np.arange(1, len(p) + 1)
+
+        # Precision of "p >= p_desc[k]" for every cut, counting ties together
+        precision = np.cumsum(y_desc) / counts
+        last_of_tie = np.r_[p_desc[1:] != p_desc[:-1], True]
+        ok = last_of_tie & (precision >= target_precision) & (counts >= MIN_THRESHOLD_SUPPORT)
+        if ok.any():
+            hi[label] = p_desc[np.nonzero(ok)[0].max()]
+
+        # Negative predictive value of "p <= p_asc[k]"
+        p_asc, y_asc = p_desc[::-1], y_desc[::-1]
+        npv = np.cumsum(1 - y_asc) / counts
+        last_of_tie = np.r_[p_asc[1:] != p_asc[:-1], True]
+        ok = last_of_tie & (npv >= target_precision) & (counts >= MIN_THRESHOLD_SUPPORT) & (p_asc < hi[label])
+        if ok.any():
+            lo[label] = p_asc[np.nonzero(ok)[0].max()]
+    return lo, hi
+
+
+def fold_indices(n: int, folds: int) -> List[List[int]]:
+    """Split range(n) into interleaved folds (deterministic, keeps segments mixed)."""
+    return [list(range(fold, n, folds)) for fold in range(min(folds, n))]
+
+
+class LocalCascade:
+    """
+    Local multi-label classifier that only answers when it is confident.
+
+    Example:
+        cascade = LocalCascade().fit(load_labelled_emails())
+        keywords = cascade.decide_many(emails)  # None where the LLM is needed
+    """
+
+    def __init__(self, target_precision: float = DEFAULT_TARGET_PRECISION, folds: int = DEFAULT_FOLDS,
+                 allow_empty: bool = False):
+        self.target_precision = target_precision
+        self.folds = folds
+        self.allow_empty = allow_empty
+        self.labels = []
+        self.vectorizer = None
+        self.model = None
+        self.lo = None
+        self.hi = None
+
+    def _train(self, emails: Sequence[Dict[str, Any]]) -> Tuple[HashedTfidf, LinearMultiLabel]:
+        import numpy as np
+
+        texts = [email_text(email) for email in emails]
+        vectorizer = HashedTfidf().fit(texts)
+        Y = np.array([[label in email_labels(email) for label in self.labels] for email in emails], dtype=np.float32)
+        model = LinearMultiLabel().fit(vectorizer.transform(texts), Y)
+        return vectorizer, model
+
+    def fit(self, emails: Sequence[Dict[str, Any]]) -> "LocalCascade":
+        """
+        Train on labelled emails and calibrate thresholds with k-fold
+        out-of-fold predictions.
+
+        Args:
+            emails: Emails with `category` or `label`
+
+        Returns:
+            self
+        """
+        import numpy as np
+
+        self.labels = sorted({label for email in emails for label in email_labels(email)})
+        Y = np.array([[label in email_labels(email) for label in self.labels] for email in emails], dtype=np.float32)
+
+        out_of_fold = np.zeros_like(Y)
+        for held_out in fold_indices(len(emails), self.folds):
+            held_out_set = set(held_out)
+            vectorizer, model = self._train([email for i, email in enumerate(emails) if i not in held_out_set])
+            out_of_fold[held_out] = model.predict_proba(vectorizer.transform([email_text(emails[i]) for i in held_out]))
+
+        self.lo, self.hi = calibrate_thresholds(out_of_fold, Y, self.target_precision)
+        self.vectorizer, self.model = self._train(emails)
+        return self
+
+    def predict_proba(self, emails: Sequence[Dict[str, Any]]):
+        """Return the (len(emails), len(labels)) matrix of keyword probabilities."""
+        return self.model.predict_proba(self.vectorizer.transform([email_text(email) for email in emails]))
+
+    def decide_many(self, emails: Sequence[Dict[str, Any]]) -> List[Optional[List[str]]]:
+        """
+        Classify emails locally where every keyword decision is confident.
+
+        Args:
+            emails: Emails with `subject` and `content`
+
+        Returns:
+            For each email, its keywords (empty, meaning "Non", only with
+            allow_empty) or None when the email has to go to the LLM
+        """
+        if not emails:
+            return []
+        probabilities = self.predict_proba(emails)
+        decisions = []
+        for row in probabilities:
+            keywords = None
+            if all(p >= hi or p <= lo for p, lo, hi in zip(row, self.lo, self.hi)):
+                keywords = [label for label, p, hi in zip(self.labels, row, self.hi) if p >= hi]
+                if not keywords and not self.allow_empty:
+                    keywords = None
+            decisions.append(keywords)
+        return decisions
+
+    def decide(self, email: Dict[str, Any]) -> Optional[List[str]]:
+        """Single-email form of decide_many."""
+        return self.decide_many([email])[0]
+
+
+def cross_fit_decisions(emails: Sequence[Dict[str, Any]], extra_training: Sequence[Dict[str, Any]] = (),
+                        target_precision: float = DEFAULT_TARGET_PRECISION,
+                        folds: int = DEFAULT_FOLDS) -> List[Optional[List[str]]]:
+    """
+    Local decisions for a labelled evaluation set, without scoring any email
+    with a cascade that was trained on it.
+
+    The emails are split into folds; each fold is decided by a cascade trained
+    on the other folds plus `extra_training`.
+
+    Args:
+        emails: Labelled emails to decide
+        extra_training: Additional labelled emails used for training only
+        target_precision: Precision required of local decisions
+        folds: Number of folds
+
+    Returns:
+        Decisions aligned with `emails` (see LocalCascade.decide_many)
+    """
+    decisions = [None] * len(emails)
+    for held_out in fold_indices(len(emails), folds):
+        held_out_set = set(held_out)
+        training = [email for i, email in enumerate(emails) if i not in held_out_set] + list(extra_training)
+        cascade = LocalCascade(target_precision=target_precision, folds=folds).fit(training)
+        for i, decision in zip(held_out, cascade.decide_many([emails[i] for i in held_out])):
+            decisions[i] = decision
+    return decisions
+
+
+def build_local_classification(keywords: List[str]) -> Dict[str, Any]:
+    """Classification result for a locally resolved email, shaped like parse_classification_response output."""
+    return {
+        'relevant_keywords': keywords,
+        'raw_result': "KEYWORDS: " + (", ".join(keywords) if keywords else "Non"),
+        'source': 'local'
+    }
+
+
+if __name__ == "__main__":
+    # Offline estimate of the cascade: decide the QTM emails out-of-fold, then
+    # swap the local answers into each saved LLM run and compare metrics
+    import time
+    from final_eval import print_cascade_report
+
+    with open(QTM_DATA_PATH, "r", encoding="utf-8") as f:
+        qtm_emails = json.load(f)
+    emory_emails = load_labelled_emails([EMORY_REPORT_DATA_PATH])
+
+    start = time.perf_counter()
+    decisions = cross_fit_decisions(qtm_emails, extra_training=emory_emails)
+    print(f"Cross-fitted decisions in {time.perf_counter() - start:.2f}s")
+
+    results_dir = os.path.join(REPO_ROOT, "final_experiments")
+    for filename in sorted(os.listdir(results_dir)):
+        if not filename.endswith(".json") or filename.endswith("_token_usage.json"):
+            continue
+        with open(os.path.join(results_dir, filename), "r") as f:
+            llm_output = json.load(f)
+        cascade_output = [
+            dict(record, predicted_classification=build_local_classification(decision)) if decision is not None else record
+            for record, decision in zip(llm_output, decisions)
+        ]
+        print(f"\n{filename}")
+        print_cascade_report(qtm_emails, cascade_output, baseline_output=llm_output)
@@ -0,0 +1,319 @@
+"""
+Deterministic local stand-in for the Gemini client, for offline load tests.
+
+MockClient implements the parts of google-genai's client the pipeline uses:
+client.models.generate_content, client.aio.models.generate_content and
+client.caches.create/update/delete. It never touches the network.
+
+Responses are, in order of preference:
+1. Replayed: the raw_result recorded for the same email content in saved
+   runs (final_experiments/*shot.json by default), looked up by a SHA-256 of
+   the request content. When several runs hold a result for the content,
+   one is picked by a hash of the instruction, so a configuration gets the
+   same answer every time.
+2. Scripted: one of the responses in the EMAILLM_MOCK_SCRIPT file (a JSON
+   string or list of strings), picked by a hash of the request.
+3. "KEYWORDS: NONE".
+
+Latency (log-normal around a median), server errors (503) and throttling
+(429 RESOURCE_EXHAUSTED) are injected at configurable rates. Every random
+draw is seeded by the request and how many times it has been sent, so a run
+sees the same latencies and failures whatever the order calls are made in,
+and a throttled request can succeed when it is retried.
+
+Select it with EMAILLM_MOCK_LLM=1 in final_experiments.py or
+tryout/email_classifier.py. Other settings:
+    EMAILLM_MOCK_REPLAY              Run file or directory to replay ("" disables replay)
+    EMAILLM_MOCK_SCRIPT              Path to a JSON list of scripted responses
+    EMAILLM_MOCK_LATENCY_MS          Median latency per call (default 0)
+    EMAILLM_MOCK_LATENCY_SIGMA       Spread of the log-normal latency (default 0.5)
+    EMAILLM_MOCK_ERROR_RATE          Fraction of calls failing with 503 UNAVAILABLE
+    EMAILLM_MOCK_RATE_LIMIT_RATE     Fraction of calls failing with 429 RESOURCE_EXHAUSTED
+    EMAILLM_MOCK_RETRY_DELAY         Retry delay in seconds sent with 429s (0 sends none)
+    EMAILLM_MOCK_SEED                Seed of the random draws
+
+Usage:
+    python mock_llm.py    # show how many dataset emails the replay index covers
+"""
+
+import asyncio
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, Any, List, Optional
+
+from final_eval import DEFAULT_DATASET_PATH
+from token_tracker import DEFAULT_CHARS_PER_TOKEN
+
+MOCK_LLM_ENABLED = os.getenv("EMAILLM_MOCK_LLM", "").lower() in ("1", "true", "yes")
+
+DEFAULT_REPLAY_PATH = os.getenv(
+    "EMAILLM_MOCK_REPLAY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "final_experiments"))
+DEFAULT_SCRIPT_PATH = os.getenv("EMAILLM_MOCK_SCRIPT", "")
+DEFAULT_LATENCY_MS = float(os.getenv("EMAILLM_MOCK_LATENCY_MS", "0"))
+DEFAULT_LATENCY_SIGMA = float(os.getenv("EMAILLM_MOCK_LATENCY_SIGMA", "0.5"))
+DEFAULT_ERROR_RATE = float(os.getenv("EMAILLM_MOCK_ERROR_RATE", "0"))
+DEFAULT_RATE_LIMIT_RATE = float(os.getenv("EMAILLM_MOCK_RATE_LIMIT_RATE", "0"))
+DEFAULT_RETRY_DELAY = float(os.getenv("EMAILLM_MOCK_RETRY_DELAY", "0"))
+DEFAULT_SEED = int(os.getenv("EMAILLM_MOCK_SEED", "0"))
+
+DEFAULT_RESPONSE = "KEYWORDS: NONE"
+
+
+class MockAPIError(Exception):
+    """
+    Injected API failure, shaped like google-genai's APIError (code, status,
+    message) so the rate limiter classifies it the same way.
+    """
+
+    def __init__(self, code: int, status: str, message: str):
+        super().__init__(f"{code} {status}. {message}")
+        self.code = code
+        self.status = status
+        self.message = message
+
+
+def content_hash(content: str) -> str:
+    """Replay key of a request's content."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def load_replay_index(path: str = DEFAULT_REPLAY_PATH,
+                      dataset_path: str = DEFAULT_DATASET_PATH) -> Dict[str, List[str]]:
+    """
+    Index the raw LLM responses of saved runs by the content they answered.
+
+    Saved records only keep the first 100 characters of the content, so the
+    full request ("<subject> <content>", as final_experiments.py sends it) is
+    rebuilt from the dataset by email id and checked against that prefix. The
+    body alone, which the Flask app sends, is indexed too.
+
+    Args:
+        path: A run's JSON file, or a directory of "*shot.json" runs
+        dataset_path: Dataset the runs classified
+
+    Returns:
+        Raw responses by content hash, in run file order
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    paths = sorted(glob.glob(os.path.join(path, "*shot.json"))) if os.path.isdir(path) else [path]
+    with open(dataset_path, "r", encoding="utf-8") as f:
+        emails = json.load(f)
+
+    index = {}
+    for run_path in paths:
+        with open(run_path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        for record in records:
+            email_id = record.get("email_id")
+            raw_result = (record.get("predicted_classification") or {}).get("raw_result")
+            if raw_result is None or not isinstance(email_id, int) or not 0 <= email_id < len(emails):
+                continue
+            email = emails[email_id]
+            content = email["subject"] + " " + email["content"]
+            if not record.get("email_content", "").startswith(content[:100]):
+                continue
+            index.setdefault(content_hash(content), []).append(raw_result)
+            index.setdefault(content_hash(email["content"]), []).append(raw_result)
+    return index
+
+
+def load_script(path: str = DEFAULT_SCRIPT_PATH) -> List[str]:
+    """Scripted responses from a JSON file holding a string or a list of strings."""
+    if not path:
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        script = json.load(f)
+    return [script] if isinstance(script, str) else list(script)
+
+
+class _Models:
+    def __init__(self, client: "MockClient"):
+        self._client = client
+
+    def generate_content(self, model: str, contents, config=None):
+        response, delay = self._client._respond(model, contents, config)
+        if delay:
+            time.sleep(delay)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class _AsyncModels:
+    def __init__(self, client: "MockClient"):
+        self._client = client
+
+    async def generate_content(self, model: str, contents, config=None):
+        response, delay = self._client._respond(model, contents, config)
+        if delay:
+            await asyncio.sleep(delay)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class _Caches:
+    def __init__(self, client: "MockClient"):
+        self._client = client
+
+    def create(self, model: str, config=None):
+        instruction = getattr(config, "system_instruction", None) or ""
+        name = "cachedContents/mock-" + content_hash(model + "\n" + instruction)[:16]
+        with self._client._lock:
+            self._client._cached_instructions[name] = instruction
+        return SimpleNamespace(name=name, model=model)
+
+    def update(self, name: str, config=None):
+        with self._client._lock:
+            if name not in self._client._cached_instructions:
+                raise MockAPIError(404, "NOT_FOUND", f"Cached content {name} not found")
+        return SimpleNamespace(name=name)
+
+    def delete(self, name: str):
+        with self._client._lock:
+            self._client._cached_instructions.pop(name, None)
+
+
+class MockClient:
+    """
+    Offline, deterministic replacement for google.genai.Client.
+
+    Example:
+        client = MockClient(latency_ms=300, rate_limit_rate=0.05)
+        response = client.models.generate_content(model="gemini-2.0-flash", contents=[content], config=config)
+        print(response.text, client.stats())
+    """
+
+    def __init__(self, replay_index: Optional[Dict[str, List[str]]] = None, script: Optional[List[str]] = None,
+                 responder: Optional[Callable[[str, str], Optional[str]]] = None,
+                 latency_ms: float = DEFAULT_LATENCY_MS, latency_sigma: float = DEFAULT_LATENCY_SIGMA,
+                 error_rate: float = DEFAULT_ERROR_RATE, rate_limit_rate: float = DEFAULT_RATE_LIMIT_RATE,
+                 retry_delay: float = DEFAULT_RETRY_DELAY, seed: int = DEFAULT_SEED):
+        """
+        Args:
+            replay_index: Raw responses by content hash (see load_replay_index)
+            script: Scripted responses for requests that are not replayed
+            responder: Optional function (content, instruction) -> response
+                text, tried before the script; None falls through
+            latency_ms: Median latency of a call in milliseconds
+            latency_sigma: Standard deviation of the log of the latency
+            error_rate: Fraction of calls failing with 503 UNAVAILABLE
+            rate_limit_rate: Fraction of calls failing with 429 RESOURCE_EXHAUSTED
+            retry_delay: Retry delay sent with 429s, in seconds (0 sends none)
+            seed: Seed of the latency and failure draws
+        """
+        self.replay_index = replay_index or {}
+        self.script = script or []
+        self.responder = responder
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_delay = retry_delay
+        self.seed = seed
+        self.models = _Models(self)
+        self.aio = SimpleNamespace(models=_AsyncModels(self))
+        self.caches = _Caches(self)
+        self._lock = threading.Lock()
+        self._attempts = {}
+        self._cached_instructions = {}
+        self.counts = {"calls": 0, "replayed": 0, "scripted": 0, "default": 0, "errors": 0, "rate_limited": 0}
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self.counts["calls"] += 1
+            self.counts[outcome] += 1
+
+    def _respond(self, model: str, contents, config):
+        # Returns (response or exception, seconds to wait before delivering it)
+        content = "".join(part if isinstance(part, str) else str(part) for part in contents) \
+            if isinstance(contents, (list, tuple)) else str(contents)
+        cached_name = getattr(config, "cached_content", None)
+        with self._lock:
+            if cached_name and cached_name not in self._cached_instructions:
+                self.counts["calls"] += 1
+                self.counts["errors"] += 1
+                return MockAPIError(404, "NOT_FOUND", f"Cached content {cached_name} not found"), 0.0
+            instruction = self._cached_instructions[cached_name] if cached_name else (
+                getattr(config, "system_instruction", None) or "")
+            request_key = content_hash(f"{model}\n{instruction}\n{content}")
+            attempt = self._attempts.get(request_key, 0)
+            self._attempts[request_key] = attempt + 1
+
+        rng = random.Random(f"{self.seed}:{request_key}:{attempt}")
+        delay = 0.0
+        if self.latency_ms > 0:
+            delay = self.latency_ms / 1000 * math.exp(self.latency_sigma * rng.gauss(0, 1))
+
+        draw = rng.random()
+        if draw < self.rate_limit_rate:
+            self._count("rate_limited")
+            details = f" Please retry in {self.retry_delay:g}s. 'retryDelay': '{self.retry_delay:g}s'" if self.retry_delay else ""
+            return MockAPIError(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)." + details), delay
+        if draw < self.rate_limit_rate + self.error_rate:
+            self._count("errors")
+            return MockAPIError(503, "UNAVAILABLE", "The model is overloaded. Please try again later."), delay
+
+        text, outcome = self._text(content, instruction)
+        self._count(outcome)
+        return self._response(text, content, instruction, cached=bool(cached_name)), delay
+
+    def _text(self, content: str, instruction: str):
+        choices = self.replay_index.get(content_hash(content))
+        if choices:
+            return choices[int(content_hash(instruction), 16) % len(choices)], "replayed"
+        if self.responder is not None:
+            text = self.responder(content, instruction)
+            if text is not None:
+                return text, "scripted"
+        if self.script:
+            return self.script[int(content_hash(instruction + "\n" + content), 16) % len(self.script)], "scripted"
+        return DEFAULT_RESPONSE, "default"
+
+    @staticmethod
+    def _response(text: str, content: str, instruction: str, cached: bool):
+        # Token counts estimated from characters, like token_tracker before any real call
+        instruction_tokens = int(len(instruction) / DEFAULT_CHARS_PER_TOKEN)
+        prompt_tokens = int(len(content) / DEFAULT_CHARS_PER_TOKEN) + instruction_tokens
+        completion_tokens = max(1, int(len(text) / DEFAULT_CHARS_PER_TOKEN))
+        usage = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            cached_content_token_count=instruction_tokens if cached else 0,
+            candidates_token_count=completion_tokens,
+            total_token_count=prompt_tokens + completion_tokens
+        )
+        part = SimpleNamespace(text=text)
+        candidate = SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason="STOP")
+        return SimpleNamespace(text=text, candidates=[candidate], usage_metadata=usage)
+
+    def stats(self) -> Dict[str, Any]:
+        """Calls made and how each was answered."""
+        with self._lock:
+            return dict(self.counts)
+
+
+def create_mock_client() -> MockClient:
+    """
+    Build a MockClient from the EMAILLM_MOCK_* environment variables.
+    """
+    replay_index = load_replay_index()
+    script = load_script()
+    print(f"Using the mock LLM client: {len(replay_index)} replayable contents, {len(script)} scripted responses")
+    return MockClient(replay_index=replay_index, script=script)
+
+
+if __name__ == "__main__":
+    with open(DEFAULT_DATASET_PATH, "r", encoding="utf-8") as f:
+        dataset = json.load(f)
+    index = load_replay_index()
+    covered = sum(1 for email in dataset if content_hash(email["subject"] + " " + email["content"]) in index)
+    print(f"Replay index: {len(index)} request contents from {DEFAULT_REPLAY_PATH}")
+    print(f"Dataset emails with a recorded response: {covered}/{len(dataset)}")
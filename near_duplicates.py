@@ -0,0 +1,241 @@
+"""
+Near-duplicate detection for repetitive bulk mail (MinHash + LSH).
+
+Each email is reduced to the set of its word shingles (overlapping n-word
+windows) and summarized by a MinHash signature, whose agreement rate between
+two emails estimates the Jaccard similarity of their shingle sets. Signatures
+are split into LSH bands so that only emails sharing a band bucket are
+compared.
+
+Clustering is greedy and streaming: an email joins the most similar existing
+representative with estimated similarity >= threshold, otherwise it becomes a
+new representative. Every member is therefore similar to its own
+representative, so the representative's classification can be copied to it.
+
+numpy is imported on first use so importing this module stays cheap.
+
+Usage:
+    python near_duplicates.py
+"""
+
+import os
+import re
+import zlib
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+DEFAULT_THRESHOLD = float(os.getenv("EMAILLM_DEDUP_THRESHOLD", "0.8"))
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 3
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str, shingle_size: int = DEFAULT_SHINGLE_SIZE) -> List[int]:
+    """
+    Return the distinct 32-bit hashes of a text's word shingles.
+
+    Texts shorter than `shingle_size` words form a single shingle.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < shingle_size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+    return sorted({zlib.crc32(gram.encode("utf-8")) for gram in grams})
+
+
+@lru_cache(maxsize=None)
+def optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Choose LSH (bands, rows per band) for a similarity threshold.
+
+    Minimizes the probability mass of false candidates below the threshold
+    plus missed pairs above it, integrated over similarity.
+
+    Returns:
+        Tuple of (bands, rows)
+    """
+    steps = 200
+
+    def integrate(f, lo, hi):
+        width = (hi - lo) / steps
+        return sum(f(lo + (i + 0.5) * width) for i in range(steps)) * width
+
+    best, best_error = (num_perm, 1), float("inf")
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        if rows == 0:
+            continue
+        false_positive = integrate(lambda s: 1 - (1 - s ** rows) ** bands, 0.0, threshold)
+        false_negative = integrate(lambda s: (1 - s ** rows) ** bands, threshold, 1.0)
+        if false_positive + false_negative < best_error:
+            best, best_error = (bands, rows), false_positive + false_negative
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index that clusters near-identical emails around representatives.
+
+    Example:
+        index = NearDuplicateIndex(threshold=0.8)
+        representatives = index.cluster(texts)  # representatives[i] == i for representatives
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = DEFAULT_NUM_PERM,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE, seed: int = 1):
+        """
+        Args:
+            threshold: Minimum estimated Jaccard similarity to join a cluster
+            num_perm: Number of MinHash permutations (signature length)
+            shingle_size: Number of words per shingle
+            seed: Seed of the hash permutations
+        """
+        import numpy as np
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+
+        # Multiply-shift hashing: h(x) = ((a * x + b) mod 2^64) >> 32, with a odd
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+        self.signatures = {}
+        self.buckets = [defaultdict(list) for _ in range(self.bands)]
+
+    def signature(self, text: str):
+        """Return the MinHash signature (uint32 array of length num_perm) of a text."""
+        import numpy as np
+
+        shingles = np.array(shingle_hashes(text, self.shingle_size), dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            hashes = (self._a[:, None] * shingles[None, :] + self._b[:, None]) >> np.uint64(32)
+        return hashes.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def query(self, signature) -> Tuple[Optional[Any], float]:
+        """
+        Find the most similar indexed representative for a signature.
+
+        Returns:
+            Tuple of (representative key, estimated similarity), or (None, 0.0)
+            when no representative reaches the threshold
+        """
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(key, ()))
+
+        best, best_similarity = None, 0.0
+        for candidate in candidates:
+            similarity = float((self.signatures[candidate] == signature).mean())
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        return best, best_similarity
+
+    def add(self, key: Any, signature) -> None:
+        """Index a signature as a cluster representative."""
+        self.signatures[key] = signature
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self.buckets[band][band_key].append(key)
+
+    def assign(self, key: Any, text: str) -> Any:
+        """
+        Put a text in a cluster.
+
+        Args:
+            key: Identifier of the text (e.g. email index or id)
+            text: Email text
+
+        Returns:
+            Key of the text's representative (`key` itself if it starts a new cluster)
+        """
+        signature = self.signature(text)
+        representative, _ = self.query(signature)
+        if representative is None:
+            self.add(key, signature)
+            return key
+        return representative
+
+    def cluster(self, texts: Sequence[str]) -> List[int]:
+        """
+        Cluster texts in order.
+
+        Returns:
+            For each text, the index of its representative
+        """
+        return [self.assign(i, text) for i, text in enumerate(texts)]
+
+
+def cluster_near_duplicates(texts: Sequence[str], threshold: float = DEFAULT_THRESHOLD,
+                            groups: Optional[Sequence[Any]] = None) -> List[int]:
+    """
+    Cluster near-identical texts.
+
+    Args:
+        texts: Texts to cluster
+        threshold: Minimum estimated Jaccard similarity to a representative
+        groups: Optional group of each text; texts are only clustered with
+            texts of the same group
+
+    Returns:
+        For each text, the index of its representative
+    """
+    if groups is None:
+        return NearDuplicateIndex(threshold=threshold).cluster(texts)
+    members = defaultdict(list)
+    for i, group in enumerate(groups):
+        members[group].append(i)
+    representatives = [0] * len(texts)
+    for indices in members.values():
+        clustered = NearDuplicateIndex(threshold=threshold).cluster([texts[i] for i in indices])
+        for i, representative in zip(indices, clustered):
+            representatives[i] = indices[representative]
+    return representatives
+
+
+def summarize_clusters(representatives: Sequence[int]) -> Dict[str, Any]:
+    """
+    Count clusters and the classifier calls they save.
+
+    Returns:
+        Dictionary with emails, clusters, llm_calls_saved and the largest cluster size
+    """
+    sizes = defaultdict(int)
+    for representative in representatives:
+        sizes[representative] += 1
+    return {
+        "emails": len(representatives),
+        "clusters": len(sizes),
+        "llm_calls_saved": len(representatives) - len(sizes),
+        "largest_cluster": max(sizes.values(), default=0)
+    }
+
+
+if __name__ == "__main__":
+    # Cluster the labelled datasets at several thresholds and report the LLM
+    # calls saved and how often a member's labels differ from its representative's
+    import json
+    import time
+
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    for filename, label_key in (("qtm_emails_final_version.json", "category"), ("Emory_Report_Labelled.json", "label")):
+        with open(os.path.join(data_dir, filename), "r", encoding="utf-8") as f:
+            emails = json.load(f)
+        texts = [email["subject"] + " " + email["content"] for email in emails]
+        print(f"\n{filename} ({len(emails)} emails)")
+        for threshold in (0.5, 0.7, 0.8, 0.9):
+            start = time.perf_counter()
+            representatives = cluster_near_duplicates(texts, threshold=threshold)
+            seconds = time.perf_counter() - start
+            summary = summarize_clusters(representatives)
+            mismatched = sum(1 for i, r in enumerate(representatives)
+                             if i != r and emails[i][label_key] != emails[r][label_key])
+            print(f"threshold {threshold}: {summary['clusters']} clusters, {summary['llm_calls_saved']} calls saved, "
+                  f"largest {summary['largest_cluster']}, {mismatched} copied labels differ, {seconds * 1000:.0f} ms")
@@ -0,0 +1,327 @@
+"""
+Incremental evaluation of classification runs.
+
+OnlineEvaluator consumes output records (as written by final_experiments.py)
+one at a time and keeps running sums per segment, so every metric of
+final_eval.evaluate_email_classification is available at any point of a run
+at O(1) cost per record. Records can come from a live run, a saved JSON list
+or a JSONL stream.
+
+The segments come from the dataset's metadata (final_eval.load_segments), and
+a record is placed by its email index. If the same email is reported again
+(for example a retry after an error), the latest record replaces the
+earlier one. Error records (and placeholders for missing emails) are scored
+as empty predictions, like final_eval does, and counted separately.
+
+Usage:
+    python online_eval.py                      # replay the saved runs and check them against final_eval
+    python online_eval.py run.jsonl [dataset]  # evaluate a stream of records
+"""
+
+import json
+import math
+from collections import defaultdict
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from final_eval import METRICS, load_segments, predicted_keywords, DEFAULT_DATASET_PATH
+
+
+def example_metrics(predicted: set, true: set) -> Tuple[float, ...]:
+    """
+    Per-example metrics of one email, in METRICS order.
+
+    Uses the conventions of final_eval.per_example_metrics.
+    """
+    intersection = len(predicted & true)
+    union = len(predicted | true)
+    precision = intersection / len(predicted) if predicted else 1.0
+    recall = intersection / len(true) if true else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    jaccard = intersection / union if union else 1.0
+    accuracy = 1.0 if intersection > 0 else 0.0
+    return precision, recall, f1, jaccard, accuracy
+
+
+def iter_jsonl_records(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the records of a JSONL file, skipping blank and truncated lines.
+
+    A run that is still writing may end in a partial line; it is skipped
+    rather than failing the evaluation.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping unreadable line in {path}")
+
+
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the records of a saved run, either a JSON list or JSONL."""
+    if path.endswith(".jsonl"):
+        yield from iter_jsonl_records(path)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+
+
+class _Totals:
+    """Running sums of one segment."""
+
+    __slots__ = ("count", "sums", "squares", "tp", "fp", "fn", "correct")
+
+    def __init__(self):
+        self.count = 0
+        self.sums = [0.0] * len(METRICS)
+        self.squares = [0.0] * len(METRICS)
+        self.tp = self.fp = self.fn = self.correct = 0
+
+    def add(self, contribution, sign: int = 1) -> None:
+        values, tp, fp, fn = contribution
+        self.count += sign
+        for j, value in enumerate(values):
+            self.sums[j] += sign * value
+            self.squares[j] += sign * value * value
+        self.tp += sign * tp
+        self.fp += sign * fp
+        self.fn += sign * fn
+        self.correct += sign * (tp > 0)
+
+    def per_example(self) -> Dict[str, float]:
+        return {metric: self.sums[j] / self.count if self.count else 0 for j, metric in enumerate(METRICS)}
+
+    def global_metrics(self) -> Dict[str, float]:
+        precision = self.tp / (self.tp + self.fp) if (self.tp + self.fp) > 0 else 0
+        recall = self.tp / (self.tp + self.fn) if (self.tp + self.fn) > 0 else 0
+        f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+        accuracy = self.correct / self.count if self.count > 0 else 0
+        return {"precision": precision, "recall": recall, "f1": f1, "accuracy": accuracy}
+
+    def intervals(self, z: float) -> Dict[str, Tuple[float, float]]:
+        # Normal approximation from the running mean and variance
+        intervals = {}
+        for j, metric in enumerate(METRICS):
+            if self.count == 0:
+                intervals[metric] = (0.0, 0.0)
+                continue
+            mean = self.sums[j] / self.count
+            variance = max(0.0, self.squares[j] / self.count - mean * mean)
+            half_width = z * math.sqrt(variance / self.count)
+            intervals[metric] = (max(0.0, mean - half_width), min(1.0, mean + half_width))
+        return intervals
+
+
+class OnlineEvaluator:
+    """
+    Running evaluation metrics, updated one output record at a time.
+
+    Example:
+        evaluator = OnlineEvaluator(load_segments(dataset_path, length=len(emails)))
+        for record in iter_records("run.jsonl"):
+            evaluator.update(record)
+        results = evaluator.results()  # same layout as evaluate_email_classification
+    """
+
+    def __init__(self, segments: Optional[List[Dict[str, Any]]] = None):
+        """
+        Args:
+            segments: Segment definitions (see final_eval.load_segments); read
+                from the default dataset's metadata when not given
+        """
+        self.segments = load_segments() if segments is None else segments
+        self.whole = _Totals()
+        self.totals = [_Totals() for _ in self.segments]
+        self.confusion = defaultdict(int)
+        self.categories = set()
+        self.errors = set()
+        self.missing = set()
+        # Contribution of each email, so a later record for it replaces the earlier one
+        self._seen = {}
+
+    def segment_of(self, index: int) -> Optional[int]:
+        """Return the position in self.segments of the segment holding an email index."""
+        for position, segment in enumerate(self.segments):
+            end = segment["end"]
+            if segment["start"] <= index and (end is None or index < end):
+                return position
+        return None
+
+    def _remove(self, index: int) -> None:
+        previous = self._seen.pop(index, None)
+        if previous is None:
+            return
+        position, contribution, pair = previous
+        self.whole.add(contribution, -1)
+        if position is not None:
+            self.totals[position].add(contribution, -1)
+        if pair is not None:
+            self.confusion[pair] -= 1
+
+    def update(self, record: Dict[str, Any], index: Optional[int] = None) -> None:
+        """
+        Add one output record.
+
+        Args:
+            record: Output record with 'predicted_classification' (or 'error')
+                and 'actual_classification'
+            index: Position of the email in the dataset (defaults to the
+                record's 'email_id')
+        """
+        index = record.get("email_id") if index is None else index
+        self._remove(index)
+        true_labels = record.get("actual_classification") or []
+        self.categories.update(true_labels)
+
+        self.errors.discard(index)
+        self.missing.discard(index)
+        if record.get("missing"):
+            self.missing.add(index)
+        elif "predicted_classification" not in record:
+            self.errors.add(index)
+
+        predictions = predicted_keywords(record)
+        predicted, true = set(predictions), set(true_labels)
+        tp = len(predicted & true)
+        contribution = (example_metrics(predicted, true), tp, len(predicted) - tp, len(true) - tp)
+
+        position = self.segment_of(index) if isinstance(index, int) else None
+        pair = None
+        if position is not None:
+            self.totals[position].add(contribution)
+            if self.segments[position]["labelling"] == "single" and predictions and true_labels:
+                pair = (true_labels[0], predictions[0])
+                self.confusion[pair] += 1
+        self.whole.add(contribution)
+        self._seen[index] = (position, contribution, pair)
+
+    def consume(self, records: Iterable[Dict[str, Any]]) -> "OnlineEvaluator":
+        """Add every record of an iterable (e.g. iter_records(path)); returns self."""
+        for record in records:
+            self.update(record)
+        return self
+
+    @property
+    def count(self) -> int:
+        """Number of emails with a classification."""
+        return self.whole.count - len(self.errors) - len(self.missing)
+
+    def running(self) -> Dict[str, Any]:
+        """Short whole-dataset summary for progress displays."""
+        summary = self.whole.per_example()
+        return {"emails": self.count, "errors": len(self.errors),
+                "accuracy": summary["accuracy"], "f1": summary["f1"], "jaccard": summary["jaccard"]}
+
+    def results(self, confidence: float = 0.0) -> Dict[str, Any]:
+        """
+        Current metrics, laid out like final_eval.evaluate_email_classification.
+
+        Args:
+            confidence: If set (e.g. 0.95), add normal-approximation confidence
+                intervals under "confidence_intervals"
+
+        Returns:
+            Dictionary of segment metrics, "whole_dataset", "confusion_matrix",
+            and the number of classified ("emails"), failed ("errors") and
+            missing emails
+        """
+        results = {}
+        for segment, totals in zip(self.segments, self.totals):
+            if segment["labelling"] == "single":
+                results[segment["name"]] = {"per_example": totals.per_example(), "global": totals.global_metrics()}
+            else:
+                results[segment["name"]] = totals.per_example()
+        results["whole_dataset"] = self.whole.per_example()
+
+        categories = sorted(self.categories)
+        results["confusion_matrix"] = {
+            category: {pred: self.confusion.get((category, pred), 0) for pred in categories}
+            for category in categories
+        }
+
+        if confidence:
+            z = _normal_quantile(0.5 + confidence / 2)
+            results["confidence_intervals"] = {
+                segment["name"]: totals.intervals(z) for segment, totals in zip(self.segments, self.totals)
+            }
+            results["confidence_intervals"]["whole_dataset"] = self.whole.intervals(z)
+
+        results["emails"] = self.count
+        results["errors"] = len(self.errors)
+        results["missing"] = len(self.missing)
+        return results
+
+
+def _normal_quantile(p: float) -> float:
+    # Inverse standard normal CDF by bisection on math.erf
+    lo, hi = -10.0, 10.0
+    for _ in range(100):
+        mid = (lo + hi) / 2
+        if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+def evaluate_records(path: str, dataset_path: str = DEFAULT_DATASET_PATH,
+                     length: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Evaluate a saved run (JSON list or JSONL) without loading it whole.
+
+    Args:
+        path: Path to the run's records
+        dataset_path: Dataset whose metadata defines the segments
+        length: Number of emails in the dataset, for open-ended segments
+
+    Returns:
+        Results of OnlineEvaluator.results
+    """
+    return OnlineEvaluator(load_segments(dataset_path, length=length)).consume(iter_records(path)).results()
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import time
+    from final_eval import evaluate_email_classification, print_evaluation_results
+
+    if len(sys.argv) > 1:
+        dataset_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_DATASET_PATH
+        with open(dataset_path, "r", encoding="utf-8") as f:
+            length = len(json.load(f))
+        results = evaluate_records(sys.argv[1], dataset_path, length=length)
+        print_evaluation_results(results)
+        print(f"Classified emails: {results['emails']}, errors: {results['errors']}, missing: {results['missing']}")
+        sys.exit(0)
+
+    # Replay each saved run record by record and compare with the batch evaluation
+    repo_root = os.path.dirname(os.path.abspath(__file__))
+    dataset_path = os.path.join(repo_root, "data", "qtm_emails_final_version.json")
+    with open(dataset_path, "r", encoding="utf-8") as f:
+        all_qtm_emails = json.load(f)
+    segments = load_segments(dataset_path, length=len(all_qtm_emails))
+
+    runs_dir = os.path.join(repo_root, "final_experiments")
+    for filename in sorted(os.listdir(runs_dir)):
+        if not filename.endswith("shot.json"):
+            continue
+        with open(os.path.join(runs_dir, filename), "r", encoding="utf-8") as f:
+            output = json.load(f)
+
+        start = time.perf_counter()
+        evaluator = OnlineEvaluator(segments).consume(output)
+        streamed = evaluator.results()
+        per_record_us = (time.perf_counter() - start) * 1e6 / len(output)
+        batch = evaluate_email_classification(all_qtm_emails, output, segments=segments)
+
+        def max_difference(a, b):
+            if isinstance(a, dict):
+                return max(max_difference(a[key], b[key]) for key in a)
+            return abs(a - b)
+
+        difference = max(max_difference(batch[key], streamed[key]) for key in batch)
+        print(f"{filename}: max difference {difference:.2e}, {per_record_us:.1f} us per record")
@@ -0,0 +1,146 @@
+"""
+Persistent cache for preprocessed (lemmatized) email text.
+
+Preprocessing output depends only on the input text and on the spaCy pipeline
+that produced it, so results are stored in a SQLite database keyed by the
+SHA-256 of the text and a signature of the pipeline (model name, model
+version, spaCy version and pipeline config). Re-running preprocessing over a
+mostly unchanged corpus only sends the new texts to spaCy.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Any, Iterable, List, Tuple
+
+DEFAULT_CACHE_PATH = os.getenv(
+    "EMAILLM_PREPROCESS_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "preprocess_cache.sqlite3")
+)
+
+# SQLite limits the number of parameters per statement
+_LOOKUP_CHUNK = 500
+
+
+def hash_text(text: str) -> str:
+    """Return the SHA-256 hex digest of a text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_signature(config: Dict[str, Any]) -> str:
+    """
+    Build a stable identifier for a preprocessing pipeline.
+
+    Args:
+        config: Model name, model version, spaCy version, pipeline config, ...
+
+    Returns:
+        Hex digest identifying the pipeline
+    """
+    payload = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PreprocessCache:
+    """
+    SQLite-backed cache of preprocessed texts keyed by (text hash, pipeline signature).
+
+    When `bypass` is set, lookups always miss but fresh results are still
+    written, which refreshes the stored entries.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, bypass: bool = False):
+        self.path = path
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS preprocessed ("
+            " text_hash TEXT NOT NULL,"
+            " signature TEXT NOT NULL,"
+            " result TEXT NOT NULL,"
+            " PRIMARY KEY (text_hash, signature)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def get_many(self, text_hashes: List[str], signature: str) -> Dict[str, str]:
+        """
+        Look up preprocessed texts in bulk.
+
+        Args:
+            text_hashes: Hashes from hash_text
+            signature: Pipeline signature from make_signature
+
+        Returns:
+            Dictionary of text hash to preprocessed text, for the hashes found
+        """
+        unique = list(dict.fromkeys(text_hashes))
+        found = {}
+        if not self.bypass:
+            with self._lock:
+                for start in range(0, len(unique), _LOOKUP_CHUNK):
+                    chunk = unique[start:start + _LOOKUP_CHUNK]
+                    rows = self._conn.execute(
+                        f"SELECT text_hash, result FROM preprocessed WHERE signature = ? AND text_hash IN ({', '.join('?' * len(chunk))})",
+                        [signature] + chunk
+                    )
+                    found.update(rows.fetchall())
+        self.hits += len(found)
+        self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, entries: Iterable[Tuple[str, str]], signature: str) -> None:
+        """
+        Store preprocessed texts in bulk.
+
+        Args:
+            entries: Iterable of (text hash, preprocessed text)
+            signature: Pipeline signature from make_signature
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO preprocessed (text_hash, signature, result) VALUES (?, ?, ?)",
+                ((text_hash, signature, result) for text_hash, result in entries)
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Remove every cached result."""
+        with self._lock:
+            self._conn.execute("DELETE FROM preprocessed")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return cache counters.
+
+        Returns:
+            Dictionary with hits, misses and entries
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM preprocessed").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_preprocess_cache() -> PreprocessCache:
+    """
+    Return the shared preprocessing cache, creating it on first use.
+
+    Set EMAILLM_PREPROCESS_CACHE_BYPASS=1 to skip lookups for this process.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            bypass = os.getenv("EMAILLM_PREPROCESS_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+            _cache = PreprocessCache(bypass=bypass)
+        return _cache
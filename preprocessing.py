@@ -1,12 +1,8 @@
-import spacy
-from spacy.lang.en.stop_words import STOP_WORDS
-import string
-
-# Load spaCy's English language model
-nlp = spacy.load("en_core_web_sm")
-
-# Define separation keyword
-SEPARATOR_KEYWORD = "Caleb_Kairos_Michael_Nate_STOP_EMAIL"
+# Shared preprocessing: spaCy pipeline without parser/NER, batched through nlp.pipe
+from text_preprocessing import preprocess_corpus
+from preprocess_cache import get_preprocess_cache
+# Streaming reader and separation keyword for the dump format
+from email_reader import SEPARATOR_KEYWORD, iter_separated_emails
 
 # Simulating the downloaded email content
 emails = [
@@ -35,45 +31,19 @@ download_emails_with_separator(emails, email_file_path)
 
 # Reading and processing the file later
 def process_downloaded_emails(file_path):
-    with open(file_path, 'r') as file:
-        content = file.read()
-    
-    # Split emails using the stop keyword separator
-    emails = content.split(SEPARATOR_KEYWORD)
-    
-    # Process each email individually
-    processed_emails = []
-    for email in emails:
-        if email.strip():  # Avoid empty segments
-            processed_email = preprocess_email(email)
-            processed_emails.append(processed_email)
-    
-    return processed_emails
-
-# Preprocess function
-def preprocess_email(email_text):
-    # Convert emails to lower case
-    email_text = email_text.lower()
-    
-    # Tokenize the email text
-    doc = nlp(email_text)
-    
-    # Lemmatize, remove stopwords, and punctuation
-    lemmatized_tokens = [token.lemma_ for token in doc if token.text not in STOP_WORDS and token.text not in string.punctuation]
-    
-    # Join the lemmatized tokens back into a string
-    processed_text = " ".join(lemmatized_tokens)
-    
-    return processed_text
+    # Stream emails one at a time from the dump, skipping empty segments, and
+    # process them in batches; emails seen in a previous run are served from
+    # the preprocessing cache without spaCy
+    return preprocess_corpus(iter_separated_emails(file_path))
 
-# Process the downloaded emails with separators
-processed_emails = process_downloaded_emails(email_file_path)
-
-# Save processed emails to a new file
+# Process the downloaded emails with separators, saving each processed email
+# to a new file as it is produced so memory stays flat for large dumps
 with open(processed_email_file_path, 'w', encoding='utf-8') as file:
-    for processed_email in processed_emails:
+    for i, processed_email in enumerate(process_downloaded_emails(email_file_path), 1):
         file.write(processed_email + "\n" + SEPARATOR_KEYWORD + "\n")
 
-# Output the processed emails
-for i, email in enumerate(processed_emails, 1):
-    print(f"Processed Email {i}:\n{email}\n")
+        # Output the processed email
+        print(f"Processed Email {i}:\n{processed_email}\n")
+
+cache_stats = get_preprocess_cache().stats()
+print(f"Preprocessing cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
@@ -0,0 +1,351 @@
+"""
+Shared rate limiter for Gemini calls.
+
+Every call takes one request from a requests-per-minute bucket and its
+estimated tokens from a tokens-per-minute bucket. Token estimates come from
+token_tracker.estimate_request_tokens, which is calibrated on the calls
+recorded so far. Both buckets refill continuously, so the long-run rate stays
+within the budgets while bursts of up to one minute's budget pass at once.
+When a call reports its actual usage, the token bucket is corrected.
+
+Throttled calls (429 / RESOURCE_EXHAUSTED) and transient server errors are
+retried with jittered exponential backoff, honouring the server's retry delay
+when it gives one. A throttled call also pauses every other caller until the
+delay has passed. A call that is still throttled after the last retry raises
+RateLimitExceeded instead of returning an error string.
+
+The number of calls in flight adapts (AIMD): it grows by one after each
+window of successful calls and halves when calls are throttled, so a
+concurrent runner settles just under the quota.
+
+The limiter works from threads (call) and from asyncio (async_call).
+"""
+
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, Any, Callable, Optional
+
+# Budgets for the whole process; 0 disables a budget
+DEFAULT_RPM = int(os.getenv("EMAILLM_RATE_LIMIT_RPM", "2000"))
+DEFAULT_TPM = int(os.getenv("EMAILLM_RATE_LIMIT_TPM", "4000000"))
+
+# Calls in flight: starting value and ceiling of the adaptive limit
+DEFAULT_INITIAL_CONCURRENCY = int(os.getenv("EMAILLM_RATE_LIMIT_CONCURRENCY", "8"))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("EMAILLM_RATE_LIMIT_MAX_CONCURRENCY", "64"))
+
+# Retries of throttled or transient failures, and their backoff bounds in seconds
+DEFAULT_MAX_RETRIES = int(os.getenv("EMAILLM_RATE_LIMIT_MAX_RETRIES", "6"))
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+
+# How often a caller waiting for a free concurrency slot checks again
+SLOT_POLL_SECONDS = 0.02
+
+# The concurrency limit is halved at most once per this many seconds, so a
+# burst of 429s from calls that were already in flight counts as one signal
+DECREASE_INTERVAL_SECONDS = 1.0
+
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+RETRY_DELAY_PATTERN = re.compile(r"retry[_ ]?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE)
+
+
+class RateLimitExceeded(Exception):
+    """A call was still throttled after every retry."""
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    for attribute in ("code", "status_code"):
+        code = getattr(error, attribute, None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def _status(error: Exception) -> str:
+    status = getattr(error, "status", None)
+    return status.upper() if isinstance(status, str) else ""
+
+
+# An error with a status code is classified by the code alone, since its
+# message can mention "429" or "quota" by chance (e.g. a random cache name)
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether an exception is a 429 / quota error."""
+    code = _status_code(error)
+    if code is not None:
+        return code == 429
+    return _status(error) == "RESOURCE_EXHAUSTED"
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether an exception is a server or network error worth retrying."""
+    code = _status_code(error)
+    if code is not None:
+        return code in TRANSIENT_STATUS_CODES
+    if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    return _status(error) in ("UNAVAILABLE", "DEADLINE_EXCEEDED")
+
+
+def retry_delay_seconds(error: Exception) -> Optional[float]:
+    """Retry delay the server asked for (e.g. "retryDelay": "23s"), if any."""
+    match = RETRY_DELAY_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def response_total_tokens(response) -> Optional[int]:
+    """Total tokens reported by a generate_content response, if any."""
+    usage = getattr(response, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", None) if usage is not None else None
+    return total if isinstance(total, int) else None
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter with retries and AIMD concurrency, shared by all calls.
+
+    Example:
+        limiter = get_rate_limiter()
+        response = limiter.call(lambda: client.models.generate_content(...), estimated_tokens)
+        response = await limiter.async_call(lambda: client.aio.models.generate_content(...), estimated_tokens)
+    """
+
+    def __init__(self, rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM,
+                 initial_concurrency: int = DEFAULT_INITIAL_CONCURRENCY,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, max_retries: int = DEFAULT_MAX_RETRIES,
+                 base_delay: float = DEFAULT_BASE_DELAY, max_delay: float = DEFAULT_MAX_DELAY,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            rpm: Requests per minute (0 for no request budget)
+            tpm: Tokens per minute (0 for no token budget)
+            initial_concurrency: Calls allowed in flight at the start
+            max_concurrency: Ceiling of the adaptive concurrency limit
+            max_retries: Retries of a throttled or transiently failing call
+            base_delay: Backoff before the first retry, doubled on each retry
+            max_delay: Longest backoff
+            clock: Monotonic clock in seconds
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = float(min(max(1, initial_concurrency), self.max_concurrency))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._last_decrease = float("-inf")
+        self.in_flight = 0
+
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm > 0:
+            self._requests = min(float(self.rpm), self._requests + elapsed * self.rpm / 60)
+        if self.tpm > 0:
+            self._tokens = min(float(self.tpm), self._tokens + elapsed * self.tpm / 60)
+
+    def try_acquire(self, tokens: int) -> float:
+        """
+        Take a concurrency slot, one request and `tokens` tokens if available.
+
+        Returns:
+            0.0 if acquired, otherwise the number of seconds to wait before trying again
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.in_flight >= int(self.concurrency):
+                return SLOT_POLL_SECONDS
+            wait = 0.0
+            if self.rpm > 0 and self._requests < 1:
+                wait = (1 - self._requests) * 60 / self.rpm
+            # A request larger than the whole budget waits for a full bucket
+            tokens = min(tokens, self.tpm)
+            if self.tpm > 0 and self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+            if wait > 0:
+                return wait
+            if self.rpm > 0:
+                self._requests -= 1
+            if self.tpm > 0:
+                self._tokens -= tokens
+            self.in_flight += 1
+            self.calls += 1
+            return 0.0
+
+    def acquire(self, tokens: int) -> None:
+        """Block the calling thread until a call may start."""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return
+            self.wait_seconds += wait
+            time.sleep(wait)
+
+    async def async_acquire(self, tokens: int) -> None:
+        """Wait (without blocking the event loop) until a call may start."""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return
+            self.wait_seconds += wait
+            await asyncio.sleep(wait)
+
+    def release(self, estimated_tokens: int, actual_tokens: Optional[int] = None,
+                throttled: bool = False, pause: float = 0.0, cancelled: bool = False) -> None:
+        """
+        Finish a call started with acquire.
+
+        Args:
+            estimated_tokens: Tokens taken when the call was acquired
+            actual_tokens: Tokens the call reported, to correct the token bucket
+            throttled: Whether the call was rejected for exceeding the quota
+            pause: Seconds every caller should wait before the next call
+            cancelled: Whether the call was abandoned (cancelled, interrupted);
+                the concurrency limit is left unchanged
+        """
+        with self._lock:
+            now = self._clock()
+            self.in_flight -= 1
+            if actual_tokens is not None and self.tpm > 0:
+                # Tokens may go negative: an underestimate is paid back from future refills
+                self._tokens -= actual_tokens - min(estimated_tokens, self.tpm)
+            if pause > 0:
+                self._paused_until = max(self._paused_until, now + pause)
+            if cancelled:
+                return
+            if throttled:
+                self.throttled += 1
+                if now - self._last_decrease >= DECREASE_INTERVAL_SECONDS:
+                    self.concurrency = max(1.0, self.concurrency / 2)
+                    self._last_decrease = now
+            else:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Jittered exponential backoff for a retry, at least the server's retry delay."""
+        cap = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = cap / 2 + random.uniform(0, cap / 2)
+        return max(delay, retry_after or 0.0)
+
+    def _after_failure(self, error: Exception, attempt: int, estimated_tokens: int) -> float:
+        # Release the slot and decide whether to retry; returns the backoff delay
+        throttled = is_rate_limit_error(error)
+        retryable = throttled or is_transient_error(error)
+        delay = self.backoff_delay(attempt, retry_delay_seconds(error)) if retryable else 0.0
+        self.release(estimated_tokens, throttled=throttled, pause=delay if throttled else 0.0)
+        give_up = not retryable or attempt >= self.max_retries
+        with self._lock:
+            if give_up:
+                self.failures += 1
+            else:
+                self.retries += 1
+        if not retryable:
+            raise error
+        if give_up:
+            if throttled:
+                raise RateLimitExceeded(f"Still rate limited after {self.max_retries} retries: {error}") from error
+            raise error
+        print(f"LLM call {'throttled' if throttled else 'failed'} ({str(error)[:120]}); retrying in {delay:.1f}s")
+        return delay
+
+    def call(self, request: Callable[[], Any], estimated_tokens: int) -> Any:
+        """
+        Make a blocking call under the limiter, retrying throttled and transient failures.
+
+        Args:
+            request: Function making the call, e.g. a generate_content lambda
+            estimated_tokens: Estimated total tokens of the call
+
+        Returns:
+            The call's result
+
+        Raises:
+            RateLimitExceeded: If the call was still throttled after every retry
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(estimated_tokens)
+            try:
+                response = request()
+            except Exception as e:
+                time.sleep(self._after_failure(e, attempt, estimated_tokens))
+                continue
+            except BaseException:
+                # Ctrl-C or similar: give back the slot and the reserved tokens
+                self.release(estimated_tokens, actual_tokens=0, cancelled=True)
+                raise
+            self.release(estimated_tokens, actual_tokens=response_total_tokens(response))
+            return response
+
+    async def async_call(self, request: Callable[[], Any], estimated_tokens: int) -> Any:
+        """
+        Async counterpart of call; `request` returns an awaitable.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.async_acquire(estimated_tokens)
+            try:
+                response = await request()
+            except Exception as e:
+                await asyncio.sleep(self._after_failure(e, attempt, estimated_tokens))
+                continue
+            except BaseException:
+                # Task cancelled (e.g. asyncio.run interrupted): give back the slot and the reserved tokens
+                self.release(estimated_tokens, actual_tokens=0, cancelled=True)
+                raise
+            self.release(estimated_tokens, actual_tokens=response_total_tokens(response))
+            return response
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and the current concurrency limit."""
+        return {
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "failures": self.failures,
+            "wait_seconds": self.wait_seconds,
+            "concurrency": int(self.concurrency),
+            "in_flight": self.in_flight
+        }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Return the process-wide rate limiter, creating it on first use.
+    """
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
+
+
+def display_rate_limit_summary():
+    """
+    Display a summary of rate limiting.
+    """
+    stats = get_rate_limiter().stats()
+    print(f"Rate limiter: {stats['calls']} attempts, {stats['throttled']} throttled, "
+          f"{stats['retries']} retries, {stats['failures']} failed, "
+          f"{stats['wait_seconds']:.1f}s waited (summed over callers), concurrency limit {stats['concurrency']}")
@@ -0,0 +1,195 @@
+"""
+Checkpoints for experiment runs: one JSONL line per classified email.
+
+Each output record is appended to "<run>.jsonl" as soon as it completes,
+tagged with the configuration name, and flushed. An interrupted run (a crash,
+a quota error, Ctrl-C) loses at most the calls still in flight. When the run
+is started again, emails whose latest record succeeded are skipped and only
+errors and missing emails are classified. For each email id, the last line
+in the file wins.
+
+finalize() writes the usual "<run>.json" list (e.g.
+with_keyword_count_control_5shot.json) with one record per email in dataset
+order, so final_eval.py and older tooling read checkpointed runs unchanged.
+Emails without a record get a placeholder error record marked "missing".
+final_eval scores error and missing records as empty predictions and counts
+them separately.
+
+Usage:
+    python run_checkpoint.py final_experiments/                      # finalize every checkpoint in a directory
+    python run_checkpoint.py final_experiments/ data/qtm_emails_final_version.json
+"""
+
+import json
+import os
+import threading
+from typing import Dict, Any, Iterable, List, Optional
+
+from latency import span
+from online_eval import iter_jsonl_records
+
+
+def checkpoint_path(output_path: str) -> str:
+    """Return the checkpoint of a run's output file (run.json -> run.jsonl)."""
+    return os.path.splitext(output_path)[0] + ".jsonl"
+
+
+def missing_record(email: Dict[str, Any], i: int, path: str) -> Dict[str, Any]:
+    """Placeholder record for an email a checkpoint holds no record for."""
+    return {
+        'email_id': email.get('id', i),
+        'error': f"No record in {path}",
+        'missing': True,
+        'actual_classification': email.get('category', []),
+        'email_content': email.get('content', '')[:100] + "..." if 'content' in email else "No content"
+    }
+
+
+class RunCheckpoint:
+    """
+    Append-only JSONL checkpoint of one experiment configuration.
+
+    Example:
+        checkpoint = RunCheckpoint("final_experiments/with_keyword_count_control_5shot.jsonl",
+                                   "with_keyword_count_control_5shot")
+        todo = [email for i, email in enumerate(emails) if not checkpoint.is_done(email.get('id', i))]
+        ...
+        checkpoint.append(record)
+        output = checkpoint.finalize(emails, "final_experiments/with_keyword_count_control_5shot.json")
+    """
+
+    def __init__(self, path: str, config: str, resume: bool = True):
+        """
+        Args:
+            path: Path of the JSONL checkpoint
+            config: Configuration name stored with every record
+            resume: Whether to keep the records already in the file; if False,
+                the file is started afresh
+        """
+        self.path = path
+        self.config = config
+        self.records = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if resume and os.path.exists(path):
+            for line in iter_jsonl_records(path):
+                if line.pop("config", config) == config:
+                    self.records[line["email_id"]] = line
+            self._file = open(path, "a", encoding="utf-8")
+            # A crash can leave a partial last line; start on a fresh line
+            if self._file.tell() > 0:
+                with open(path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        self._file.write("\n")
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+
+    def is_done(self, email_id: Any) -> bool:
+        """Whether an email already has a successful record."""
+        record = self.records.get(email_id)
+        return record is not None and "error" not in record
+
+    def completed(self) -> Dict[Any, Dict[str, Any]]:
+        """Successful records by email id."""
+        return {email_id: record for email_id, record in self.records.items() if "error" not in record}
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Write one output record and flush it to disk."""
+        line = json.dumps(dict(record, config=self.config), ensure_ascii=False)
+        with span("persistence"), self._lock:
+            self.records[record["email_id"]] = record
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def extend(self, records: Iterable[Dict[str, Any]]) -> None:
+        """Write several output records."""
+        for record in records:
+            self.append(record)
+
+    def close(self) -> None:
+        """Close the checkpoint file."""
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def finalize(self, emails: List[Dict[str, Any]], output_path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Collect the latest record of every email in dataset order.
+
+        Args:
+            emails: The run's dataset, for ordering (record ids are email.get('id', i))
+            output_path: If given, also write the records there as a JSON list,
+                formatted like the files run_experiments used to write
+
+        Returns:
+            One output record per email, aligned with `emails`; emails without
+            a record get a placeholder error record with "missing": True
+        """
+        output, missing = [], 0
+        for i, email in enumerate(emails):
+            record = self.records.get(email.get('id', i))
+            if record is None:
+                missing += 1
+                record = missing_record(email, i, self.path)
+            output.append(record)
+        if missing:
+            print(f"Warning: {missing} emails have no record in {self.path}")
+        if output_path is not None:
+            # Write to a temporary file first, so a crash never leaves a half-written run
+            tmp_path = output_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(output, f, indent=4)
+            os.replace(tmp_path, output_path)
+        return output
+
+
+def finalize_runs(output_dir: str, dataset_path: str) -> List[str]:
+    """
+    Write the JSON output file of every checkpoint in a directory.
+
+    Args:
+        output_dir: Directory holding "<run>.jsonl" checkpoints
+        dataset_path: Dataset the runs classified, for ordering
+
+    Returns:
+        Paths of the written JSON files
+    """
+    with open(dataset_path, 'r') as f:
+        emails = json.load(f)
+
+    written = []
+    for filename in sorted(os.listdir(output_dir)):
+        if not filename.endswith(".jsonl"):
+            continue
+        path = os.path.join(output_dir, filename)
+        config = os.path.splitext(filename)[0]
+        with RunCheckpoint(path, config) as checkpoint:
+            output_path = os.path.join(output_dir, config + ".json")
+            output = checkpoint.finalize(emails, output_path)
+        missing = sum(1 for record in output if record.get("missing"))
+        errors = sum(1 for record in output if "error" in record) - missing
+        print(f"Wrote {output_path}: {len(output)} records ({errors} errors, {missing} missing)")
+        written.append(output_path)
+    return written
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: python run_checkpoint.py OUTPUT_DIR [DATASET_PATH]")
+        sys.exit(1)
+    dataset_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "data", "qtm_emails_final_version.json")
+    finalize_runs(sys.argv[1], dataset_path)
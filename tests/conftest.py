@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules under test live at the repository root, and the Flask app in tryout/
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "tryout"))
@@ -0,0 +1,120 @@
+"""
+ContextCacheManager against a local fake client, and call_llm falling back
+to an inline instruction when the server rejects a cache name.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import final_experiments
+from context_cache import ContextCacheManager
+from mock_llm import MockAPIError, MockClient
+
+MODEL = "gemini-2.0-flash"
+INSTRUCTION = "Classify the email into the given keywords. " * 200
+
+
+class FakeCaches:
+    """caches.create/update/delete that count calls and can fail on demand."""
+
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.deleted = []
+        self.errors = []
+
+    def create(self, model, config=None):
+        if self.errors:
+            raise self.errors.pop(0)
+        name = f"cachedContents/fake-{len(self.created)}"
+        self.created.append(name)
+        return SimpleNamespace(name=name, model=model)
+
+    def update(self, name, config=None):
+        self.updated.append(name)
+        return SimpleNamespace(name=name)
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+
+@pytest.fixture
+def clock():
+    return SimpleNamespace(now=1000.0)
+
+
+@pytest.fixture
+def manager(clock):
+    return ContextCacheManager(ttl_seconds=600, refresh_margin_seconds=60, clock=lambda: clock.now)
+
+
+@pytest.fixture
+def client():
+    return SimpleNamespace(caches=FakeCaches())
+
+
+def test_one_create_per_model_and_instruction(manager, client):
+    names = [manager.get_cache_name(client, MODEL, INSTRUCTION) for _ in range(5)]
+    assert names == ["cachedContents/fake-0"] * 5
+    assert manager.get_cache_name(client, "gemini-2.0-flash-lite", INSTRUCTION) == "cachedContents/fake-1"
+    assert manager.get_cache_name(client, MODEL, INSTRUCTION + "Be brief.") == "cachedContents/fake-2"
+    assert len(client.caches.created) == 3
+
+    manager.release_all(client)
+    assert sorted(client.caches.deleted) == sorted(client.caches.created)
+
+
+def test_refreshed_near_expiry(manager, client, clock):
+    name = manager.get_cache_name(client, MODEL, INSTRUCTION)
+    clock.now += 600 - 30
+    assert manager.get_cache_name(client, MODEL, INSTRUCTION) == name
+    assert client.caches.updated == [name]
+    # The refresh extended the TTL from the time of the update
+    clock.now += 600 - 90
+    assert manager.get_cache_name(client, MODEL, INSTRUCTION) == name
+    assert client.caches.created == [name] and client.caches.updated == [name]
+
+
+def test_recreated_after_expiry(manager, client, clock):
+    manager.get_cache_name(client, MODEL, INSTRUCTION)
+    clock.now += 601
+    assert manager.get_cache_name(client, MODEL, INSTRUCTION) == "cachedContents/fake-1"
+    assert client.caches.updated == []
+
+
+@pytest.mark.parametrize("error", [
+    MockAPIError(400, "INVALID_ARGUMENT", "Cached content is too small. total_token_count=812, min_total_token_count=4096"),
+    Exception("The minimum token count to start caching is 4096"),
+])
+def test_rejected_instruction_is_remembered(manager, client, error):
+    client.caches.errors = [error]
+    assert manager.get_cache_name(client, MODEL, INSTRUCTION) is None
+    assert manager.get_cache_name(client, MODEL, INSTRUCTION) is None
+    assert client.caches.created == []
+    assert client.caches.errors == []
+
+
+@pytest.mark.parametrize("error", [
+    MockAPIError(429, "RESOURCE_EXHAUSTED", "Quota exceeded"),
+    MockAPIError(503, "UNAVAILABLE", "The service is currently unavailable"),
+])
+def test_transient_errors_are_not_remembered(manager, client, error):
+    client.caches.errors = [error]
+    assert manager.get_cache_name(client, MODEL, INSTRUCTION) is None
+    assert manager.get_cache_name(client, MODEL, INSTRUCTION) == "cachedContents/fake-0"
+
+
+def test_call_llm_retries_inline_after_rejected_cache(monkeypatch, manager):
+    monkeypatch.setattr(final_experiments, "get_context_cache", lambda: manager)
+    client = MockClient(script=["KEYWORDS: events"])
+    name = manager.get_cache_name(client, MODEL, INSTRUCTION)
+    # The server forgets the cache before its TTL is up
+    client.caches.delete(name)
+
+    text = final_experiments.call_llm(client, "Club fair on Friday", INSTRUCTION, model=MODEL,
+                                      use_cache=False, use_context_cache=True)
+    assert text == "KEYWORDS: events"
+    assert client.stats()["errors"] == 1
+    # The rejected name is forgotten, so the next call creates a new cache
+    assert manager._entries == {}
@@ -0,0 +1,53 @@
+"""
+The in-memory inbox of the Flask app and the SQLite email store must agree
+after every mutation, including tag lists with duplicates.
+"""
+
+import pytest
+
+import email_classifier
+from email_store import EmailStore
+
+MUTATIONS = [
+    {"op": "set_tags", "id": 5, "tags": ["research", "research"]},
+    {"op": "set_tags", "id": 3, "tags": ["research", "events", "research"]},
+    {"op": "insert", "email": {"id": 13, "subject": "New", "content": "Body", "tags": ["events", "events"]}},
+    {"op": "remove_tag", "tag": "research"},
+    {"op": "delete_untagged"},
+]
+
+
+@pytest.fixture
+def inbox(tmp_path, monkeypatch):
+    # Newest first, ids 12..0, with email 0 and 1 already tagged
+    emails = [{"id": i, "subject": f"Email {i}", "content": f"Content {i}", "tags": ["events"] if i < 2 else []}
+              for i in reversed(range(13))]
+    store = EmailStore(str(tmp_path / "emails.sqlite3"))
+    store.rebuild([dict(email, tags=list(email["tags"])) for email in emails], seq=0)
+    monkeypatch.setattr(email_classifier, "_EMAILS_CACHE", emails)
+    monkeypatch.setattr(email_classifier, "_EMAILS_BY_ID", {email["id"]: email for email in emails})
+    monkeypatch.setattr(email_classifier, "_NEXT_EMAIL_ID", 13)
+    yield store
+    store.close()
+
+
+def assert_same_inbox(store):
+    memory = email_classifier._EMAILS_CACHE
+    assert store.email_ids() == [email["id"] for email in memory]
+    assert store.untagged_count() == sum(not email["tags"] for email in memory)
+    counts = {}
+    for email in memory:
+        assert len(email["tags"]) == len(set(email["tags"]))
+        for tag in email["tags"]:
+            counts[tag] = counts.get(tag, 0) + 1
+    assert store.tag_counts() == counts
+    for tag in counts:
+        assert store.email_ids(tag=tag) == [email["id"] for email in memory if tag in email["tags"]]
+
+
+def test_memory_and_store_agree_after_each_mutation(inbox):
+    for seq, mutation in enumerate(MUTATIONS, start=1):
+        email_classifier.apply_mutation(mutation)
+        inbox.apply(mutation, seq)
+        assert_same_inbox(inbox)
+    assert [email["id"] for email in email_classifier._EMAILS_CACHE] == [13, 3, 1, 0]
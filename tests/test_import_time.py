@@ -0,0 +1,15 @@
+"""
+Import-time budgets of the entry points (check_import_time.py), so a slow or
+eager import fails the test suite.
+"""
+
+import pytest
+
+from check_import_time import ENTRY_POINTS, check_entry_point
+
+
+@pytest.mark.parametrize("module", sorted(ENTRY_POINTS))
+def test_entry_point_import_time(module):
+    cwd, budget_ms = ENTRY_POINTS[module]
+    _, failures = check_entry_point(module, cwd, budget_ms)
+    assert not failures, "\n".join(failures)
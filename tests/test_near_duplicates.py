@@ -0,0 +1,19 @@
+"""
+Near-duplicate clustering, with and without groups.
+"""
+
+from near_duplicates import cluster_near_duplicates
+
+BODY = ("The QTM department is hosting an information session about the data science "
+        "summer internship program on Friday afternoon in the main conference room. ")
+TEXTS = [BODY + "Snacks provided.", BODY + "Snacks provided!", "A completely different email about exams.", BODY + "Snacks provided."]
+
+
+def test_near_identical_texts_share_a_representative():
+    assert cluster_near_duplicates(TEXTS) == [0, 0, 2, 0]
+
+
+def test_groups_are_clustered_separately():
+    representatives = cluster_near_duplicates(TEXTS, groups=[1, 2, 1, 2])
+    assert representatives == [0, 1, 2, 1]
+    assert all(representative <= i for i, representative in enumerate(representatives))
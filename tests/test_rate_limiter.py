@@ -0,0 +1,23 @@
+"""
+Classification of LLM errors into throttled, transient and permanent ones.
+"""
+
+import pytest
+
+from mock_llm import MockAPIError
+from rate_limiter import is_rate_limit_error, is_transient_error
+
+
+@pytest.mark.parametrize("error, throttled, transient", [
+    (MockAPIError(429, "RESOURCE_EXHAUSTED", "Quota exceeded"), True, False),
+    (MockAPIError(503, "UNAVAILABLE", "The model is overloaded"), False, True),
+    # A status code decides, whatever the message happens to contain
+    (MockAPIError(404, "NOT_FOUND", "Cached content cachedContents/mock-8a4291f0c2 not found"), False, False),
+    (MockAPIError(400, "INVALID_ARGUMENT", "Project quota settings are invalid"), False, False),
+    (MockAPIError(500, "INTERNAL", "Retry after 429 ms"), False, True),
+    (TimeoutError(), False, True),
+    (ValueError("429 quota"), False, False),
+])
+def test_error_classification(error, throttled, transient):
+    assert is_rate_limit_error(error) is throttled
+    assert is_transient_error(error) is transient
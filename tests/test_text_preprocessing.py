@@ -0,0 +1,49 @@
+"""
+Parity of preprocess_corpus with per-email preprocess_email on the full
+en_core_web_sm pipeline, over the QTM dataset.
+"""
+
+import json
+import os
+
+import pytest
+
+spacy = pytest.importorskip("spacy")
+if not spacy.util.is_package("en_core_web_sm"):
+    pytest.skip("en_core_web_sm is not installed", allow_module_level=True)
+
+import preprocess_cache
+from preprocess_cache import PreprocessCache
+from text_preprocessing import load_nlp, preprocess_email, preprocess_corpus
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "data", "qtm_emails_final_version.json")
+
+
+@pytest.fixture(scope="module")
+def texts():
+    with open(DATA_PATH, "r", encoding="utf-8") as f:
+        return [email["content"] for email in json.load(f)]
+
+
+@pytest.fixture(scope="module")
+def expected(texts):
+    # The original behaviour: one email at a time on the full pipeline
+    full_nlp = load_nlp(exclude=[])
+    return [preprocess_email(text, nlp=full_nlp) for text in texts]
+
+
+@pytest.mark.parametrize("n_process", [1, 2])
+def test_corpus_matches_per_email(texts, expected, n_process):
+    assert list(preprocess_corpus(texts, n_process=n_process, use_cache=False)) == expected
+
+
+def test_cached_corpus_matches_per_email(texts, expected, tmp_path, monkeypatch):
+    monkeypatch.setattr(preprocess_cache, "_cache", PreprocessCache(path=str(tmp_path / "preprocess.sqlite3")))
+    # First pass fills the cache, second pass is served from it
+    assert list(preprocess_corpus(texts)) == expected
+    assert list(preprocess_corpus(texts)) == expected
+
+
+def test_trimmed_pipeline_matches_full_pipeline(texts, expected):
+    assert [preprocess_email(text) for text in texts] == expected
@@ -0,0 +1,51 @@
+"""
+Token usage scopes of resumed runs.
+"""
+
+import json
+from types import SimpleNamespace
+
+from token_tracker import TokenTracker
+
+
+def response(total_tokens):
+    usage = SimpleNamespace(prompt_token_count=total_tokens - 4, cached_content_token_count=0,
+                            candidates_token_count=4, total_token_count=total_tokens)
+    return SimpleNamespace(text="KEYWORDS: events", usage_metadata=usage)
+
+
+def run_session(tracker, log_path, totals, resume):
+    with tracker.scope("run", str(log_path), resume=resume) as usage:
+        for total in totals:
+            tracker.record("content", "instruction", "gemini-2.0-flash", response(total))
+    return usage.summary()
+
+
+def test_resumed_scope_counts_earlier_sessions(tmp_path):
+    log_path = tmp_path / "run_token_usage.jsonl"
+    run_session(TokenTracker(log_path=None), log_path, [100, 200, 300], resume=False)
+    # The first session crashed while writing a record
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write('{"usage": {"total_tok')
+
+    summary = run_session(TokenTracker(log_path=None), log_path, [400, 500], resume=True)
+    assert summary["calls"] == 5
+    assert summary["calls_from_earlier_sessions"] == 3
+    assert summary["total_tokens"] == 1500
+
+    lines = log_path.read_text(encoding="utf-8").splitlines()
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            pass
+    assert [record["usage"]["total_tokens"] for record in records] == [100, 200, 300, 400, 500]
+
+
+def test_scope_without_resume_starts_the_log_afresh(tmp_path):
+    log_path = tmp_path / "run_token_usage.jsonl"
+    run_session(TokenTracker(log_path=None), log_path, [100, 200], resume=False)
+    summary = run_session(TokenTracker(log_path=None), log_path, [300], resume=False)
+    assert summary["calls"] == 1 and summary["calls_from_earlier_sessions"] == 0
+    assert len(log_path.read_text(encoding="utf-8").splitlines()) == 1
@@ -0,0 +1,216 @@
+"""
+Shared spaCy preprocessing for emails.
+
+Emails are lowercased, tokenized and lemmatized, and stopwords and
+punctuation are dropped. Only lemmas and token text are used, so the pipeline
+is loaded without the dependency parser and NER. The remaining components
+(tok2vec, tagger, attribute_ruler, lemmatizer) are the ones the rule-based
+lemmatizer depends on, so the output is the same as with the full pipeline.
+
+`preprocess_corpus` streams many emails through `nlp.pipe` in batches and,
+optionally, across several processes.
+
+spaCy itself is only imported when a pipeline is first needed, so importing
+this module (and the entry points that use it) stays cheap. Results of
+`preprocess_corpus` are kept in a persistent cache (see preprocess_cache.py);
+when every text is cached, spaCy is not loaded at all.
+"""
+
+import os
+import string
+import time
+from importlib import metadata
+from itertools import islice
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+
+from preprocess_cache import get_preprocess_cache, hash_text, make_signature
+from latency import span, observe
+
+DEFAULT_MODEL = "en_core_web_sm"
+
+# Components lemmatization does not need
+UNUSED_COMPONENTS = ["parser", "ner"]
+
+DEFAULT_BATCH_SIZE = int(os.getenv("EMAILLM_SPACY_BATCH_SIZE", 64))
+DEFAULT_N_PROCESS = int(os.getenv("EMAILLM_SPACY_N_PROCESS", 1))
+
+# Bump whenever lemmatize_doc changes, so cached results are not reused
+PREPROCESS_VERSION = 1
+
+# Number of texts looked up in the cache at once; the misses of each chunk go
+# through one nlp.pipe call, so worker processes are started once per chunk
+CACHE_CHUNK_SIZE = 10000
+
+_nlp = None
+
+
+def load_nlp(model: str = DEFAULT_MODEL, exclude: Optional[List[str]] = None):
+    """
+    Load a spaCy pipeline, downloading the model if it is missing.
+
+    Args:
+        model: Name of the spaCy model
+        exclude: Components not to load (defaults to UNUSED_COMPONENTS)
+
+    Returns:
+        The spaCy Language object
+    """
+    import spacy
+
+    exclude = UNUSED_COMPONENTS if exclude is None else exclude
+    try:
+        return spacy.load(model, exclude=exclude)
+    except OSError:
+        print("Downloading spaCy model...")
+        spacy.cli.download(model)
+        return spacy.load(model, exclude=exclude)
+
+
+def get_nlp():
+    """Return the shared trimmed pipeline, loading it on first use."""
+    global _nlp
+    if _nlp is None:
+        _nlp = load_nlp()
+    return _nlp
+
+
+def _package_version(name: str) -> Optional[str]:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def pipeline_config(nlp=None) -> Dict[str, Any]:
+    """
+    Describe a preprocessing pipeline for cache keys.
+
+    The default pipeline is described from package metadata, without loading
+    spaCy or the model.
+
+    Args:
+        nlp: spaCy pipeline, or None for the shared trimmed pipeline
+
+    Returns:
+        Dictionary with model name, model version, spaCy version and pipeline config
+    """
+    if nlp is None:
+        return {
+            "model": DEFAULT_MODEL,
+            "model_version": _package_version(DEFAULT_MODEL),
+            "spacy_version": _package_version("spacy"),
+            "exclude": UNUSED_COMPONENTS,
+            "preprocess_version": PREPROCESS_VERSION
+        }
+    return {
+        "model": f"{nlp.meta.get('lang')}_{nlp.meta.get('name')}",
+        "model_version": nlp.meta.get("version"),
+        "spacy_version": _package_version("spacy"),
+        "pipeline": list(nlp.pipe_names),
+        "preprocess_version": PREPROCESS_VERSION
+    }
+
+
+def lemmatize_doc(doc) -> str:
+    """
+    Join the lemmas of a processed document, skipping stopwords and punctuation.
+
+    Args:
+        doc: A spaCy Doc of lowercased email text
+
+    Returns:
+        Preprocessed email text
+    """
+    from spacy.lang.en.stop_words import STOP_WORDS
+
+    lemmatized_tokens = [token.lemma_ for token in doc if token.text not in STOP_WORDS and token.text not in string.punctuation]
+    return " ".join(lemmatized_tokens)
+
+
+def preprocess_email(email_text: str, nlp=None) -> str:
+    """
+    Preprocess email text by tokenizing, lemmatizing, and removing stopwords.
+
+    Args:
+        email_text: The raw email text
+        nlp: spaCy pipeline to use (defaults to the shared trimmed pipeline)
+
+    Returns:
+        Preprocessed email text
+    """
+    with span("preprocessing"):
+        nlp = nlp or get_nlp()
+        return lemmatize_doc(nlp(email_text.lower()))
+
+
+def preprocess_corpus(email_texts: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                      n_process: int = DEFAULT_N_PROCESS, nlp=None, use_cache: bool = True) -> Iterator[str]:
+    """
+    Preprocess many emails with nlp.pipe. Gives the same result as calling
+    preprocess_email on each one, in the same order.
+
+    Args:
+        email_texts: Iterable of raw email texts (consumed lazily)
+        batch_size: Number of emails spaCy processes per batch
+        n_process: Number of worker processes (-1 for one per CPU)
+        nlp: spaCy pipeline to use (defaults to the shared trimmed pipeline)
+        use_cache: Whether to serve and store results in the preprocessing cache
+
+    Returns:
+        Iterator over the preprocessed email texts
+    """
+    lowered = (email_text.lower() for email_text in email_texts)
+    if not use_cache:
+        pipeline = nlp or get_nlp()
+        for doc in pipeline.pipe(lowered, batch_size=batch_size, n_process=n_process):
+            yield lemmatize_doc(doc)
+        return
+
+    cache = get_preprocess_cache()
+    signature = make_signature(pipeline_config(nlp))
+    while True:
+        chunk = list(islice(lowered, CACHE_CHUNK_SIZE))
+        if not chunk:
+            return
+        start = time.perf_counter()
+        text_hashes = [hash_text(text) for text in chunk]
+        results = cache.get_many(text_hashes, signature)
+
+        # Only texts not seen before go through spaCy (each distinct text once)
+        missing = {text_hash: text for text_hash, text in zip(text_hashes, chunk) if text_hash not in results}
+        if missing:
+            pipeline = nlp or get_nlp()
+            docs = pipeline.pipe(missing.values(), batch_size=batch_size, n_process=n_process)
+            computed = {text_hash: lemmatize_doc(doc) for text_hash, doc in zip(missing, docs)}
+            cache.put_many(computed.items(), signature)
+            results.update(computed)
+        # Texts are processed in bulk; record the mean time per email
+        observe("preprocessing", (time.perf_counter() - start) / len(chunk), count=len(chunk))
+
+        for text_hash in text_hashes:
+            yield results[text_hash]
+
+
+if __name__ == "__main__":
+    # Parity and timing of the batched, trimmed pipeline against the original
+    # per-email preprocessing on the full pipeline (also tested in
+    # tests/test_text_preprocessing.py)
+    import json
+    import time
+
+    data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "qtm_emails_final_version.json")
+    with open(data_path, "r", encoding="utf-8") as f:
+        texts = [email["content"] for email in json.load(f)]
+
+    full_nlp = load_nlp(exclude=[])
+    start = time.perf_counter()
+    expected = [preprocess_email(text, nlp=full_nlp) for text in texts]
+    baseline_seconds = time.perf_counter() - start
+
+    for n_process in (1, 2):
+        start = time.perf_counter()
+        actual = list(preprocess_corpus(texts, n_process=n_process, use_cache=False))
+        seconds = time.perf_counter() - start
+        mismatches = sum(1 for a, b in zip(expected, actual) if a != b) + abs(len(expected) - len(actual))
+        print(f"n_process={n_process}: {mismatches} mismatches out of {len(texts)} emails, "
+              f"{seconds:.2f}s vs {baseline_seconds:.2f}s one at a time on the full pipeline")
@@ -1,85 +1,361 @@
+"""
+Token usage tracking for LLM calls.
+
+A TokenTracker keeps running aggregates (sums, mean and p50/p95 tokens per
+call) instead of a list of records, so memory stays flat in a long-running
+process. Each record is appended to a JSONL log as it arrives, if one is
+configured (EMAILLM_TOKEN_USAGE_LOG for the whole process, or a scope's own
+file).
+
+Scopes attribute calls to a run:
+
+    with token_scope("with_keyword_count_control_5shot", "run_token_usage.jsonl") as usage:
+        ...  # every call made here, including from asyncio tasks, is counted in `usage`
+    save_token_usage("run_token_usage.json", usage)
+
+A scope opened with resume=True first counts the records already in its log,
+so a run resumed over several sessions is summarized as a whole.
+
+The active scopes live in a context variable, so concurrent asyncio tasks and
+threads each count towards the scopes they were started in. Updates take a
+lock, which makes recording safe from worker threads.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 import json
-from typing import Dict, Any
-
-# Initialize token usage tracking
-token_usage = {
-    "records": [],
-    "total_usage": {
-        "prompt_tokens": 0,
-        "completion_tokens": 0,
-        "total_tokens": 0,
-        "calls": 0
-    }
-}
+import math
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Any, Optional
+
+# Token estimates before any call has been recorded (measured on the saved
+# token usage logs: ~3.8 characters per prompt token, ~4 completion tokens)
+DEFAULT_CHARS_PER_TOKEN = 3.8
+DEFAULT_COMPLETION_TOKENS = 8
+
+# Process-wide JSONL log of every call (unset: aggregates only)
+DEFAULT_LOG_PATH = os.getenv("EMAILLM_TOKEN_USAGE_LOG", "")
+
+USAGE_FIELDS = ["prompt_tokens", "cached_prompt_tokens", "uncached_prompt_tokens", "completion_tokens", "total_tokens"]
+
+# Relative width of the token histogram buckets (quantiles are within ~1%)
+HISTOGRAM_GROWTH = 1.02
+
+
+class TokenHistogram:
+    """
+    Log-spaced histogram of per-call token counts.
+
+    Its size depends on the range of values, not the number of calls, and
+    quantiles are accurate to about half a bucket width.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.count = 0
+
+    def add(self, value: int) -> None:
+        bucket = 0 if value <= 0 else int(math.log(value) / math.log(HISTOGRAM_GROWTH)) + 1
+        self.counts[bucket] += 1
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Approximate q-quantile (0 <= q <= 1) of the added values."""
+        if self.count == 0:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen > rank:
+                if bucket == 0:
+                    return 0.0
+                # Geometric midpoint of the bucket
+                return HISTOGRAM_GROWTH ** (bucket - 0.5)
+        return HISTOGRAM_GROWTH ** (max(self.counts) - 0.5)
+
+
+class UsageAggregate:
+    """
+    Running token totals of a set of calls, with per-call mean and percentiles.
+    """
+
+    def __init__(self, name: str = "total", log_path: Optional[str] = None, restart: bool = False):
+        """
+        Args:
+            name: Name of the scope, stored with its records
+            log_path: JSONL file the records are appended to (none if None)
+            restart: Whether to start the log afresh instead of appending to it
+        """
+        self.name = name
+        self.log_path = log_path
+        self.calls = 0
+        self.loaded_calls = 0
+        self.sums = {field: 0 for field in USAGE_FIELDS}
+        self.histogram = TokenHistogram()
+        self._log = open(log_path, "w" if restart else "a", encoding="utf-8") if log_path else None
+
+    def add(self, record: Dict[str, Any], line: Optional[str] = None) -> None:
+        # Callers hold the tracker lock
+        self._count(record["usage"])
+        if self._log is not None:
+            self._log.write((line or json.dumps(record)) + "\n")
+            self._log.flush()
+
+    def _count(self, usage: Dict[str, Any]) -> None:
+        self.calls += 1
+        for field in USAGE_FIELDS:
+            self.sums[field] += usage.get(field, 0)
+        if "total_tokens" in usage:
+            self.histogram.add(usage["total_tokens"])
+
+    def load(self) -> int:
+        """
+        Count the records already in the log, e.g. from earlier sessions of a
+        resumed run.
+
+        Returns:
+            Number of records loaded
+        """
+        if not self.log_path or not os.path.exists(self.log_path):
+            return 0
+        loaded, line = 0, ""
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave a partial last line
+                    continue
+                self._count(record.get("usage") or {})
+                loaded += 1
+        # Start the records of this session on a fresh line
+        if self._log is not None and line and not line.endswith("\n"):
+            self._log.write("\n")
+        self.loaded_calls += loaded
+        return loaded
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Totals in the format of the old "total_usage" dictionary, plus the mean
+        and p50/p95 of total tokens per call.
+        """
+        summary = dict(self.sums, calls=self.calls, calls_from_earlier_sessions=self.loaded_calls)
+        summary["mean_tokens_per_call"] = self.sums["total_tokens"] / self.calls if self.calls else 0
+        summary["p50_tokens_per_call"] = self.histogram.quantile(0.5)
+        summary["p95_tokens_per_call"] = self.histogram.quantile(0.95)
+        return summary
+
+
+class TokenTracker:
+    """
+    Thread- and asyncio-safe token usage tracker with per-run scopes.
+
+    Example:
+        tracker = get_token_tracker()
+        with tracker.scope("run", "run_token_usage.jsonl") as usage:
+            ...
+        print(usage.summary()["total_tokens"])
+    """
+
+    def __init__(self, log_path: Optional[str] = DEFAULT_LOG_PATH):
+        """
+        Args:
+            log_path: JSONL file every record is appended to (none if empty)
+        """
+        self._lock = threading.Lock()
+        self.total = UsageAggregate("total", log_path or None)
+        self._scopes = ContextVar("token_scopes", default=())
+        # Characters and tokens of calls that reported usage, for estimate_request_tokens
+        self.estimate_totals = {"characters": 0, "prompt_tokens": 0, "completion_tokens": 0, "calls": 0}
+
+    @contextmanager
+    def scope(self, name: str, log_path: Optional[str] = None, resume: bool = False):
+        """
+        Count every call made inside the block (and in tasks started from it)
+        in a new aggregate, which is yielded.
+
+        Args:
+            name: Scope name, e.g. the experiment configuration
+            log_path: JSONL file the scope's records are appended to
+            resume: Whether to count the records already in the log and append
+                to it; if False, the log is started afresh
+        """
+        aggregate = UsageAggregate(name, log_path, restart=not resume)
+        if resume:
+            aggregate.load()
+        token = self._scopes.set(self._scopes.get() + (aggregate,))
+        try:
+            yield aggregate
+        finally:
+            self._scopes.reset(token)
+            with self._lock:
+                aggregate.close()
+
+    def record(self, content: str, instruction: str, model: str, response) -> Dict[str, Any]:
+        """
+        Record the token usage of one call.
+
+        Args:
+            content: The input content
+            instruction: The system instruction
+            model: The model used
+            response: The model's response object
+
+        Returns:
+            The record that was added
+        """
+        # Extract response text
+        response_text = ""
+        if hasattr(response, 'text'):
+            response_text = response.text or ""
+        elif hasattr(response, 'candidates') and response.candidates:
+            response_text = response.candidates[0].content.parts[0].text
+
+        # Extract token usage if available
+        usage_data = {}
+        if hasattr(response, 'usage_metadata'):
+            usage = response.usage_metadata
+            prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+            # prompt_token_count includes tokens served from a context cache
+            cached_prompt_tokens = getattr(usage, 'cached_content_token_count', 0) or 0
+            usage_data = {
+                "prompt_tokens": prompt_tokens,
+                "cached_prompt_tokens": cached_prompt_tokens,
+                "uncached_prompt_tokens": prompt_tokens - cached_prompt_tokens,
+                "completion_tokens": getattr(usage, 'candidates_token_count', 0) or 0,
+                "total_tokens": getattr(usage, 'total_token_count', 0) or 0
+            }
+
+        scopes = self._scopes.get()
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "scope": scopes[-1].name if scopes else None,
+            "model": model,
+            "content_length": len(content),
+            "instruction_length": len(instruction),
+            "response_length": len(response_text),
+            "usage": usage_data
+        }
+        line = json.dumps(record)
+
+        with self._lock:
+            self.total.add(record, line)
+            for aggregate in scopes:
+                aggregate.add(record, line)
+            if usage_data.get("prompt_tokens"):
+                self.estimate_totals["characters"] += len(content) + len(instruction)
+                self.estimate_totals["prompt_tokens"] += usage_data["prompt_tokens"]
+                self.estimate_totals["completion_tokens"] += usage_data["completion_tokens"]
+                self.estimate_totals["calls"] += 1
+        return record
+
+    def current_scope(self) -> UsageAggregate:
+        """The innermost active scope, or the process-wide totals."""
+        scopes = self._scopes.get()
+        return scopes[-1] if scopes else self.total
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_token_tracker() -> TokenTracker:
+    """
+    Return the process-wide token tracker, creating it on first use.
+    """
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = TokenTracker()
+    return _tracker
+
+
+def token_scope(name: str, log_path: Optional[str] = None, resume: bool = False):
+    """Open a scope on the process-wide tracker (see TokenTracker.scope)."""
+    return get_token_tracker().scope(name, log_path, resume)
+
 
 def record_token_usage(content: str, instruction: str, model: str, response) -> None:
     """
     Record token usage, input, output, and model information.
-    
+
     Args:
         content: The input content
         instruction: The system instruction
         model: The model used
         response: The model's response object
     """
-    global token_usage
-    
-    # Extract response text
-    response_text = ""
-    if hasattr(response, 'text'):
-        response_text = response.text
-    elif hasattr(response, 'candidates') and response.candidates:
-        response_text = response.candidates[0].content.parts[0].text
-    
-    # Extract token usage if available
-    usage_data = {}
-    if hasattr(response, 'usage_metadata'):
-        usage = response.usage_metadata
-        usage_data = {
-            "prompt_tokens": usage.prompt_token_count if hasattr(usage, 'prompt_token_count') else 0,
-            "completion_tokens": usage.candidates_token_count if hasattr(usage, 'candidates_token_count') else 0,
-            "total_tokens": usage.total_token_count if hasattr(usage, 'total_token_count') else 0
-        }
-    
-    # Create record
-    record = {
-        "timestamp": datetime.now().isoformat(),
-        "model": model,
-        "content_length": len(content),
-        "instruction_length": len(instruction),
-        "response_length": len(response_text),
-        "usage": usage_data
-    }
-    
-    # Add record to token_usage
-    token_usage["records"].append(record)
-    
-    # Update total counts
-    token_usage["total_usage"]["calls"] += 1
-    if "prompt_tokens" in usage_data:
-        token_usage["total_usage"]["prompt_tokens"] += usage_data["prompt_tokens"]
-    if "completion_tokens" in usage_data:
-        token_usage["total_usage"]["completion_tokens"] += usage_data["completion_tokens"]
-    if "total_tokens" in usage_data:
-        token_usage["total_usage"]["total_tokens"] += usage_data["total_tokens"]
-
-def save_token_usage(filepath="token_usage_log.json"):
-    """
-    Save token usage data to a JSON file.
-    
+    get_token_tracker().record(content, instruction, model, response)
+
+
+def estimate_request_tokens(content: str, instruction: str) -> int:
+    """
+    Estimate the total tokens a call will use before making it.
+
+    Uses the characters-per-prompt-token ratio and the mean completion size of
+    the calls recorded so far, or the DEFAULT_* values before the first one.
+
+    Args:
+        content: The input content
+        instruction: The system instruction
+
+    Returns:
+        Estimated prompt plus completion tokens
+    """
+    totals = get_token_tracker().estimate_totals
+    characters = len(content) + len(instruction)
+    if totals["calls"] == 0:
+        return int(characters / DEFAULT_CHARS_PER_TOKEN) + DEFAULT_COMPLETION_TOKENS
+    prompt_tokens = characters * totals["prompt_tokens"] / max(1, totals["characters"])
+    completion_tokens = totals["completion_tokens"] / totals["calls"]
+    return int(prompt_tokens + completion_tokens) + 1
+
+
+def save_token_usage(filepath="token_usage_log.json", usage: Optional[UsageAggregate] = None):
+    """
+    Save a token usage summary to a JSON file.
+
+    Only the aggregates are written; the per-call records are in the scope's
+    JSONL log, if it has one.
+
     Args:
         filepath: Path to save the JSON file
+        usage: Scope to save (defaults to the current scope, or the process-wide totals)
     """
+    usage = usage or get_token_tracker().current_scope()
+    summary = {"scope": usage.name, "total_usage": usage.summary()}
+    if usage.log_path:
+        summary["records_path"] = usage.log_path
     with open(filepath, 'w') as f:
-        json.dump(token_usage, f, indent=4)
+        json.dump(summary, f, indent=4)
     print(f"Token usage saved to {filepath}")
-    
-def display_token_usage_summary():
+
+
+def display_token_usage_summary(usage: Optional[UsageAggregate] = None):
     """
     Display a summary of token usage.
+
+    Args:
+        usage: Scope to summarize (defaults to the process-wide totals)
     """
-    print(f"Total API calls: {token_usage['total_usage']['calls']}")
-    print(f"Total tokens used: {token_usage['total_usage']['total_tokens']}")
-    print(f"Total prompt tokens: {token_usage['total_usage']['prompt_tokens']}")
-    print(f"Total completion tokens: {token_usage['total_usage']['completion_tokens']}") 
\ No newline at end of file
+    summary = (usage or get_token_tracker().total).summary()
+    print(f"Total API calls: {summary['calls']}")
+    if summary['calls_from_earlier_sessions']:
+        print(f"  From earlier sessions of a resumed run: {summary['calls_from_earlier_sessions']}")
+    print(f"Total tokens used: {summary['total_tokens']}")
+    print(f"Total prompt tokens: {summary['prompt_tokens']}")
+    print(f"  Cached prompt tokens: {summary['cached_prompt_tokens']}")
+    print(f"  Uncached prompt tokens: {summary['uncached_prompt_tokens']}")
+    print(f"Total completion tokens: {summary['completion_tokens']}")
+    print(f"Tokens per call: mean {summary['mean_tokens_per_call']:.1f}, "
+          f"p50 {summary['p50_tokens_per_call']:.0f}, p95 {summary['p95_tokens_per_call']:.0f}")
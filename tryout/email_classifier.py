@@ -9,18 +9,30 @@ with on-demand AI classification based on user-defined keywords.
 import os
 import sys
 import json
-import string
 import re
+import time
 from typing import List, Dict, Any
 from datetime import datetime, timedelta
-import spacy
-from spacy.lang.en.stop_words import STOP_WORDS
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file, Response, stream_with_context, g
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import io
-
-# Google Gemini imports
-from google import genai
-from google.genai import types
+import threading
+import atexit
+
+# google-genai is imported where the client is set up, since it takes most of a second to import
+
+# Shared modules (LLM cache, etc.) live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_cache import get_llm_cache, make_cache_key
+from mutation_log import MutationLog
+from email_store import EmailStore
+from search_index import SearchIndex
+from near_duplicates import NearDuplicateIndex
+from rate_limiter import get_rate_limiter, RateLimitExceeded, is_rate_limit_error
+from token_tracker import estimate_request_tokens, record_token_usage, get_token_tracker
+from latency import span
+from mock_llm import MOCK_LLM_ENABLED, create_mock_client
+from metrics import get_metrics_registry, gauge, counter_family, latency_stage_collector, CONTENT_TYPE
 
 # Initialize Flask application
 app = Flask(__name__)
@@ -34,10 +46,58 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit
 DATA_FILE = os.path.join('data', 'qtm_email.json')
 _EMAILS_CACHE = []
 
+# Emails by their stable 'id', and the lock that serializes inbox mutations
+_EMAILS_BY_ID = {}
+_NEXT_EMAIL_ID = 0
+_INBOX_LOCK = threading.RLock()
+_MUTATION_LOG = None
+_EMAIL_STORE = None
+_SEARCH_INDEX = None
+
+# Number of logged mutations after which the inbox snapshot is rewritten
+INBOX_COMPACT_EVERY = int(os.getenv("INBOX_COMPACT_EVERY", 1000))
+
+# Number of emails listed per page, and the most a client may ask for
+INBOX_PAGE_SIZE = int(os.getenv("INBOX_PAGE_SIZE", 50))
+INBOX_MAX_PAGE_SIZE = 500
+
+# Length of the body preview shown in the email list
+SNIPPET_LENGTH = 80
+
+# Prometheus metrics served at /metrics (see metrics.py)
+METRICS = get_metrics_registry()
+HTTP_REQUESTS = METRICS.counter(
+    "emaillm_http_requests_total", "HTTP requests by route, method and status", ["route", "method", "status"])
+HTTP_REQUEST_DURATION = METRICS.histogram(
+    "emaillm_http_request_duration_seconds", "Time to produce a response, by route", ["route", "method"])
+LLM_CALLS = METRICS.counter(
+    "emaillm_llm_calls_total", "Requests sent to the LLM (retries included), by model", ["model"])
+LLM_ERRORS = METRICS.counter(
+    "emaillm_llm_errors_total", "Failed LLM requests by model and kind (rate_limited or error)", ["model", "kind"])
+LLM_CALL_DURATION = METRICS.histogram(
+    "emaillm_llm_call_duration_seconds", "Duration of LLM requests, by model", ["model"])
+SAVE_EMAILS_DURATION = METRICS.histogram(
+    "emaillm_save_emails_duration_seconds", "Time to write an inbox snapshot")
+
 @app.before_request
 def make_session_permanent():
     session.permanent = True
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by the route pattern, not the path, so /api/emails/<id> is one series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+    start = g.get('request_start')
+    if start is not None:
+        # For streamed responses this is the time to the first byte
+        HTTP_REQUEST_DURATION.observe(route, request.method, seconds=time.perf_counter() - start)
+    return response
+
 def load_and_cache_emails():
     """Load emails and store them in both session and cache"""
     global _EMAILS_CACHE
@@ -54,6 +114,8 @@ def load_and_cache_emails():
     # Load emails from common paths
     emails = None
     possible_paths = [
+        # Snapshots are written to DATA_FILE, so it takes precedence
+        DATA_FILE,
         os.path.join(os.path.dirname(__file__), '..', 'data', 'qtm_email.json'),
         # os.path.join(os.path.dirname(__file__), '..', 'data', 'emailGroup1.json'),
         os.path.join(os.path.dirname(__file__), 'data', 'qtm_email.json'),
@@ -61,13 +123,15 @@ def load_and_cache_emails():
         os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'qtm_email.json')
     ]
 
+    snapshot_bytes = None
     for path in possible_paths:
         print(f"Checking for emails at: {path}")
         if os.path.exists(path):
             print(f"File found at: {path}")
             try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    emails = json.load(f)
+                with open(path, 'rb') as f:
+                    snapshot_bytes = f.read()
+                emails = json.loads(snapshot_bytes.decode('utf-8'))
                 print(f"Loaded emails successfully from {path}")
                 break  # Stop after successfully loading from one file
             except json.JSONDecodeError:
@@ -86,9 +150,31 @@ def load_and_cache_emails():
     for email in emails:
         if 'tags' not in email:
             email['tags'] = []
+    assign_email_ids(emails)
 
     # Store in cache
     _EMAILS_CACHE = emails
+    _EMAILS_BY_ID.clear()
+    _EMAILS_BY_ID.update((email['id'], email) for email in emails)
+
+    # Replay mutations logged since the snapshot was written
+    replayed = 0
+    for mutation in get_mutation_log().replay(snapshot_bytes):
+        apply_mutation(mutation)
+        replayed += 1
+    if replayed:
+        print(f"Replayed {replayed} logged mutations.")
+    emails = _EMAILS_CACHE
+
+    # Bring the indexed store up to date if it missed any mutations
+    seq = get_mutation_log().last_seq
+    if not get_email_store().is_current(seq, len(emails)):
+        print("Rebuilding email store...")
+        get_email_store().rebuild(emails, seq)
+    search_index = get_search_index()
+    if search_index.seq != seq or len(search_index) != len(emails):
+        print("Rebuilding search index...")
+        search_index.rebuild(emails, seq)
     print(f"Loaded and cached {len(emails)} emails.")
     if _EMAILS_CACHE:
         print(f"First email in cache: {_EMAILS_CACHE[0].get('subject', 'No Subject')}")
@@ -96,6 +182,158 @@ def load_and_cache_emails():
         print("Cache is empty after loading attempt.")
     return emails
 
+def assign_email_ids(emails: List[Dict[str, Any]]) -> None:
+    """
+    Give every email without one a stable integer 'id'.
+
+    Ids are assigned oldest-first (the list is newest-first), continuing
+    from the highest existing id, so the same file always yields the same ids.
+    """
+    global _NEXT_EMAIL_ID
+    next_id = max((email['id'] for email in emails if isinstance(email.get('id'), int)), default=-1) + 1
+    for email in reversed(emails):
+        if not isinstance(email.get('id'), int):
+            email['id'] = next_id
+            next_id += 1
+    _NEXT_EMAIL_ID = next_id
+
+def get_mutation_log() -> MutationLog:
+    """Return the inbox mutation log, opening it on first use."""
+    global _MUTATION_LOG
+    if _MUTATION_LOG is None:
+        _MUTATION_LOG = MutationLog(DATA_FILE + ".log", compact_every=INBOX_COMPACT_EVERY, compact=save_emails)
+    return _MUTATION_LOG
+
+def get_email_store() -> EmailStore:
+    """Return the indexed email store, opening it on first use."""
+    global _EMAIL_STORE
+    if _EMAIL_STORE is None:
+        _EMAIL_STORE = EmailStore(os.path.splitext(DATA_FILE)[0] + '.sqlite3')
+    return _EMAIL_STORE
+
+def get_search_index() -> SearchIndex:
+    """Return the full-text search index, loading it from disk on first use."""
+    global _SEARCH_INDEX
+    if _SEARCH_INDEX is None:
+        path = os.path.splitext(DATA_FILE)[0] + '.search'
+        _SEARCH_INDEX = SearchIndex.load(path) or SearchIndex()
+        atexit.register(save_search_index, path)
+    return _SEARCH_INDEX
+
+def save_search_index(path: str = None) -> None:
+    """Persist the search index so the next start does not have to rebuild it."""
+    try:
+        get_search_index().save(path or os.path.splitext(DATA_FILE)[0] + '.search')
+    except Exception as e:
+        print(f"Error saving search index: {e}")
+
+def emails_for_ids(email_ids: List[int]) -> List[Dict[str, Any]]:
+    """Look up emails by id, skipping any deleted since the ids were fetched."""
+    return [_EMAILS_BY_ID[email_id] for email_id in email_ids if email_id in _EMAILS_BY_ID]
+
+def email_summary(email: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the header fields of an email plus a short preview of its body."""
+    content = " ".join((email.get('content') or '').split())
+    if len(content) > SNIPPET_LENGTH:
+        content = content[:SNIPPET_LENGTH - 3].rsplit(' ', 1)[0] + '...'
+    return {
+        'id': email['id'],
+        'sender_name': email.get('sender_name', ''),
+        'sender_email': email.get('sender_email', ''),
+        'subject': email.get('subject', ''),
+        'date': email.get('date', ''),
+        'tags': list(email.get('tags', [])),
+        'snippet': content
+    }
+
+def list_email_page(keyword: str = None, search_query: str = '', cursor: str = None, limit: int = None):
+    """
+    Return one page of the inbox listing.
+
+    Folder listings are paged by position, so new emails arriving at the top
+    of the inbox do not shift later pages. Search results are paged by rank.
+
+    Args:
+        keyword: Folder to list ('inbox', 'untagged' or a keyword), or None for the inbox
+        search_query: Full-text query, used when no keyword folder is selected
+        cursor: Cursor returned with the previous page, or None for the first page
+        limit: Number of emails per page (defaults to INBOX_PAGE_SIZE)
+
+    Returns:
+        Tuple of (list of emails, cursor for the next page or None)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    limit = limit or INBOX_PAGE_SIZE
+    after = int(cursor) if cursor else None
+    if (keyword and keyword != 'inbox') or not search_query:
+        tag = keyword if keyword not in (None, '', 'inbox', 'untagged') else None
+        rows = get_email_store().email_page(tag=tag, untagged=keyword == 'untagged', before=after, limit=limit + 1)
+        page = rows[:limit]
+        next_cursor = str(page[-1][1]) if len(rows) > limit else None
+        return emails_for_ids([email_id for email_id, _ in page]), next_cursor
+
+    offset = after or 0
+    results = get_search_index().search(search_query, limit=offset + limit + 1)
+    page = results[offset:offset + limit]
+    next_cursor = str(offset + limit) if len(results) > offset + limit else None
+    return emails_for_ids([email_id for email_id, _ in page]), next_cursor
+
+def apply_mutation(mutation: Dict[str, Any]) -> None:
+    """
+    Apply a mutation to the in-memory inbox.
+
+    Supported mutations:
+        {"op": "set_tags", "id": ..., "tags": [...]}
+        {"op": "insert", "email": {...}}          (inserted at the front)
+        {"op": "remove_tag", "tag": ...}
+        {"op": "delete_untagged"}
+    """
+    global _EMAILS_CACHE, _NEXT_EMAIL_ID
+    op = mutation['op']
+    # Tags are a set, as in the email store: duplicates (e.g. a keyword the LLM repeated) are dropped
+    if op == 'set_tags':
+        email = _EMAILS_BY_ID.get(mutation['id'])
+        if email is not None:
+            email['tags'] = list(dict.fromkeys(mutation['tags']))
+    elif op == 'insert':
+        email = dict(mutation['email'])
+        if 'tags' in email:
+            email['tags'] = list(dict.fromkeys(email['tags']))
+        _EMAILS_CACHE.insert(0, email)
+        _EMAILS_BY_ID[email['id']] = email
+        _NEXT_EMAIL_ID = max(_NEXT_EMAIL_ID, email['id'] + 1)
+    elif op == 'remove_tag':
+        for email in _EMAILS_CACHE:
+            if mutation['tag'] in email.get('tags', []):
+                email['tags'] = [tag for tag in email['tags'] if tag != mutation['tag']]
+    elif op == 'delete_untagged':
+        for email in _EMAILS_CACHE:
+            if not email['tags']:
+                del _EMAILS_BY_ID[email['id']]
+        _EMAILS_CACHE = [email for email in _EMAILS_CACHE if email['tags']]
+    else:
+        print(f"Ignoring unknown mutation: {op}")
+
+def record_mutation(mutation: Dict[str, Any]) -> None:
+    """Apply a mutation to the inbox, the email store and the search index, and append it to the mutation log."""
+    with _INBOX_LOCK:
+        removed_ids = []
+        if mutation['op'] == 'delete_untagged':
+            removed_ids = [email['id'] for email in _EMAILS_CACHE if not email['tags']]
+        apply_mutation(mutation)
+        seq = get_mutation_log().append(mutation)
+        get_email_store().apply(mutation, seq)
+
+        # Tags are not indexed, so only inserts and deletions touch the search index
+        search_index = get_search_index()
+        if mutation['op'] == 'insert':
+            search_index.add(mutation['email'])
+        for email_id in removed_ids:
+            search_index.remove(email_id)
+        search_index.seq = seq
+
 # Load environment variables
 from dotenv import load_dotenv
 load_dotenv()
@@ -104,12 +342,17 @@ load_dotenv()
 
 def setup_gemini_client():
     """Configure and return the Gemini API client."""
+    if MOCK_LLM_ENABLED:
+        # Offline load tests: replayed or scripted responses, no network (mock_llm.py)
+        return create_mock_client()
+
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         print("GEMINI_API_KEY is not set. Please set it in your .env file.")
         return None
     
     try:
+        from google import genai
         # genai.configure(api_key=api_key)
         # client = genai.GenerativeModel('gemini-2.0-flash')
         client = genai.Client(api_key=api_key)
@@ -118,39 +361,16 @@ def setup_gemini_client():
         print(f"Failed to configure Gemini API: {str(e)}")
         return None
 
-# ============ Text Processing Functions ============
+_GEMINI_CLIENT = None
 
-# Load spaCy's English language model
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("Downloading spaCy model...")
-    spacy.cli.download("en_core_web_sm")
-    nlp = spacy.load("en_core_web_sm")
+def get_gemini_client():
+    """Return the shared Gemini client, configuring it on first use."""
+    global _GEMINI_CLIENT
+    if _GEMINI_CLIENT is None:
+        _GEMINI_CLIENT = setup_gemini_client()
+    return _GEMINI_CLIENT
 
-def preprocess_email(email_text: str) -> str:
-    """
-    Preprocess email text by tokenizing, lemmatizing, and removing stopwords.
-    
-    Args:
-        email_text: The raw email text
-        
-    Returns:
-        Preprocessed email text
-    """
-    # Convert emails to lower case
-    email_text = email_text.lower()
-    
-    # Tokenize the email text
-    doc = nlp(email_text)
-    
-    # Lemmatize, remove stopwords, and punctuation
-    lemmatized_tokens = [token.lemma_ for token in doc if token.text not in STOP_WORDS and token.text not in string.punctuation]
-    
-    # Join the lemmatized tokens back into a string
-    processed_text = " ".join(lemmatized_tokens)
-    
-    return processed_text
+# ============ Text Processing Functions ============
 
 def keyword_preprocessing(keywords: str) -> List[str]:
     """
@@ -177,7 +397,11 @@ def retrieve_user_keywords() -> List[str]:
 
 # ============ Email Classification Functions ============
 
-def call_llm(client, content: str, instruction: str, model: str = "gemini-2.0-flash") -> str:
+# Generation settings shared by every LLM call
+LLM_TEMPERATURE = 0.1
+LLM_MAX_OUTPUT_TOKENS = 1024
+
+def call_llm(client, content: str, instruction: str, model: str = "gemini-2.0-flash", use_cache: bool = True) -> str:
     """
     Call the language model to generate a response based on the content and instruction.
     
@@ -186,43 +410,70 @@ def call_llm(client, content: str, instruction: str, model: str = "gemini-2.0-fl
         content: The email content to be classified
         instruction: The system instruction for the model
         model: The model to use for generation
+        use_cache: Whether to serve and store the response in the LLM cache
         
     Returns:
         The model's response text
+        
+    Raises:
+        RateLimitExceeded: If the call was still throttled after every retry
+        Exception: Any other failure of the call, so an error is never taken
+            for a classification
     """
+    cache_key = make_cache_key(model, instruction, content, LLM_TEMPERATURE, LLM_MAX_OUTPUT_TOKENS)
+    if use_cache:
+        cached = get_llm_cache().get(cache_key)
+        if cached is not None:
+            return cached
     try:
+        from google.genai import types
         print(f"Calling LLM with {len(content)} characters of content")
-        response = client.models.generate_content(
-        model=model,
-        contents=[content], # here should the content of email be
-        config=types.GenerateContentConfig(
-            max_output_tokens=1024,
-            temperature=0.1,
-            system_instruction= instruction,
-        )
-        )
+        
+        def generate():
+            LLM_CALLS.inc(model)
+            try:
+                # Only the request itself is timed, not rate limiting or backoff
+                with span("llm_call"), LLM_CALL_DURATION.time(model):
+                    return client.models.generate_content(
+                    model=model,
+                    contents=[content], # here should the content of email be
+                    config=types.GenerateContentConfig(
+                        max_output_tokens=LLM_MAX_OUTPUT_TOKENS,
+                        temperature=LLM_TEMPERATURE,
+                        system_instruction= instruction,
+                    )
+                    )
+            except Exception as e:
+                LLM_ERRORS.inc(model, 'rate_limited' if is_rate_limit_error(e) else 'error')
+                raise
+        
+        # Shared with concurrent /classify-batch workers; retries throttled requests
+        response = get_rate_limiter().call(generate, estimate_request_tokens(content, instruction))
+        # Aggregated in constant memory (set EMAILLM_TOKEN_USAGE_LOG to also log each call)
+        record_token_usage(content, instruction, model, response)
         if hasattr(response, 'text'):
-            return response.text
+            text = response.text
         elif hasattr(response, 'candidates') and response.candidates:
-            return response.candidates[0].content.parts[0].text
+            text = response.candidates[0].content.parts[0].text
         else:
             print("Unexpected response format:", response)
             return str(response)
+        if use_cache and text is not None:
+            get_llm_cache().put(cache_key, text)
+        return text
     except Exception as e:
         print(f"Error calling LLM: {str(e)}")
-        return f"Error: {str(e)}"
+        raise
 
-def classify_email(email_content: str, keywords: List[str], client) -> Dict[str, Any]:
+def build_classification_prompt(keywords: List[str]) -> str:
     """
-    Classify an email based on its content and user-defined keywords.
+    Build the classification system instruction for the user's keywords.
     
     Args:
-        email_content: The preprocessed email content
         keywords: List of user-defined keywords
-        client: The generative AI client
         
     Returns:
-        Classification result dictionary
+        The system instruction string
     """
     KEYWORDS = ", ".join(keywords)
 
@@ -267,30 +518,47 @@ def classify_email(email_content: str, keywords: List[str], client) -> Dict[str,
 
     Do not include any additional explanation or analysis in your response.
     """
+    return PROMPT_CLASSIFICATION
+
+def classify_email(email_content: str, keywords: List[str], client) -> Dict[str, Any]:
+    """
+    Classify an email based on its content and user-defined keywords.
+    
+    Args:
+        email_content: The preprocessed email content
+        keywords: List of user-defined keywords
+        client: The generative AI client
+        
+    Returns:
+        Classification result dictionary
+    """
+    with span("prompt_assembly"):
+        PROMPT_CLASSIFICATION = build_classification_prompt(keywords)
     response = call_llm(client, content=email_content, instruction=PROMPT_CLASSIFICATION)
     
     # Parse the result
-    try:
-        keywords_line = next((line for line in response.strip().split('\n') if line.startswith('KEYWORDS:')), '')
-        found_keywords = keywords_line.replace('KEYWORDS:', '').strip()
-        
-        if found_keywords.upper() == 'NONE':
+    with span("parsing"):
+        try:
+            keywords_line = next((line for line in response.strip().split('\n') if line.startswith('KEYWORDS:')), '')
+            found_keywords = keywords_line.replace('KEYWORDS:', '').strip()
+            
+            if found_keywords.upper() == 'NONE':
+                return {
+                    'relevant_keywords': [],
+                    'raw_result': response
+                }
+            else:
+                return {
+                    'relevant_keywords': [kw.strip().lower() for kw in found_keywords.split(',')],
+                    'raw_result': response
+                }
+        except Exception as e:
+            print(f"Error parsing classification result: {str(e)}")
             return {
                 'relevant_keywords': [],
-                'raw_result': response
+                'raw_result': response,
+                'error': str(e)
             }
-        else:
-            return {
-                'relevant_keywords': [kw.strip().lower() for kw in found_keywords.split(',')],
-                'raw_result': response
-            }
-    except Exception as e:
-        print(f"Error parsing classification result: {str(e)}")
-        return {
-            'relevant_keywords': [],
-            'raw_result': response,
-            'error': str(e)
-        }
 
 # ============ Email Loading Functions ============
 
@@ -369,16 +637,22 @@ def load_emails():
         _EMAILS_CACHE = {}
 
 def save_emails():
-    """Save the current email data to the JSON file, with new emails at the front."""
+    """
+    Write a snapshot of the inbox to the JSON file and compact the mutation log.
+
+    Routes do not call this directly; they record mutations, and the mutation
+    log calls this in the background once enough records have accumulated.
+    """
     try:
-        # Create a temporary file
-        temp_file_path = DATA_FILE + ".tmp"
-        with open(temp_file_path, 'w', encoding='utf-8') as f:
-            # Ensure the newest emails (from _EMAILS_CACHE) are written first
-            json.dump(_EMAILS_CACHE, f, indent=4)
-
-        # Rename the temporary file to the original file
-        os.replace(temp_file_path, DATA_FILE)
+        with span("persistence"), SAVE_EMAILS_DURATION.time():
+            mutation_log = get_mutation_log()
+            with _INBOX_LOCK:
+                seq = mutation_log.last_seq
+                # Copy tag lists so later mutations cannot change the snapshot mid-write
+                snapshot = [dict(email, tags=list(email.get('tags', []))) for email in _EMAILS_CACHE]
+            data = json.dumps(snapshot, indent=4).encode('utf-8')
+            mutation_log.write_snapshot(DATA_FILE, data, seq)
+            save_search_index()
         print(f"Successfully saved email data to {DATA_FILE} with new emails at the front.")
 
     except Exception as e:
@@ -398,7 +672,7 @@ def process_chat_query(query: str, email_data: Dict[str, Any]) -> str:
     Returns:
         AI response
     """
-    client = setup_gemini_client()
+    client = get_gemini_client()
     if not client:
         return "Sorry, I can't process your query right now. The AI service is unavailable."
     
@@ -432,56 +706,72 @@ def process_chat_query(query: str, email_data: Dict[str, Any]) -> str:
 @app.route('/')
 def home():
     """
-    Render the home page with email list, optionally filtered by keyword.
+    Render the home page with the first page of the email list, optionally
+    filtered by keyword or search query. Further pages and email bodies are
+    fetched from /api/emails as they are needed.
     """
-    emails = _EMAILS_CACHE
+    store = get_email_store()
     keywords = session.get('keywords', [])
     selected_keyword = request.args.get('keyword', None)
     search_query = request.args.get('q', '')
     
-    total_emails = len(emails)  # Calculate the total number of emails
+    total_emails = store.total_count()  # Calculate the total number of emails
 
-    emails_by_keyword = {keyword: [] for keyword in keywords}
-    untagged_count = 0
-    for email in emails:
-        if not email['tags']:
-            untagged_count += 1
-            emails_by_keyword['untagged'] = emails_by_keyword.get('untagged', []) + [email]
-        else:
-            for tag in email['tags']:
-                if tag in emails_by_keyword:
-                    emails_by_keyword[tag].append(email)
+    # Folder counts come from the tag index rather than a scan of every email
+    tag_counts = store.tag_counts()
+    keyword_counts = {keyword: tag_counts.get(keyword, 0) for keyword in keywords}
+    untagged_count = store.untagged_count()
 
-    filtered_emails = []
-    if selected_keyword == 'untagged':
-        filtered_emails = [email for email in emails if not email['tags']]
-    elif selected_keyword and selected_keyword != 'inbox': # Exclude 'inbox' here
-        filtered_emails = [
-            email for email in emails if selected_keyword in email['tags']
-        ]
-    elif search_query:
-        terms = search_query.lower().split()
-        for email in emails:
-            subject = email.get('subject', '').lower()
-            content = email.get('content', '').lower()
-            sender = email.get('sender_name', '').lower()
-            if any(term in subject or term in content or term in sender for term in terms):
-                filtered_emails.append(email)
-    else: # Handles default case OR selected_keyword == 'inbox'
-        filtered_emails = emails
+    # Keyword folders take precedence over the search query; search results are ranked
+    filtered_emails, next_cursor = list_email_page(selected_keyword, search_query)
 
     return render_template(
         'index.html',
-        emails=filtered_emails,
+        emails=[email_summary(email) for email in filtered_emails],
+        next_cursor=next_cursor,
+        page_size=INBOX_PAGE_SIZE,
         keywords=keywords,
         search_query=search_query,
         selected_keyword=selected_keyword,
-        emails_by_keyword=emails_by_keyword,
+        keyword_counts=keyword_counts,
         untagged_count=untagged_count,
         total_emails=total_emails,
         current_step=4,
     )
 
+@app.route('/api/emails', methods=['GET'])
+def api_list_emails():
+    """
+    API endpoint returning one page of the email list (header fields and a
+    snippet per email). Accepts the same keyword and q filters as the home
+    page, plus cursor and limit.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', INBOX_PAGE_SIZE)), 1), INBOX_MAX_PAGE_SIZE)
+        emails, next_cursor = list_email_page(
+            request.args.get('keyword', None),
+            request.args.get('q', ''),
+            request.args.get('cursor', None),
+            limit
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit.'}), 400
+
+    return jsonify({
+        'emails': [email_summary(email) for email in emails],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/emails/<int:email_id>', methods=['GET'])
+def api_get_email(email_id):
+    """
+    API endpoint returning a single email, including its full body.
+    """
+    email = _EMAILS_BY_ID.get(email_id)
+    if email is None:
+        return jsonify({'error': f'Email with ID {email_id} not found.'}), 404
+    return jsonify(email)
+
 @app.route('/process-emails', methods=['POST'])
 def process_emails():
     """
@@ -545,7 +835,8 @@ def final_result():
     return render_template('index.html', 
                           emails=emails, 
                           keywords=keywords,
-                          emails_by_keyword=emails_by_keyword,
+                          keyword_counts={keyword: len(tagged) for keyword, tagged in emails_by_keyword.items()},
+                          untagged_count=len(emails_by_keyword['untagged']),
                           current_step=4)
 
 @app.route('/classify-email', methods=['POST'])
@@ -565,20 +856,11 @@ def classify_single_email():
     except ValueError:
         return jsonify({'error': 'Invalid email ID format.'}), 400
     
-    # Get emails from cache instead of session
-    emails = _EMAILS_CACHE
-    print(f"Found {len(emails)} emails in cache")
-    
-    # Find the email by ID
-    try:
-        if email_id < 0 or email_id >= len(emails):
-            return jsonify({'error': f'Email ID {email_id} out of range.'}), 404
-        
-        email = emails[email_id]
-        print(f"Found email: {email.get('subject', 'No subject')}")
-    except Exception as e:
-        print(f"Error finding email: {str(e)}")
-        return jsonify({'error': f'Email with ID {email_id} not found. Error: {str(e)}'}), 404
+    # Find the email by its stable ID
+    email = _EMAILS_BY_ID.get(email_id)
+    if email is None:
+        return jsonify({'error': f'Email with ID {email_id} not found.'}), 404
+    print(f"Found email: {email.get('subject', 'No subject')}")
     
     # Get keywords
     keywords = session.get('keywords', [])
@@ -586,8 +868,8 @@ def classify_single_email():
     if not keywords:
         return jsonify({'error': 'No keywords defined.'}), 400
     
-    # Initialize Gemini client
-    client = setup_gemini_client()
+    # Get the shared Gemini client
+    client = get_gemini_client()
     if not client:
         return jsonify({
             'status': 'error',
@@ -597,15 +879,17 @@ def classify_single_email():
     # Classify the email
     email_content = email.get('content', '')
     print(f"Classifying email with content length: {len(email_content)}")
-    classification_result = classify_email(email_content, keywords, client)
+    try:
+        classification_result = classify_email(email_content, keywords, client)
+    except RateLimitExceeded as e:
+        # Leave the email's tags as they were
+        return jsonify({'status': 'error', 'message': f'AI service is rate limited, try again later: {str(e)}'}), 429
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Classification failed: {str(e)}'}), 502
     print(f"Classification result: {classification_result}")
     
-    # Update the email's tags
-    email['tags'] = classification_result.get('relevant_keywords', [])
-    
-    # Update cache
-    _EMAILS_CACHE[email_id] = email
-    save_emails() # <-- Add this line to persist changes
+    # Update the email's tags (applied to the cache and appended to the mutation log)
+    record_mutation({'op': 'set_tags', 'id': email['id'], 'tags': classification_result.get('relevant_keywords', [])})
     
     return jsonify({
         'status': 'success',
@@ -613,6 +897,111 @@ def classify_single_email():
         'tags': email['tags']
     })
 
+# Number of emails /classify-batch classifies at once
+BATCH_CLASSIFY_WORKERS = int(os.getenv("BATCH_CLASSIFY_WORKERS", 8))
+
+# Emails in a batch at least this similar (estimated Jaccard of word shingles)
+# are classified once and share the tags; 0 disables
+BATCH_DEDUP_THRESHOLD = float(os.getenv("BATCH_DEDUP_THRESHOLD", 0.9))
+
+@app.route('/classify-batch', methods=['POST'])
+def classify_batch():
+    """
+    API endpoint to classify several emails in one request.
+
+    Classifications run concurrently on the shared Gemini client and each
+    result is streamed back as a JSON line as soon as it finishes. Near-identical
+    emails in the batch are classified once and their results carry
+    `duplicate_of`. The email data is persisted once, after the whole batch.
+    """
+    data = request.get_json()
+    if not data or not isinstance(data.get('email_ids'), list):
+        return jsonify({'error': 'Invalid request. List of email IDs required.'}), 400
+
+    try:
+        email_ids = [int(email_id) for email_id in data['email_ids']]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid email ID format.'}), 400
+
+    keywords = session.get('keywords', [])
+    if not keywords:
+        return jsonify({'error': 'No keywords defined.'}), 400
+
+    client = get_gemini_client()
+    if not client:
+        return jsonify({
+            'status': 'error',
+            'message': 'AI service is currently unavailable.'
+        }), 500
+
+    # Resolve emails up front so concurrent deletions cannot change the targets
+    targets = {}
+    invalid_ids = []
+    for email_id in dict.fromkeys(email_ids):
+        if email_id in _EMAILS_BY_ID:
+            targets[email_id] = _EMAILS_BY_ID[email_id]
+        else:
+            invalid_ids.append(email_id)
+
+    # Group near-identical emails; only each group's representative is classified
+    duplicates = {email_id: [] for email_id in targets}
+    if BATCH_DEDUP_THRESHOLD > 0 and len(targets) > 1:
+        index = NearDuplicateIndex(threshold=BATCH_DEDUP_THRESHOLD)
+        for email_id, email in targets.items():
+            representative = index.assign(email_id, email.get('content', ''))
+            if representative != email_id:
+                del duplicates[email_id]
+                duplicates[representative].append(email_id)
+
+    def classify_and_tag(email):
+        classification_result = classify_email(email.get('content', ''), keywords, client)
+        tags = classification_result.get('relevant_keywords', [])
+        record_mutation({'op': 'set_tags', 'id': email['id'], 'tags': tags})
+        for duplicate_id in duplicates[email['id']]:
+            record_mutation({'op': 'set_tags', 'id': duplicate_id, 'tags': tags})
+        return tags
+
+    def generate():
+        classified = 0
+        failed = len(invalid_ids)
+        executor = ThreadPoolExecutor(max_workers=BATCH_CLASSIFY_WORKERS)
+        try:
+            for email_id in invalid_ids:
+                yield json.dumps({'status': 'error', 'email_id': email_id, 'message': f'Email with ID {email_id} not found.'}) + "\n"
+
+            futures = {
+                executor.submit(classify_and_tag, targets[email_id]): email_id
+                for email_id in duplicates
+            }
+            for future in as_completed(futures):
+                email_id = futures[future]
+                try:
+                    tags = future.result()
+                    classified += 1 + len(duplicates[email_id])
+                    yield json.dumps({'status': 'success', 'email_id': email_id, 'tags': tags}) + "\n"
+                    for duplicate_id in duplicates[email_id]:
+                        yield json.dumps({'status': 'success', 'email_id': duplicate_id, 'tags': tags, 'duplicate_of': email_id}) + "\n"
+                except Exception as e:
+                    print(f"Error classifying email {email_id}: {str(e)}")
+                    failed += 1 + len(duplicates[email_id])
+                    for failed_id in [email_id] + duplicates[email_id]:
+                        yield json.dumps({'status': 'error', 'email_id': failed_id, 'message': str(e)}) + "\n"
+
+            yield json.dumps({
+                'status': 'done',
+                'classified': classified,
+                'failed': failed,
+                'llm_calls_saved': len(targets) - len(duplicates)
+            }) + "\n"
+        finally:
+            # Let in-flight classifications finish (tags are recorded by the workers,
+            # even if the client disconnected) and sync the log once for the whole batch
+            executor.shutdown(wait=True)
+            if targets:
+                get_mutation_log().flush()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """
@@ -624,11 +1013,13 @@ def chat():
         return jsonify({'error': 'Invalid request. Query and email ID required.'}), 400
     
     query = data['query']
-    email_id = data['email_id']
-    emails = session.get('emails', [])
-    
-    # Find the email by ID
-    email = next((e for i, e in enumerate(emails) if i == email_id), None)
+    try:
+        email_id = int(data['email_id'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid email ID format.'}), 400
+
+    # Find the email by its stable ID
+    email = _EMAILS_BY_ID.get(email_id)
     if not email:
         return jsonify({'error': f'Email with ID {email_id} not found.'}), 404
     
@@ -722,15 +1113,11 @@ def delete_category():
             print(f"Removed category '{category_to_delete}' from .env and session.")
 
         # --- Remove tag from emails in cache --- 
-        updated_email_count = 0
-        for email in _EMAILS_CACHE:
-            if 'tags' in email and category_to_delete in email['tags']:
-                email['tags'].remove(category_to_delete)
-                updated_email_count += 1
+        updated_email_count = sum(1 for email in _EMAILS_CACHE if category_to_delete in email.get('tags', []))
         
         if updated_email_count > 0:
+            record_mutation({'op': 'remove_tag', 'tag': category_to_delete})
             print(f"Removed tag '{category_to_delete}' from {updated_email_count} emails in cache.")
-            save_emails() # Save the changes to the JSON file
         else:
             print(f"Tag '{category_to_delete}' not found on any emails in cache.")
         # --- End tag removal --- 
@@ -747,9 +1134,11 @@ def delete_category():
 @app.route('/process-untagged')
 def process_untagged():
     """Downloads untagged emails and then deletes them."""
-    global _EMAILS_CACHE  # Declare _EMAILS_CACHE as global
-
-    untagged_emails = [email for email in _EMAILS_CACHE if not email['tags']]
+    with _INBOX_LOCK:
+        untagged_emails = [email for email in _EMAILS_CACHE if not email['tags']]
+        if untagged_emails:
+            # Delete the untagged emails
+            record_mutation({'op': 'delete_untagged'})
 
     if untagged_emails:
         # Prepare content for download
@@ -764,9 +1153,6 @@ def process_untagged():
         mem.write(file_content.encode('utf-8'))
         mem.seek(0)
 
-        # Simulate deletion
-        _EMAILS_CACHE = [email for email in _EMAILS_CACHE if email['tags']]
-
         return send_file(
             mem,
             mimetype='text/plain',
@@ -823,17 +1209,61 @@ def create_email():
         if not all(k in email_data for k in ('sender_name', 'sender_email', 'recipients', 'subject', 'content')):
             return jsonify({'error': 'Missing required fields'}), 400
 
-        global _EMAILS_CACHE
         email_data['date'] = datetime.now().strftime('%b %d, %Y %H:%M:%S')
         email_data['tags'] = []
-        _EMAILS_CACHE.insert(0, email_data)  # Insert at the beginning of the list
-
-        save_emails() # Ensure save_emails writes a list to JSON
+        with _INBOX_LOCK:
+            email_data['id'] = _NEXT_EMAIL_ID
+            record_mutation({'op': 'insert', 'email': email_data})  # Inserted at the beginning of the list
         return jsonify({'success': True}), 200
     except Exception as e:
         print(f"Error creating email: {e}")
         return jsonify({'error': str(e)}), 500
 
+# ============ Metrics ============
+
+def collect_app_metrics():
+    """
+    Read the values other modules keep (inbox, search index, tokens, LLM cache,
+    rate limiter) at scrape time, so requests never pay for them.
+    """
+    families = [gauge("emaillm_inbox_emails", "Emails in the inbox", len(_EMAILS_CACHE))]
+    if _SEARCH_INDEX is not None:
+        families.append(gauge("emaillm_search_index_emails", "Emails in the full-text search index", len(_SEARCH_INDEX)))
+
+    tokens = dict(get_token_tracker().total.sums)
+    families.append(counter_family("emaillm_llm_tokens_total", "Tokens used by LLM calls, by type", "type", {
+        'prompt': tokens['prompt_tokens'],
+        'cached_prompt': tokens['cached_prompt_tokens'],
+        'completion': tokens['completion_tokens'],
+    }))
+
+    cache_stats = get_llm_cache().stats()
+    families.append(counter_family("emaillm_llm_cache_lookups_total", "LLM cache lookups by result", "result", {
+        'hit': cache_stats['hits'],
+        'miss': cache_stats['misses'],
+    }))
+    families.append(gauge("emaillm_llm_cache_entries", "Responses in the LLM cache", cache_stats['entries']))
+    families.append(gauge("emaillm_llm_cache_size_bytes", "Size of the cached responses", cache_stats['size_bytes']))
+
+    limiter_stats = get_rate_limiter().stats()
+    families.append(counter_family("emaillm_rate_limiter_events_total", "Throttled responses and retries", "event", {
+        'throttled': limiter_stats['throttled'],
+        'retry': limiter_stats['retries'],
+    }))
+    families.append(gauge("emaillm_rate_limiter_in_flight", "LLM requests in flight", limiter_stats['in_flight']))
+    families.append(gauge("emaillm_rate_limiter_concurrency", "Current LLM concurrency limit", limiter_stats['concurrency']))
+    return families
+
+METRICS.register_collector(collect_app_metrics)
+METRICS.register_collector(latency_stage_collector)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Serve every metric in the Prometheus text exposition format.
+    """
+    return Response(METRICS.render(), content_type=CONTENT_TYPE)
+
 # ============ Main Application Entry ============
 
 if __name__ == '__main__':
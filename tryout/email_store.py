@@ -0,0 +1,242 @@
+"""
+Indexed SQLite store for the inbox.
+
+Holds every email, a tag table and a many-to-many email_tags table, with
+indexes for the queries the UI makes on each page load: folder counts, the
+emails carrying a tag, and the untagged emails. The store is kept in step with
+the in-memory inbox by applying the same mutations that are written to the
+mutation log (see mutation_log.py), and it remembers the sequence number of
+the last one so a restart only rebuilds it when it is out of date.
+"""
+
+import sqlite3
+import threading
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+EMAIL_FIELDS = ('sender_name', 'sender_email', 'recipients', 'reply_to', 'subject', 'date', 'content')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    tag_count INTEGER NOT NULL DEFAULT 0,
+    sender_name TEXT,
+    sender_email TEXT,
+    recipients TEXT,
+    reply_to TEXT,
+    subject TEXT,
+    date TEXT,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_emails_position ON emails(position);
+CREATE INDEX IF NOT EXISTS idx_emails_untagged ON emails(position) WHERE tag_count = 0;
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS email_tags (
+    tag_id INTEGER NOT NULL,
+    email_id INTEGER NOT NULL,
+    PRIMARY KEY (tag_id, email_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_email_tags_email ON email_tags(email_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class EmailStore:
+    """
+    SQLite (WAL mode) email store with a tag index.
+
+    Emails are ordered by `position`; newer emails have higher positions, so
+    listing by position descending matches the newest-first inbox order.
+
+    Args:
+        path: Path of the SQLite database file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    # ---------- Sync with the in-memory inbox ----------
+
+    def is_current(self, seq: int, count: int) -> bool:
+        """
+        Check whether the store reflects the inbox as of mutation `seq`.
+
+        Args:
+            seq: Sequence number of the last applied mutation
+            count: Number of emails in the inbox
+
+        Returns:
+            True if the store does not need to be rebuilt
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+            stored_count = self._conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+        return row is not None and int(row[0]) == seq and stored_count == count
+
+    def rebuild(self, emails: List[Dict[str, Any]], seq: int) -> None:
+        """
+        Replace the store contents with a newest-first list of emails.
+
+        Args:
+            emails: The inbox, newest first, each with a stable 'id'
+            seq: Sequence number of the last mutation reflected in `emails`
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM email_tags")
+            self._conn.execute("DELETE FROM emails")
+            self._conn.execute("DELETE FROM tags")
+            total = len(emails)
+            self._conn.executemany(
+                f"INSERT INTO emails (id, position, {', '.join(EMAIL_FIELDS)}) VALUES ({', '.join('?' * (len(EMAIL_FIELDS) + 2))})",
+                ((email['id'], total - i) + tuple(email.get(field) for field in EMAIL_FIELDS) for i, email in enumerate(emails))
+            )
+            for email in emails:
+                if email.get('tags'):
+                    self._set_tags(email['id'], email['tags'])
+            self._set_seq(seq)
+
+    def apply(self, mutation: Dict[str, Any], seq: int) -> None:
+        """
+        Apply an inbox mutation (the same dictionaries the mutation log records).
+
+        Args:
+            mutation: The mutation to apply
+            seq: Sequence number assigned to the mutation
+        """
+        op = mutation['op']
+        with self._lock, self._conn:
+            if op == 'set_tags':
+                self._set_tags(mutation['id'], mutation['tags'])
+            elif op == 'insert':
+                email = mutation['email']
+                position = self._conn.execute("SELECT COALESCE(MAX(position), 0) + 1 FROM emails").fetchone()[0]
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO emails (id, position, {', '.join(EMAIL_FIELDS)}) VALUES ({', '.join('?' * (len(EMAIL_FIELDS) + 2))})",
+                    (email['id'], position) + tuple(email.get(field) for field in EMAIL_FIELDS)
+                )
+                self._set_tags(email['id'], email.get('tags', []))
+            elif op == 'remove_tag':
+                row = self._conn.execute("SELECT id FROM tags WHERE name = ?", (mutation['tag'],)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE emails SET tag_count = tag_count - 1 WHERE id IN (SELECT email_id FROM email_tags WHERE tag_id = ?)",
+                        (row[0],)
+                    )
+                    self._conn.execute("DELETE FROM email_tags WHERE tag_id = ?", (row[0],))
+            elif op == 'delete_untagged':
+                self._conn.execute("DELETE FROM emails WHERE tag_count = 0")
+            self._set_seq(seq)
+
+    def _set_tags(self, email_id: int, tags: Iterable[str]) -> None:
+        # A set_tags for an email deleted in the meantime must not leave orphaned email_tags rows
+        if self._conn.execute("SELECT 1 FROM emails WHERE id = ?", (email_id,)).fetchone() is None:
+            return
+        tags = list(dict.fromkeys(tags))
+        self._conn.execute("DELETE FROM email_tags WHERE email_id = ?", (email_id,))
+        for tag in tags:
+            self._conn.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
+        self._conn.executemany(
+            "INSERT INTO email_tags (tag_id, email_id) SELECT id, ? FROM tags WHERE name = ?",
+            ((email_id, tag) for tag in tags)
+        )
+        self._conn.execute("UPDATE emails SET tag_count = ? WHERE id = ?", (len(tags), email_id))
+
+    def _set_seq(self, seq: int) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seq', ?)", (str(seq),))
+
+    # ---------- Queries ----------
+
+    def total_count(self) -> int:
+        """Return the number of emails in the store."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+
+    def untagged_count(self) -> int:
+        """Return the number of emails without tags."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM emails WHERE tag_count = 0").fetchone()[0]
+
+    def tag_counts(self) -> Dict[str, int]:
+        """Return the number of emails carrying each tag."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT tags.name, COUNT(*) FROM email_tags JOIN tags ON tags.id = email_tags.tag_id GROUP BY tags.name"
+            ).fetchall()
+        return dict(rows)
+
+    def email_ids(self, tag: Optional[str] = None, untagged: bool = False) -> List[int]:
+        """
+        Return email ids, newest first, optionally filtered by tag.
+
+        Args:
+            tag: Only return emails carrying this tag
+            untagged: Only return emails without tags
+
+        Returns:
+            List of email ids
+        """
+        with self._lock:
+            if untagged:
+                rows = self._conn.execute("SELECT id FROM emails WHERE tag_count = 0 ORDER BY position DESC")
+            elif tag is not None:
+                rows = self._conn.execute(
+                    "SELECT emails.id FROM tags"
+                    " JOIN email_tags ON email_tags.tag_id = tags.id"
+                    " JOIN emails ON emails.id = email_tags.email_id"
+                    " WHERE tags.name = ? ORDER BY emails.position DESC",
+                    (tag,)
+                )
+            else:
+                rows = self._conn.execute("SELECT id FROM emails ORDER BY position DESC")
+            return [row[0] for row in rows.fetchall()]
+
+    def email_page(self, tag: Optional[str] = None, untagged: bool = False,
+                   before: Optional[int] = None, limit: int = 50) -> List[Tuple[int, int]]:
+        """
+        Return one page of emails, newest first, optionally filtered by tag.
+
+        Pages are addressed by position rather than offset, so emails inserted
+        at the top of the inbox do not shift the pages after them.
+
+        Args:
+            tag: Only return emails carrying this tag
+            untagged: Only return emails without tags
+            before: Only return emails with a position below this one
+            limit: Maximum number of emails to return
+
+        Returns:
+            List of (email id, position)
+        """
+        conditions, params = [], []
+        if untagged:
+            conditions.append("emails.tag_count = 0")
+        elif tag is not None:
+            conditions.append("emails.id IN (SELECT email_tags.email_id FROM email_tags JOIN tags ON tags.id = email_tags.tag_id WHERE tags.name = ?)")
+            params.append(tag)
+        if before is not None:
+            conditions.append("emails.position < ?")
+            params.append(before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT emails.id, emails.position FROM emails {where} ORDER BY emails.position DESC LIMIT ?",
+                params + [limit]
+            )
+            return rows.fetchall()
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
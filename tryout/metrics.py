@@ -0,0 +1,231 @@
+"""
+Prometheus metrics for the Flask app, served in the text exposition format.
+
+Counters and histograms are kept in plain dictionaries keyed by label values.
+Recording takes the metric's own lock for one dictionary lookup and a few
+additions and never formats anything, so it adds no measurable time to a
+request. Rendering copies the values under the lock and formats
+them outside it.
+
+Values that other modules already track (token usage, the LLM cache, the
+rate limiter, inbox size) are not duplicated: collectors read them when
+/metrics is scraped.
+
+    REQUESTS = get_metrics_registry().counter(
+        "emaillm_http_requests_total", "HTTP requests", ["route", "method", "status"])
+    REQUESTS.inc("/classify-email", "POST", "200")
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from latency import LatencyHistogram, DEFAULT_BUCKETS
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# A sample: (suffix, label names, label values, value)
+Sample = Tuple[str, Tuple[str, ...], Tuple[str, ...], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    Monotonic counter with labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        """Add `amount` to the series with the given label values."""
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            values = list(self._values.items())
+        return [("", self.labelnames, labelvalues, value) for labelvalues, value in values]
+
+
+class Histogram:
+    """
+    Histogram of durations in seconds with labels, on latency.LatencyHistogram buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labelvalues: str, seconds: float) -> None:
+        """Record one duration for the series with the given label values."""
+        with self._lock:
+            histogram = self._histograms.get(labelvalues)
+            if histogram is None:
+                histogram = self._histograms[labelvalues] = LatencyHistogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        """Time a block as one observation."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labelvalues, seconds=time.perf_counter() - start)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            snapshot = [(labelvalues, histogram.cumulative_counts(), histogram.sum)
+                        for labelvalues, histogram in self._histograms.items()]
+        return histogram_samples(self.labelnames, self.buckets, snapshot)
+
+
+def histogram_samples(labelnames: Tuple[str, ...], buckets: Tuple[float, ...],
+                      snapshot: Iterable[Tuple[Tuple[str, ...], List[int], float]]) -> List[Sample]:
+    """
+    Samples of a histogram family from (label values, cumulative counts, sum) triples.
+    """
+    names = labelnames + ("le",)
+    samples = []
+    for labelvalues, cumulative, total in snapshot:
+        for bound, count in zip(list(buckets) + [math.inf], cumulative):
+            samples.append(("_bucket", names, labelvalues + (_format_value(bound),), count))
+        samples.append(("_sum", labelnames, labelvalues, total))
+        samples.append(("_count", labelnames, labelvalues, cumulative[-1]))
+    return samples
+
+
+class MetricsRegistry:
+    """
+    Metric families and scrape-time collectors, rendered for /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Registering the same name again (e.g. a reloaded module) returns the existing metric
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        """Create (or return) a counter."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        """Create (or return) a histogram of durations in seconds."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]) -> None:
+        """
+        Add a function called at every scrape.
+
+        Args:
+            collector: Returns (name, type, help, samples) tuples for values
+                kept elsewhere, such as token usage or cache sizes
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        families = [(metric.name, metric.kind, metric.documentation, metric.samples()) for metric in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                # A failing collector must not take the whole endpoint down
+                print(f"Error collecting metrics: {e}")
+
+        lines = []
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} " + documentation.replace("\\", "\\\\").replace("\n", "\\n"))
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labelnames, labelvalues, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labelnames, labelvalues)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Return the process-wide metrics registry, creating it on first use.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry()
+    return _registry
+
+
+def gauge(name: str, documentation: str, value: float,
+          labelnames: Tuple[str, ...] = (), labelvalues: Tuple[str, ...] = ()) -> Tuple[str, str, str, List[Sample]]:
+    """A single-sample gauge family, for collectors."""
+    return (name, "gauge", documentation, [("", labelnames, labelvalues, value)])
+
+
+def counter_family(name: str, documentation: str, labelname: str,
+                   values: Dict[str, float]) -> Tuple[str, str, str, List[Sample]]:
+    """A counter family with one label, for collectors."""
+    samples = [("", (labelname,), (label,), value) for label, value in values.items()]
+    return (name, "counter", documentation, samples)
+
+
+def latency_stage_collector() -> List[Tuple[str, str, str, List[Sample]]]:
+    """
+    Export the pipeline stage histograms of latency.py (when EMAILLM_LATENCY is on).
+    """
+    from latency import get_latency_recorder
+    recorder = get_latency_recorder()
+    if not recorder.enabled:
+        return []
+    snapshot = [((stage,), cumulative, total) for stage, cumulative, total in recorder.snapshot()]
+    return [("emaillm_stage_duration_seconds", "histogram", "Duration of each pipeline stage",
+             histogram_samples(("stage",), recorder.buckets, snapshot))]
@@ -0,0 +1,219 @@
+"""
+Append-only mutation log for the inbox.
+
+Instead of rewriting the whole inbox JSON on every change, each mutation
+(tags set, email inserted, tag removed, untagged emails deleted) is appended
+to a JSON-lines log. fsync calls are batched: a background thread syncs the
+log shortly after a burst of writes, or immediately once enough records are
+pending. On startup the log is replayed on top of the last snapshot. Once
+enough records have accumulated, a background compaction writes a new
+snapshot and truncates the log.
+
+A small meta file records which log sequence number a snapshot reflects,
+together with the snapshot's SHA-256. It is written before the snapshot is
+replaced. If a crash happens between the two writes, the hash no longer
+matches and replay falls back to the previous snapshot's sequence number, so
+no record is ever applied twice.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Dict, Any, Iterator, Optional
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class MutationLog:
+    """
+    JSON-lines mutation log with batched fsync and background compaction.
+
+    Args:
+        path: Path of the log file
+        fsync_interval: Seconds to wait before syncing a burst of appends
+        fsync_batch: Number of pending appends that forces an immediate sync
+        compact_every: Number of records after which compaction is triggered
+        compact: Callback that writes a snapshot (normally via write_snapshot)
+    """
+
+    def __init__(self, path: str, fsync_interval: float = 0.05, fsync_batch: int = 64,
+                 compact_every: int = 1000, compact: Optional[Callable[[], None]] = None):
+        self.path = path
+        self.meta_path = path + ".meta"
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.compact_every = compact_every
+        self._compact = compact
+
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._pending = 0
+        self._dirty = threading.Event()
+        self._compact_requested = threading.Event()
+        self._closed = False
+
+        self._meta = self._read_meta()
+        self.base_seq = self._meta.get("seq", 0)
+        self.last_seq = self.base_seq
+        self.records = 0
+        for record in self._read_records():
+            self.last_seq = max(self.last_seq, record["seq"])
+            self.records += 1
+
+        self._file = open(self.path, 'a', encoding='utf-8')
+        threading.Thread(target=self._flush_loop, name="mutation-log-fsync", daemon=True).start()
+        if self._compact is not None:
+            threading.Thread(target=self._compact_loop, name="mutation-log-compact", daemon=True).start()
+        atexit.register(self.close)
+
+    def _read_meta(self) -> Dict[str, Any]:
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _read_records(self) -> Iterator[Dict[str, Any]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final write from a crash; everything after it is lost anyway
+                        print(f"Ignoring corrupt record at end of {self.path}")
+                        return
+        except FileNotFoundError:
+            return
+
+    def replay(self, snapshot_bytes: Optional[bytes]) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the logged mutations that are not yet reflected in a snapshot.
+
+        Args:
+            snapshot_bytes: Raw contents of the snapshot that was loaded
+
+        Returns:
+            Iterator over mutation records, in order
+        """
+        base_seq = 0
+        if self._meta:
+            digest = hashlib.sha256(snapshot_bytes).hexdigest() if snapshot_bytes is not None else None
+            if digest == self._meta.get("sha256"):
+                base_seq = self._meta.get("seq", 0)
+            else:
+                base_seq = self._meta.get("previous_seq", 0)
+        self.base_seq = base_seq
+        for record in self._read_records():
+            if record["seq"] > base_seq:
+                yield record
+
+    def append(self, mutation: Dict[str, Any]) -> int:
+        """
+        Append a mutation to the log. The write is O(1); the fsync is batched.
+
+        Args:
+            mutation: JSON-serializable mutation, e.g. {"op": "set_tags", ...}
+
+        Returns:
+            The sequence number assigned to the mutation
+        """
+        with self._lock:
+            self.last_seq += 1
+            record = dict(mutation, seq=self.last_seq)
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            self.records += 1
+            self._pending += 1
+            if self._pending >= self.fsync_batch:
+                self._sync_locked()
+            else:
+                self._dirty.set()
+            if self._compact is not None and self.records >= self.compact_every:
+                self._compact_requested.set()
+            return self.last_seq
+
+    def _sync_locked(self) -> None:
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+
+    def flush(self) -> None:
+        """Force pending appends to disk."""
+        with self._lock:
+            if not self._closed:
+                self._sync_locked()
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._dirty.wait()
+            self._dirty.clear()
+            # Give concurrent writers a moment to join this fsync
+            threading.Event().wait(self.fsync_interval)
+            self.flush()
+
+    def _compact_loop(self) -> None:
+        while not self._closed:
+            self._compact_requested.wait()
+            self._compact_requested.clear()
+            if self._closed:
+                return
+            try:
+                self._compact()
+            except Exception as e:
+                print(f"Error compacting mutation log {self.path}: {e}")
+
+    def write_snapshot(self, snapshot_path: str, snapshot_bytes: bytes, seq: int) -> None:
+        """
+        Atomically replace the snapshot and drop the log records it covers.
+
+        Args:
+            snapshot_path: Path of the snapshot file
+            snapshot_bytes: Serialized inbox state as of `seq`
+            seq: Sequence number of the last mutation reflected in the snapshot
+        """
+        with self._snapshot_lock:
+            meta = {
+                "seq": seq,
+                "sha256": hashlib.sha256(snapshot_bytes).hexdigest(),
+                "previous_seq": self.base_seq
+            }
+            _atomic_write(self.meta_path, json.dumps(meta).encode('utf-8'))
+            _atomic_write(snapshot_path, snapshot_bytes)
+            self._meta = meta
+            self.base_seq = seq
+            self._truncate(seq)
+
+    def _truncate(self, seq: int) -> None:
+        # Records appended while the snapshot was being written are kept
+        with self._lock:
+            self._sync_locked()
+            remaining = [record for record in self._read_records() if record["seq"] > seq]
+            data = "".join(json.dumps(record) + "\n" for record in remaining)
+            self._file.close()
+            _atomic_write(self.path, data.encode('utf-8'))
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self.records = len(remaining)
+
+    def close(self) -> None:
+        """Sync and close the log."""
+        with self._lock:
+            if self._closed:
+                return
+            self._sync_locked()
+            self._closed = True
+            self._file.close()
+        self._dirty.set()
+        self._compact_requested.set()
@@ -0,0 +1,324 @@
+"""
+Ranked full-text search over the inbox.
+
+An in-process inverted index with BM25 ranking. Subject and sender matches are
+boosted over body matches, and quoted phrases ("career fair") must appear
+verbatim within a single field. The index is updated incrementally as emails
+are created or deleted, and it is persisted to disk so a restart does not
+have to re-tokenize the whole inbox.
+
+Postings are kept in compact `array` buffers (one doc-slot array and one
+term-frequency array per term). At query time they are scored as NumPy views
+without copying, so queries stay in the millisecond range on large inboxes.
+NumPy is imported on the first query.
+"""
+
+import math
+import os
+import pickle
+import re
+import threading
+from array import array
+from typing import Dict, Any, List, Optional, Tuple
+
+# Fields are indexed in this order; per-field weights are applied to term frequencies
+FIELD_BOOSTS = (('subject', 3.0), ('sender', 2.0), ('content', 1.0))
+
+# Separates fields in a document's token sequence so phrases cannot span fields
+FIELD_SEPARATOR = -1
+
+INDEX_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"\w+")
+PHRASE_PATTERN = re.compile(r'"([^"]*)"')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase a string and split it into word tokens."""
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+def email_fields(email: Dict[str, Any]) -> List[str]:
+    """Return the searchable text of an email, in FIELD_BOOSTS order."""
+    sender = f"{email.get('sender_name') or ''} {email.get('sender_email') or ''}"
+    return [email.get('subject') or '', sender, email.get('content') or '']
+
+
+class SearchIndex:
+    """
+    Incrementally updated BM25 inverted index keyed by email id.
+
+    Args:
+        k1: BM25 term-frequency saturation
+        b: BM25 length normalization
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.seq = 0
+        self._lock = threading.Lock()
+        self._vocab: Dict[str, int] = {}
+        self._postings_slots: List[array] = []
+        self._postings_tf: List[array] = []
+        self._slot_email_ids = array('q')
+        self._slot_lengths = array('f')
+        self._slot_alive = bytearray()
+        self._slot_tokens: List[Optional[array]] = []
+        self._slots: Dict[int, int] = {}
+        self._total_length = 0.0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    # ---------- Updates ----------
+
+    def add(self, email: Dict[str, Any]) -> None:
+        """
+        Index an email (replacing any previous version with the same id).
+
+        Args:
+            email: Email dictionary with a stable 'id'
+        """
+        with self._lock:
+            if email['id'] in self._slots:
+                self._remove_locked(email['id'])
+            field_term_ids = []
+            for text in email_fields(email):
+                term_ids = []
+                for term in tokenize(text):
+                    term_id = self._vocab.get(term)
+                    if term_id is None:
+                        term_id = len(self._vocab)
+                        self._vocab[term] = term_id
+                        self._postings_slots.append(array('i'))
+                        self._postings_tf.append(array('f'))
+                    term_ids.append(term_id)
+                field_term_ids.append(term_ids)
+            self._add_locked(email['id'], field_term_ids)
+
+    def _add_locked(self, email_id: int, field_term_ids: List[List[int]]) -> None:
+        slot = len(self._slot_email_ids)
+        weighted_tf: Dict[int, float] = {}
+        length = 0.0
+        tokens = array('i')
+        for (_, boost), term_ids in zip(FIELD_BOOSTS, field_term_ids):
+            for term_id in term_ids:
+                weighted_tf[term_id] = weighted_tf.get(term_id, 0.0) + boost
+            length += boost * len(term_ids)
+            tokens.extend(term_ids)
+            tokens.append(FIELD_SEPARATOR)
+        for term_id, tf in weighted_tf.items():
+            self._postings_slots[term_id].append(slot)
+            self._postings_tf[term_id].append(tf)
+        self._slot_email_ids.append(email_id)
+        self._slot_lengths.append(length)
+        self._slot_alive.append(1)
+        self._slot_tokens.append(tokens)
+        self._slots[email_id] = slot
+        self._total_length += length
+
+    def remove(self, email_id: int) -> None:
+        """
+        Remove an email from the index. Postings are tombstoned and reclaimed
+        once enough of the index is dead.
+
+        Args:
+            email_id: Id of the email to remove
+        """
+        with self._lock:
+            self._remove_locked(email_id)
+            dead = len(self._slot_email_ids) - len(self._slots)
+            if dead > 1000 and dead > len(self._slots):
+                self._compact_locked()
+
+    def _remove_locked(self, email_id: int) -> None:
+        slot = self._slots.pop(email_id, None)
+        if slot is None:
+            return
+        self._slot_alive[slot] = 0
+        self._slot_tokens[slot] = None
+        self._total_length -= self._slot_lengths[slot]
+
+    def _compact_locked(self) -> None:
+        live = sorted(self._slots.values())
+        tokens = [self._slot_tokens[slot] for slot in live]
+        email_ids = [self._slot_email_ids[slot] for slot in live]
+        self._postings_slots = [array('i') for _ in self._vocab]
+        self._postings_tf = [array('f') for _ in self._vocab]
+        self._slot_email_ids = array('q')
+        self._slot_lengths = array('f')
+        self._slot_alive = bytearray()
+        self._slot_tokens = []
+        self._slots = {}
+        self._total_length = 0.0
+        for email_id, token_ids in zip(email_ids, tokens):
+            fields, current = [], []
+            for term_id in token_ids:
+                if term_id == FIELD_SEPARATOR:
+                    fields.append(current)
+                    current = []
+                else:
+                    current.append(term_id)
+            self._add_locked(email_id, fields)
+
+    def rebuild(self, emails: List[Dict[str, Any]], seq: int) -> None:
+        """
+        Replace the index contents with the given emails.
+
+        Args:
+            emails: Emails to index, each with a stable 'id'
+            seq: Sequence number of the last mutation reflected in `emails`
+        """
+        self.__init__(self.k1, self.b)
+        # Oldest first, so slot order follows email age
+        for email in reversed(emails):
+            self.add(email)
+        self.seq = seq
+
+    # ---------- Queries ----------
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Search the index.
+
+        Bare words match if any of them occurs (ranked by BM25); every quoted
+        phrase must occur verbatim within one field.
+
+        Args:
+            query: Query string, e.g. 'internship "career fair"'
+            limit: Maximum number of results, or None for all matches
+
+        Returns:
+            List of (email id, score), best match first
+        """
+        import numpy as np
+
+        phrases = [tokenize(phrase) for phrase in PHRASE_PATTERN.findall(query)]
+        phrases = [phrase for phrase in phrases if phrase]
+        terms = tokenize(PHRASE_PATTERN.sub(' ', query)) + [term for phrase in phrases for term in phrase]
+
+        with self._lock:
+            if not terms or not self._slots:
+                return []
+            phrase_ids = []
+            for phrase in phrases:
+                if any(term not in self._vocab for term in phrase):
+                    return []
+                phrase_ids.append([self._vocab[term] for term in phrase])
+            term_ids = {self._vocab[term] for term in terms if term in self._vocab}
+            if not term_ids:
+                return []
+
+            alive = np.frombuffer(self._slot_alive, dtype=np.bool_)
+            lengths = np.frombuffer(self._slot_lengths, dtype=np.float32)
+            live_docs = len(self._slots)
+            average_length = self._total_length / live_docs if live_docs else 1.0
+            scores = np.zeros(len(alive), dtype=np.float32)
+            for term_id in term_ids:
+                slots = np.frombuffer(self._postings_slots[term_id], dtype=np.int32)
+                tf = np.frombuffer(self._postings_tf[term_id], dtype=np.float32)
+                df = int(alive[slots].sum())
+                if df == 0:
+                    continue
+                idf = math.log(1 + (live_docs - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[slots] / average_length)
+                # Slots are unique within a posting list, so fancy-index += is safe
+                scores[slots] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            candidates = alive & (scores > 0)
+            for ids in phrase_ids:
+                for term_id in set(ids):
+                    has_term = np.zeros(len(alive), dtype=np.bool_)
+                    has_term[np.frombuffer(self._postings_slots[term_id], dtype=np.int32)] = True
+                    candidates &= has_term
+            matches = np.nonzero(candidates)[0]
+            if len(matches) == 0:
+                return []
+
+            match_scores = scores[matches]
+            if not phrase_ids:
+                order = self._top(matches, match_scores, limit)
+            else:
+                # Verify phrases best-first so a limited query can stop early;
+                # most limited queries are answered from the first few candidates
+                needles = [array('i', ids).tobytes() for ids in phrase_ids]
+                order = []
+                for pool in ([limit * 4, None] if limit is not None else [None]):
+                    candidates = self._top(matches, match_scores, pool)
+                    order = []
+                    for i in candidates:
+                        if self._contains_phrases(matches[i], needles):
+                            order.append(i)
+                            if limit is not None and len(order) >= limit:
+                                break
+                    if len(order) == limit or len(candidates) == len(matches):
+                        break
+            return [(int(self._slot_email_ids[matches[i]]), float(match_scores[i])) for i in order]
+
+    @staticmethod
+    def _top(matches, match_scores, limit: Optional[int]):
+        """Positions of the best `limit` matches, best score first; ties go to the newer email."""
+        import numpy as np
+
+        if limit is not None and limit < len(matches):
+            # Everything scoring above the cutoff, then the newest of the ties at it
+            cutoff = np.partition(match_scores, len(matches) - limit)[len(matches) - limit]
+            above = np.nonzero(match_scores > cutoff)[0]
+            tied = np.nonzero(match_scores == cutoff)[0]
+            top = np.concatenate([above, tied[np.argsort(-matches[tied], kind='stable')][:limit - len(above)]])
+            return top[np.lexsort((-matches[top], -match_scores[top]))]
+        return np.lexsort((-matches, -match_scores))
+
+    def _contains_phrases(self, slot: int, needles: List[bytes]) -> bool:
+        haystack = self._slot_tokens[slot].tobytes()
+        for needle in needles:
+            position = haystack.find(needle)
+            # Only matches aligned to a whole token count
+            while position != -1 and position % 4:
+                position = haystack.find(needle, position + 1)
+            if position == -1:
+                return False
+        return True
+
+    # ---------- Persistence ----------
+
+    def save(self, path: str) -> None:
+        """
+        Write the index to disk atomically.
+
+        Args:
+            path: Destination file
+        """
+        with self._lock:
+            state = {key: value for key, value in self.__dict__.items() if key != '_lock'}
+            data = pickle.dumps((INDEX_VERSION, state), protocol=pickle.HIGHEST_PROTOCOL)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["SearchIndex"]:
+        """
+        Load an index written by save().
+
+        Args:
+            path: File to load
+
+        Returns:
+            The index, or None if the file is missing or unreadable
+        """
+        try:
+            with open(path, 'rb') as f:
+                version, state = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Ignoring unreadable search index {path}: {e}")
+            return None
+        if version != INDEX_VERSION:
+            return None
+        index = cls.__new__(cls)
+        index.__dict__.update(state)
+        index._lock = threading.Lock()
+        return index
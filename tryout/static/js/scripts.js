@@ -1,5 +1,14 @@
-// Current selected email
-let currentEmailId = 0;
+// Current selected email (stable email id)
+let currentEmailId = initialEmails && initialEmails.length > 0 ? initialEmails[0].id : null;
+
+// Emails loaded so far, by id. List pages only carry headers and a snippet;
+// the full email is fetched from /api/emails/<id> when it is opened.
+const loadedEmails = {};
+(initialEmails || []).forEach(email => { loadedEmails[email.id] = email; });
+
+// Cursor for the next page of the email list (null when there are no more)
+let nextEmailCursor = null;
+let loadingMoreEmails = false;
 
 // Global map to store colors for category names
 const categoryColors = {};
@@ -33,8 +42,8 @@ function showNotification(message, type) {
 function selectEmail(emailId) {
     console.log(`Selecting email with ID: ${emailId}`); // Log selection
 
-    if (!initialEmails || emailId < 0 || emailId >= initialEmails.length) {
-        console.error(`Invalid emailId: ${emailId} or initialEmails not loaded properly.`);
+    if (!loadedEmails[emailId]) {
+        console.error(`Invalid emailId: ${emailId} or emails not loaded properly.`);
         return;
     }
 
@@ -55,7 +64,7 @@ function selectEmail(emailId) {
     }
     
     // Get email data
-    const email = initialEmails[emailId];
+    const email = loadedEmails[emailId];
     console.log("Selected email data:", email); // Log email data
     
     // Update details pane elements safely
@@ -70,7 +79,22 @@ function selectEmail(emailId) {
     if (senderNameEl) senderNameEl.textContent = email.sender_name || email.sender_email || 'No Sender'; 
     if (toEl) toEl.textContent = email.recipients || 'No Recipients';
     if (dateEl) dateEl.textContent = email.date || 'No Date';
-    if (contentEl) contentEl.innerHTML = email.content || 'No Content'; // Use innerHTML if content can be HTML
+    if (contentEl) {
+        if (email.content !== undefined) {
+            contentEl.innerHTML = email.content || 'No Content'; // Use innerHTML if content can be HTML
+        } else {
+            // Only headers are loaded yet; fetch the full email
+            contentEl.innerHTML = '<p class="text-muted">Loading...</p>';
+            fetchFullEmail(emailId).then(fullEmail => {
+                if (currentEmailId !== emailId) return; // Another email was opened meanwhile
+                if (toEl) toEl.textContent = fullEmail.recipients || 'No Recipients';
+                contentEl.innerHTML = fullEmail.content || 'No Content';
+            }).catch(error => {
+                console.error(`Error loading email ${emailId}:`, error);
+                if (currentEmailId === emailId) contentEl.innerHTML = '<p class="text-danger">Could not load this email.</p>';
+            });
+        }
+    }
     
     // Clear chat messages
     const chatMessagesEl = document.getElementById('chat-messages');
@@ -91,6 +115,149 @@ function selectEmail(emailId) {
     }
 }
 
+// Fetch the full email (including its body) and remember it
+async function fetchFullEmail(emailId) {
+    const response = await fetch(`/api/emails/${emailId}`);
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    const fullEmail = await response.json();
+    // Keep tags that were updated client-side since the list was loaded
+    loadedEmails[emailId] = Object.assign(fullEmail, { tags: loadedEmails[emailId] ? loadedEmails[emailId].tags : fullEmail.tags });
+    return loadedEmails[emailId];
+}
+
+// Escape text for insertion into HTML
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text == null ? '' : String(text);
+    return div.innerHTML;
+}
+
+// Build an email list item (same markup as the server-rendered list)
+function renderEmailItem(email) {
+    const dateParts = (email.date || '').split(' ');
+    const tagsHtml = (email.tags || []).map(tag => `
+        <span class="tag tag-${escapeHtml(tag.replace(/\s+/g, '-').toLowerCase())}">
+           ${getTagIcon(tag)} ${escapeHtml(tag)}
+        </span>
+    `).join('');
+
+    const emailItem = document.createElement('div');
+    emailItem.className = 'email-item clickable';
+    emailItem.setAttribute('data-id', email.id);
+    emailItem.setAttribute('role', 'button');
+    emailItem.setAttribute('tabindex', '0');
+    emailItem.onclick = () => selectEmail(email.id);
+    emailItem.innerHTML = `
+        <div class="email-select">
+            <input type="checkbox" onclick="event.stopPropagation();">
+        </div>
+        <div class="email-sender">${escapeHtml(email.sender_name || email.sender_email)}</div>
+        <div class="email-date">${escapeHtml((dateParts[1] || '') + ' ' + dateParts[0])}</div>
+        <div class="email-subject">${escapeHtml(email.subject)}</div>
+        <div class="email-preview">${escapeHtml(email.snippet)}</div>
+        ${tagsHtml ? `<div class="email-tags">${tagsHtml}</div>` : ''}
+    `;
+    applyColorsToTags(emailItem.querySelector('.email-tags'));
+    return emailItem;
+}
+
+// Fetch the next page of the email list and append it
+async function loadMoreEmails() {
+    const emailList = document.querySelector('.email-list');
+    const sentinel = document.getElementById('email-list-sentinel');
+    if (!nextEmailCursor || loadingMoreEmails || !emailList) return;
+
+    loadingMoreEmails = true;
+    try {
+        const params = new URLSearchParams({ cursor: nextEmailCursor, limit: emailListQuery.limit });
+        if (emailListQuery.keyword) params.set('keyword', emailListQuery.keyword);
+        if (emailListQuery.q) params.set('q', emailListQuery.q);
+
+        const response = await fetch(`/api/emails?${params.toString()}`);
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || `HTTP ${response.status}`);
+        }
+
+        data.emails.forEach(email => {
+            if (loadedEmails[email.id]) return; // Already listed
+            loadedEmails[email.id] = email;
+            emailList.appendChild(renderEmailItem(email));
+        });
+        nextEmailCursor = data.next_cursor;
+    } catch (error) {
+        console.error("Error loading more emails:", error);
+        showNotification('Error loading more emails.', 'error');
+        nextEmailCursor = null;
+    } finally {
+        loadingMoreEmails = false;
+        if (sentinel && !nextEmailCursor) sentinel.textContent = '';
+    }
+}
+
+// Load further pages as the end of the email list scrolls into view
+function initEmailListPaging() {
+    const sentinel = document.getElementById('email-list-sentinel');
+    if (!sentinel) return;
+    nextEmailCursor = sentinel.getAttribute('data-next-cursor') || null;
+    if (!nextEmailCursor) return;
+
+    if ('IntersectionObserver' in window) {
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadMoreEmails().then(() => {
+                    if (!nextEmailCursor) observer.disconnect();
+                });
+            }
+        });
+        observer.observe(sentinel);
+    } else {
+        sentinel.textContent = 'Load more';
+        sentinel.classList.add('clickable');
+        sentinel.addEventListener('click', loadMoreEmails);
+    }
+}
+
+// Render classification tags on an email list item and update client-side data
+function renderEmailTags(emailItem, emailId, tags) {
+    if (tags.length > 0) {
+        let tagsHtml = '';
+        tags.forEach(tag => {
+            tagsHtml += `
+                <span class="tag tag-${tag.replace(/\s+/g, '-').toLowerCase()}">
+                   ${getTagIcon(tag)} ${tag}
+                </span>
+            `;
+        });
+        
+        let tagsElement = emailItem.querySelector('.email-tags');
+        if (!tagsElement) {
+            tagsElement = document.createElement('div');
+            tagsElement.className = 'email-tags';
+            const previewElement = emailItem.querySelector('.email-preview');
+            if (previewElement) {
+                 previewElement.insertAdjacentElement('afterend', tagsElement);
+            } else {
+                emailItem.appendChild(tagsElement);
+            }
+        }
+        tagsElement.innerHTML = tagsHtml;
+        applyColorsToTags(tagsElement); // Apply colors to the new tags
+    } else {
+        // Handle case where classification is successful but finds no tags
+        let tagsElement = emailItem.querySelector('.email-tags');
+        if (tagsElement) tagsElement.innerHTML = '<span class="text-muted small">No relevant tags found.</span>';
+    }
+    
+    // Update client-side data store
+    if (loadedEmails[emailId]) {
+        loadedEmails[emailId].tags = tags;
+        console.log(`Updated loadedEmails[${emailId}] tags:`, tags);
+    }
+}
+
 // Function to classify a specific email by its ID
 async function classifyEmailById(emailId) {
     console.log(`Attempting to classify email ID: ${emailId}`);
@@ -124,52 +291,9 @@ async function classifyEmailById(emailId) {
         emailItem.classList.remove('classifying'); // Remove loading state
 
         if (data.status === 'success') {
-            let tagsHtml = '';
-            if (data.tags && data.tags.length > 0) {
-                tagsHtml = ''; // Start fresh for the tags div content
-                data.tags.forEach(tag => {
-                    // Use getTagIcon helper if you want icons here too
-                    tagsHtml += `
-                        <span class="tag tag-${tag.replace(/\s+/g, '-').toLowerCase()}">
-                           ${getTagIcon(tag)} ${tag}
-                        </span>
-                    `;
-                });
-                
-                let tagsElement = emailItem.querySelector('.email-tags');
-                if (!tagsElement) {
-                    tagsElement = document.createElement('div');
-                    tagsElement.className = 'email-tags';
-                    const previewElement = emailItem.querySelector('.email-preview');
-                    if (previewElement) {
-                         previewElement.insertAdjacentElement('afterend', tagsElement);
-                    } else {
-                        emailItem.appendChild(tagsElement);
-                    }
-                }
-                tagsElement.innerHTML = tagsHtml;
-                applyColorsToTags(tagsElement); // Apply colors to the new tags
-                
-                // Update client-side data store
-                if (initialEmails[emailId]) {
-                    initialEmails[emailId].tags = data.tags;
-                    console.log(`Updated initialEmails[${emailId}] tags:`, initialEmails[emailId].tags);
-                }
-                
-                return { status: 'success', emailId: emailId, tags: data.tags };
-            } else {
-                // Handle case where classification is successful but finds no tags
-                 let tagsElement = emailItem.querySelector('.email-tags');
-                 if (tagsElement) tagsElement.innerHTML = '<span class="text-muted small">No relevant tags found.</span>'; // Clear or update UI
-                 
-                 // Update client-side data store (empty tags)
-                 if (initialEmails[emailId]) {
-                    initialEmails[emailId].tags = [];
-                     console.log(`Updated initialEmails[${emailId}] tags to empty`);
-                 }
-                 
-                 return { status: 'success', emailId: emailId, tags: [] };
-            }
+            const tags = data.tags || [];
+            renderEmailTags(emailItem, emailId, tags);
+            return { status: 'success', emailId: emailId, tags: tags };
         } else {
             // Handle classification error for this specific email
              let tagsElement = emailItem.querySelector('.email-tags');
@@ -186,6 +310,67 @@ async function classifyEmailById(emailId) {
     }
 }
 
+// Classify several emails with one /classify-batch request. The server streams
+// back one JSON line per email as each classification finishes.
+async function classifyEmailBatch(emailIds) {
+    emailIds.forEach(id => {
+        const emailItem = document.querySelector(`.email-item[data-id="${id}"]`);
+        if (emailItem) emailItem.classList.add('classifying');
+    });
+
+    let successfulCount = 0;
+    let failedCount = 0;
+    const handleResult = (result) => {
+        if (result.status === 'done') return;
+        const emailItem = document.querySelector(`.email-item[data-id="${result.email_id}"]`);
+        if (emailItem) emailItem.classList.remove('classifying');
+        if (result.status === 'success') {
+            successfulCount++;
+            if (emailItem) renderEmailTags(emailItem, result.email_id, result.tags || []);
+        } else {
+            failedCount++;
+            console.error(`Classification failed for email ${result.email_id}: ${result.message}`);
+            const tagsElement = emailItem ? emailItem.querySelector('.email-tags') : null;
+            if (tagsElement) tagsElement.innerHTML = '<span class="text-danger small">Classification failed.</span>';
+        }
+    };
+
+    try {
+        const response = await fetch('/classify-batch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ email_ids: emailIds }),
+        });
+
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.error || data.message || `HTTP ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop(); // Keep any partial line for the next chunk
+            lines.filter(line => line.trim()).forEach(line => handleResult(JSON.parse(line)));
+        }
+        if (buffer.trim()) handleResult(JSON.parse(buffer));
+    } finally {
+        emailIds.forEach(id => {
+            const emailItem = document.querySelector(`.email-item[data-id="${id}"]`);
+            if (emailItem) emailItem.classList.remove('classifying');
+        });
+    }
+
+    return { successfulCount, failedCount };
+}
+
 // Classify *currently selected* email function (now uses the refactored function)
 function classifyCurrentEmail() {
     const resultElement = document.getElementById('classification-result'); // Detail pane result area
@@ -537,13 +722,13 @@ function initCategoryManagement() {
                     }
                 });
                 
-                // Update the initialEmails array to reflect the change
-                initialEmails.forEach(email => {
+                // Update the loaded emails to reflect the change
+                Object.values(loadedEmails).forEach(email => {
                     if (email.tags && email.tags.includes(categoryToDelete)) {
                         email.tags = email.tags.filter(tag => tag !== categoryToDelete);
                     }
                 });
-                console.log("initialEmails updated after tag removal.");
+                console.log("loadedEmails updated after tag removal.");
 
                 // If the currently selected email was affected, update the details pane? (Optional)
                 // This is complex as details pane might not directly show tags
@@ -742,6 +927,12 @@ document.addEventListener('DOMContentLoaded', function() {
     // Debug logs for initialization
     console.log("DOM fully loaded");
     console.log("Initial emails data:", initialEmails ? initialEmails.length : "Not loaded");
+
+    // Open the first email (its body is not part of the page) and enable paging
+    if (currentEmailId !== null) {
+        selectEmail(currentEmailId);
+    }
+    initEmailListPaging();
     
     // Add a document-level click handler (keep for debugging if needed)
     // document.addEventListener('click', function(event) { ... });
@@ -919,19 +1110,8 @@ document.addEventListener('DOMContentLoaded', function() {
             this.disabled = true; // Disable button during processing
             this.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Classifying...';
 
-            console.log("Mapping classification promises..."); // <-- Log before promises
-            const classificationPromises = emailIdsToClassify.map(id => {
-                 console.log(`Creating promise for ID: ${id}`); // <-- Log each ID being mapped
-                 return classifyEmailById(id);
-            });
-            
             try {
-                console.log("Awaiting Promise.allSettled..."); // <-- Log before await
-                const results = await Promise.allSettled(classificationPromises);
-                console.log("Promise.allSettled finished. Results:", results); // <-- Log results
-                
-                const successfulCount = results.filter(r => r.status === 'fulfilled' && r.value.status === 'success').length;
-                const failedCount = results.length - successfulCount;
+                const { successfulCount, failedCount } = await classifyEmailBatch(emailIdsToClassify);
                 
                 let message = `Batch classification complete. ${successfulCount} successful`;
                 if (failedCount > 0) {
@@ -940,10 +1120,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 } else {
                     showNotification(message, 'success');
                 }
-                console.log("Batch classification results:", results);
 
             } catch (error) {
-                // This catch is unlikely with Promise.allSettled but good practice
                 console.error("Error during batch classification execution:", error);
                 showNotification('An unexpected error occurred during batch classification.', 'error');
             } finally {
@@ -998,8 +1176,8 @@ async function handleUntagClick() {
             if (tagsContainer) {
                 tagsContainer.innerHTML = '';
             }
-            if (initialEmails[currentEmailId]) {
-                initialEmails[currentEmailId].tags = [];
+            if (loadedEmails[currentEmailId]) {
+                loadedEmails[currentEmailId].tags = [];
             }
         } else {
             showNotification(`Untag failed: ${data.message}`, 'error');
@@ -1039,23 +1217,12 @@ async function handleDeleteClick() {
             if (data.status === 'success') {
                 showNotification('Email deleted.', 'success');
                 const emailItem = document.querySelector(`.email-item[data-id="${currentEmailId}"]`);
+                // Email ids are stable, so the remaining items keep theirs
+                const nextItem = emailItem ? (emailItem.nextElementSibling || emailItem.previousElementSibling) : null;
                 if (emailItem) {
                     emailItem.remove();
                 }
-                const deletedIndex = currentEmailId; // Store index before splicing
-                initialEmails.splice(deletedIndex, 1);
-                console.log(`Removed email at index ${deletedIndex} from initialEmails`);
-                
-                // Update data-id and onclick for subsequent items
-                document.querySelectorAll('.email-item').forEach(item => {
-                    let currentId = parseInt(item.getAttribute('data-id'), 10);
-                    if (currentId > deletedIndex) {
-                        let newIndex = currentId - 1;
-                        item.setAttribute('data-id', newIndex);
-                        // Re-attach listener correctly (avoiding direct onclick if possible)
-                        item.onclick = () => selectEmail(newIndex); 
-                    }
-                 });
+                delete loadedEmails[currentEmailId];
                 
                 // Clear details or select next
                 const detailsSubjectEl = document.getElementById('email-subject');
@@ -1075,14 +1242,9 @@ async function handleDeleteClick() {
                 if (chatMessagesEl) chatMessagesEl.innerHTML = ''; 
                 
                 currentEmailId = null; 
-                 if (document.querySelectorAll('.email-item').length > 0) {
-                     // Select the email that is now at the deleted index, or the last one if deleting last
-                     let nextIndex = Math.min(deletedIndex, initialEmails.length - 1);
-                     if (nextIndex >= 0) {
-                        selectEmail(nextIndex); 
-                     } else {
-                        // Handle case where list becomes empty - clear details further?
-                     }
+                 if (nextItem && nextItem.classList.contains('email-item')) {
+                     // Select the email that took the deleted one's place, or the previous one if deleting last
+                     selectEmail(parseInt(nextItem.getAttribute('data-id'), 10));
                  } else {
                      // Handle empty list case
                  }
@@ -1097,4 +1259,4 @@ async function handleDeleteClick() {
         }
     }
 }
-// --- End Action Button Handlers ---
\ No newline at end of file
+// --- End Action Button Handlers ---
\ No newline at end of file